@@ -22,6 +22,100 @@ BADGE_PAGE_SIZE = 50
 # Max # of items shown on home page recent sections
 MAX_RECENT = 15
 
+# Max # of claim codes generated at once from the badge detail page
+MAX_GENERATE_AMOUNT = 10000
+
+# Seconds to keep sets of awarded badge IDs per user in Django's cache, on
+# top of the per-request cache. 0 disables.
+AWARDED_CACHE_TIMEOUT = 0
+
+# Seconds to buffer Progress counter increments in memory before writing them
+# in one batch. Buffers are also written at the end of each request. 0 writes
+# every increment immediately.
+PROGRESS_FLUSH_INTERVAL = 0
+
+# Leave award side effects (baking, signals, notifications, claim emails,
+# prerequisite cascades) to the badger_worker command, via an outbox table
+ASYNC_SIDE_EFFECTS = False
+
+# Outbox messages handled by badger_worker per batch, and worker threads
+WORKER_BATCH_SIZE = 100
+WORKER_THREADS = 4
+
+# Seconds an outbox message stays leased to a worker before another may
+# take it, and seconds before retrying a failure (doubled for each attempt)
+OUTBOX_LEASE = 300
+OUTBOX_RETRY_DELAY = 60
+
+# Attempts at an outbox message before giving up on it
+OUTBOX_MAX_ATTEMPTS = 5
+
+# Claim invitation emails sent per batch over one mail connection, and the
+# most messages sent per second. 0 sends as fast as the mail backend allows.
+MAIL_BATCH_SIZE = 100
+MAIL_RATE_LIMIT = 0
+
+# Send badge_was_awarded for each award, as well as badges_were_awarded for
+# each batch. False sends only the batches.
+PER_AWARD_SIGNALS = True
+
+# Time receivers of badger signals, see badger.stats, and log any taking
+# longer than the threshold in seconds. 0 logs none.
+SIGNAL_STATS = False
+SIGNAL_SLOW_THRESHOLD = 0
+
+# Seconds between each process adding its signal and cache statistics to the
+# shared totals in Django's cache, at the end of a request
+STATS_PUBLISH_INTERVAL = 30
+
+# Seconds to keep counts of tags used on badges in Django's cache. Changes to
+# badge tags clear them right away. 0 disables.
+TAG_COUNTS_CACHE_TIMEOUT = 300
+
+# Keep leaderboards of users by awards up to date, see badger.leaderboards
+LEADERBOARDS = False
+
+# Dotted path of the class used to search badges and awards, see
+# badger.search. The default token index matches the starts of words, where
+# badger used to match substrings anywhere. For that, use
+# 'badger.search.IcontainsBackend'.
+SEARCH_BACKEND = 'badger.search.TokenIndexBackend'
+
+# Seconds browsers and proxies may keep autocomplete responses
+AUTOCOMPLETE_MAX_AGE = 60
+
+# Page badge and award listings by cursor rather than by page number, see
+# badger.pagination
+CURSOR_PAGINATION = False
+
+# Seconds to keep counts of rows in listings in Django's cache. 0 counts on
+# every request.
+COUNT_CACHE_TIMEOUT = 300
+
+# Seconds to keep rendered feeds in Django's cache. Feeds are rendered again
+# as soon as anything in them changes. JSON feeds are streamed as they're
+# encoded either way, and cached once the whole feed has been sent. 0
+# disables.
+FEED_CACHE_TIMEOUT = 300
+
+# Seconds to keep Open Badges JSON for badges and award assertions in
+# Django's cache. Changes to the badges, awards and users they show clear
+# them right away. 0 disables.
+OBI_CACHE_TIMEOUT = 3600
+
+# Write award assertions and badge JSON to storage for a plain web server to
+# serve, and point baked images at them, see badger.publishing. The storage
+# is the dotted path of a storage class, or None for the badge uploads one.
+PUBLISH_ASSERTIONS = False
+PUBLISH_STORAGE = None
+
+# Bytes of badge images, and things made from them for baking and printing,
+# kept in memory by each process. 0 disables.
+IMAGE_CACHE_SIZE = 8 * 1024 * 1024
+
+# Most items in a feed polled with since= or after_id=, see badger.feeds
+MAX_FEED_POLL_ITEMS = 100
+
 
 class BadgerSettings(object):
     """Dirty settings interface that allows defaults from here to be overidden
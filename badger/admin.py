@@ -1,5 +1,6 @@
 from urlparse import urljoin
 
+import django
 from django.conf import settings
 from django.contrib import admin
 
@@ -11,13 +12,23 @@ try:
 except ImportError:
     from django.core.urlresolvers import reverse
 
-from .models import (Badge, Award, Nomination, Progress, DeferredAward)
+from .models import (Badge, Award, Nomination, Progress, DeferredAward,
+                     ClaimTokenRedemption, OutboxMessage, UserAwardCount)
+from .prerequisites import graph as prerequisite_graph
 
 
 UPLOADS_URL = getattr(settings, 'BADGER_MEDIA_URL',
     urljoin(getattr(settings, 'MEDIA_URL', '/media/'), 'uploads/'))
 
 
+def select_related(*fields):
+    """list_select_related for some relations"""
+    # HACK: Django < 1.6 only takes True or False, for all relations
+    if django.VERSION < (1, 6):
+        return True
+    return fields
+
+
 def show_unicode(obj):
     return unicode(obj)
 show_unicode.short_description = "Display"
@@ -34,7 +45,7 @@ show_image.allow_tags = True
 show_image.short_description = "Image"
 
 
-def build_related_link(self, model_name, name_single, name_plural, qs):
+def build_related_link(self, model_name, name_single, name_plural, count):
     link = '%s?%s' % (
         reverse('admin:badger_%s_changelist' % model_name, args=[]),
         'badge__exact=%s' % (self.id)
@@ -43,7 +54,6 @@ def build_related_link(self, model_name, name_single, name_plural, qs):
         reverse('admin:badger_%s_add' % model_name, args=[]),
         'badge=%s' % (self.id)
     )
-    count = qs.count()
     what = (count == 1) and name_single or name_plural
     return ('<a href="%s">%s %s</a> (<a href="%s">new</a>)' %
             (link, count, what, new_link))
@@ -51,7 +61,7 @@ def build_related_link(self, model_name, name_single, name_plural, qs):
 
 def related_deferredawards_link(self):
     return build_related_link(self, 'deferredaward', 'deferred', 'deferred',
-                              self.deferredaward_set)
+                              self.deferred_award_count)
 
 related_deferredawards_link.allow_tags = True
 related_deferredawards_link.short_description = "Deferred Awards"
@@ -59,16 +69,30 @@ related_deferredawards_link.short_description = "Deferred Awards"
 
 def related_awards_link(self):
     return build_related_link(self, 'award', 'award', 'awards',
-                              self.award_set)
+                              self.award_count)
 
 related_awards_link.allow_tags = True
 related_awards_link.short_description = "Awards"
 
 
+class BadgeAdminForm(forms.ModelForm):
+    """Badge admin form that refuses prerequisite cycles"""
+
+    def clean_prerequisites(self):
+        prerequisites = self.cleaned_data['prerequisites']
+        if self.instance.pk and prerequisite_graph.would_cycle(
+                self.instance.pk, [b.pk for b in prerequisites]):
+            raise forms.ValidationError(
+                'A badge cannot require itself, even indirectly.')
+        return prerequisites
+
+
 class BadgeAdmin(admin.ModelAdmin):
+    form = BadgeAdminForm
     list_display = ("id", "title", show_image, "slug", "unique", "creator",
                     related_awards_link, related_deferredawards_link, "created",)
     list_display_links = ('id', 'title',)
+    list_select_related = select_related('creator')
     search_fields = ("title", "slug", "image", "description",)
     filter_horizontal = ('prerequisites', )
     prepopulated_fields = {"slug": ("title",)}
@@ -94,6 +118,7 @@ badge_link.short_description = 'Badge'
 class AwardAdmin(admin.ModelAdmin):
     list_display = (show_unicode, badge_link, show_image, 'claim_code', 'user',
                     'creator', 'created', )
+    list_select_related = select_related(*Award.objects.feed_related)
     fields = ('badge', 'description', 'claim_code', 'user', 'creator', )
     search_fields = ("badge__title", "badge__slug", "badge__description",
                      "description")
@@ -115,6 +140,7 @@ class DeferredAwardAdmin(admin.ModelAdmin):
     list_display = ('id', claim_code_link, 'claim_group', badge_link, 'email',
                     'reusable', 'creator', 'created', 'modified',)
     list_display_links = ('id',)
+    list_select_related = select_related('badge', 'creator')
     list_filter = ('reusable', )    
     fields = ('badge', 'claim_group', 'claim_code', 'email', 'reusable',
               'description',)
@@ -123,6 +149,32 @@ class DeferredAwardAdmin(admin.ModelAdmin):
     raw_id_fields = ('creator',)
 
 
+class ClaimTokenRedemptionAdmin(admin.ModelAdmin):
+    list_display = ('id', badge_link, 'claim_group', 'serial', 'user',
+                    'created',)
+    list_display_links = ('id',)
+    list_select_related = select_related('badge', 'user')
+    readonly_fields = ('created',)
+    search_fields = ("badge__title", "badge__slug",)
+    raw_id_fields = ('user', 'award',)
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'object_id', 'attempts', 'available_at',
+                    'locked_until', 'created',)
+    list_display_links = ('id',)
+    list_filter = ('kind',)
+    readonly_fields = ('created',)
+
+
+class UserAwardCountAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'award_count',)
+    list_display_links = ('id',)
+    list_select_related = select_related('user')
+    search_fields = ('user__username', 'user__email',)
+    raw_id_fields = ('user',)
+
+
 def award_link(self):
     url = reverse('admin:badger_award_change', args=[self.award.id])
     return '<a href="%s">%s</a>' % (url, self.award)
@@ -134,6 +186,9 @@ award_link.short_description = 'award'
 class NominationAdmin(admin.ModelAdmin):
     list_display = ('id', show_unicode, award_link, 'accepted', 'nominee',
                     'approver', 'creator', 'created', 'modified',)
+    list_select_related = select_related('badge', 'award__badge',
+                                         'award__user', 'award__creator',
+                                         'nominee', 'approver', 'creator')
     list_filter = ('accepted',)
     search_fields = ('badge__title', 'badge__slug', 'badge__description',)
     raw_id_fields = ('nominee', 'creator', 'approver', 'rejected_by',)
@@ -143,5 +198,8 @@ for x in ((Badge, BadgeAdmin),
           (Award, AwardAdmin),
           (Nomination, NominationAdmin),
           (Progress, ProgressAdmin),
-          (DeferredAward, DeferredAwardAdmin),):
+          (DeferredAward, DeferredAwardAdmin),
+          (ClaimTokenRedemption, ClaimTokenRedemptionAdmin),
+          (OutboxMessage, OutboxMessageAdmin),
+          (UserAwardCount, UserAwardCountAdmin),):
     admin.site.register(*x)
@@ -0,0 +1,89 @@
+"""Prefix index for autocompleting badge titles, slugs and tags
+
+Typeahead asks for completions on every keystroke, so rather than querying
+the badge table each time, the titles and slugs of all badges and the names
+of tags used on badges are loaded once per process into a sorted list, and
+completions are found by binary search. As with the prerequisite graph, the
+index is kept until badges or their tags change anywhere, which bumps a
+version number in Django's cache to tell other processes to reload.
+"""
+import threading
+from bisect import bisect_left
+
+from .caching import get_version, bump_version
+
+
+VERSION_CACHE_KEY = 'badger:autocomplete:version'
+
+# Kinds of completion
+BADGE, TAG = 'badge', 'tag'
+
+# Most completions returned at once
+MAX_RESULTS = 50
+
+
+class PrefixIndex(object):
+    """Sorted keys for badges and tags, each paired with a (kind, label,
+    slug) completion"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        # Keys and completions are swapped in together, so readers never
+        # see one without the other.
+        self._data = ([], [])
+
+    def invalidate(self):
+        """Throw away the index in this and every other process"""
+        bump_version(VERSION_CACHE_KEY)
+        self.version = None
+
+    def load(self):
+        """Ensure the index is current, rebuilding from the DB if
+        necessary"""
+        version = get_version(VERSION_CACHE_KEY)
+        if self.version is not None and self.version == version:
+            return self
+        with self._lock:
+            if self.version != version:
+                self._build()
+                self.version = version
+        return self
+
+    def _build(self):
+        from badger.models import Badge
+        rows = []
+        for title, slug in Badge.objects.values_list('title', 'slug'):
+            completion = (BADGE, title, slug)
+            rows.append((title.lower(), completion))
+            if slug.lower() != title.lower():
+                rows.append((slug.lower(), completion))
+        for tag_count in Badge.objects.tag_counts():
+            tag = tag_count['tag']
+            rows.append((tag.name.lower(), (TAG, tag.name, tag.slug)))
+        rows.sort()
+        self._data = ([key for key, completion in rows],
+                      [completion for key, completion in rows])
+
+    def complete(self, prefix, limit=10, kinds=None):
+        """Completions with a title, slug or tag name starting with the
+        prefix, ignoring case, in alphabetical order"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        keys, completions = self.load()._data
+        limit = min(limit, MAX_RESULTS)
+        results, seen = [], set()
+        idx = bisect_left(keys, prefix)
+        while (idx < len(keys) and len(results) < limit and
+               keys[idx].startswith(prefix)):
+            completion = completions[idx]
+            if (completion not in seen and
+                    (kinds is None or completion[0] in kinds)):
+                seen.add(completion)
+                results.append(completion)
+            idx += 1
+        return results
+
+
+prefix_index = PrefixIndex()
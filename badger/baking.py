@@ -0,0 +1,129 @@
+"""Baking Open Badges assertions into PNG images
+
+A baked badge is a PNG with an ``openbadges`` text chunk holding the
+assertion, or its URL. Rather than decoding the image and encoding it again
+just to add a chunk, baking here walks the chunk stream of the PNG, drops any
+``openbadges`` text chunk already there, and adds a new one after the header.
+Every other chunk, including the image data, is copied byte for byte from a
+memoryview of the original without being decoded.
+
+See: http://www.w3.org/TR/PNG/#5DataRep
+"""
+import struct
+import zlib
+
+try:
+    view_of = memoryview
+except NameError:
+    # HACK: Python < 2.7 has no memoryview. Slices of a buffer are copies,
+    # but the bytes come out the same.
+    view_of = buffer
+
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+KEYWORD = 'openbadges'
+
+# Chunks able to hold text, by whether they're international text
+TEXT_CHUNKS = {'tEXt': False, 'iTXt': True}
+
+
+class BakingError(ValueError):
+    """Image data that isn't a PNG that can be baked"""
+
+
+def _bytes(piece):
+    """Bytes of a slice of a view, which is already bytes from a buffer"""
+    if isinstance(piece, str):
+        return piece
+    return piece.tobytes()
+
+
+def iter_chunks(data):
+    """(type, start, end) for each chunk in a PNG, where start and end are
+    the offsets of the whole chunk, from length to CRC"""
+    view = view_of(data)
+    if _bytes(view[:len(PNG_SIGNATURE)]) != PNG_SIGNATURE:
+        raise BakingError('Not a PNG')
+    pos = len(PNG_SIGNATURE)
+    while pos < len(view):
+        if pos + 8 > len(view):
+            raise BakingError('Truncated chunk header at %s' % pos)
+        length, chunk_type = struct.unpack_from('>I4s', view, pos)
+        end = pos + 12 + length
+        if end > len(view):
+            raise BakingError('Truncated %s chunk at %s' % (chunk_type, pos))
+        yield chunk_type, pos, end
+        if chunk_type == 'IEND':
+            return
+        pos = end
+    raise BakingError('No IEND chunk')
+
+
+def make_chunk(chunk_type, data):
+    """A PNG chunk of a type with data, with its length and CRC"""
+    return ''.join((struct.pack('>I', len(data)), chunk_type, data,
+                    struct.pack('>I', zlib.crc32(chunk_type + data)
+                                & 0xffffffff)))
+
+
+def make_text_chunk(value, keyword=KEYWORD):
+    """A tEXt chunk for a value in Latin-1, otherwise an uncompressed iTXt
+    chunk in UTF-8"""
+    try:
+        if isinstance(value, unicode):
+            value = value.encode('latin-1')
+        return make_chunk('tEXt', '%s\0%s' % (keyword, value))
+    except UnicodeEncodeError:
+        # Keyword, no compression, no language tag or translated keyword
+        return make_chunk('iTXt', '%s\0\0\0\0\0%s' % (
+            keyword, value.encode('utf-8')))
+
+
+def _text_keyword(view, start, end):
+    """The keyword of a text chunk, with the offset its data starts at"""
+    data_start = start + 8
+    # Keywords are at most 79 bytes, ended by a null byte.
+    head = _bytes(view[data_start:min(end - 4, data_start + 80)])
+    keyword, sep, rest = head.partition('\0')
+    return sep and keyword or None, data_start
+
+
+def bake(data, value, keyword=KEYWORD, chunks=None):
+    """Image data for a PNG with a text chunk holding the value, in place of
+    any chunk for the keyword already there. Chunks already found in the
+    data by iter_chunks() may be given, to skip finding them again."""
+    view = view_of(data)
+    if chunks is None:
+        chunks = iter_chunks(data)
+    out = bytearray()
+    out += view[:len(PNG_SIGNATURE)]
+    for chunk_type, start, end in chunks:
+        if (chunk_type in TEXT_CHUNKS and
+                _text_keyword(view, start, end)[0] == keyword):
+            continue
+        out += view[start:end]
+        if chunk_type == 'IHDR':
+            out += make_text_chunk(value, keyword)
+    return str(out)
+
+
+def unbake(data, keyword=KEYWORD):
+    """The value in the text chunk for a keyword in a PNG, or None"""
+    view = view_of(data)
+    for chunk_type, start, end in iter_chunks(data):
+        if chunk_type not in TEXT_CHUNKS:
+            continue
+        found, data_start = _text_keyword(view, start, end)
+        if found != keyword:
+            continue
+        text = _bytes(view[data_start + len(keyword) + 1:end - 4])
+        if not TEXT_CHUNKS[chunk_type]:
+            return text.decode('latin-1')
+        compressed = text[0] != '\0'
+        # Skip the compression method, language tag and translated keyword.
+        text = text[2:].split('\0', 2)[2]
+        if compressed:
+            text = zlib.decompress(text)
+        return text.decode('utf-8')
+    return None
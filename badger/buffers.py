@@ -0,0 +1,68 @@
+"""Write-behind buffering for Progress counters
+
+Activity hooks tend to bump the same counters over and over. With
+``BADGER_PROGRESS_FLUSH_INTERVAL`` set, increments are summed in memory per
+(badge, user) and written in one batch once the interval has passed, at the
+end of each request, and when the process exits.
+"""
+import atexit
+import logging
+import threading
+from time import time
+
+from django.core.signals import request_finished
+
+import badger
+
+
+log = logging.getLogger('badger.buffers')
+
+
+class ProgressBuffer(object):
+    """Pending Progress counter increments, keyed by (badge PK, user PK)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._amounts = dict()
+        self._goals = dict()
+        self._last_flush = time()
+
+    def add(self, badge_pk, user_pk, amount, goal=None):
+        """Queue up an increment, flushing if the interval has passed"""
+        key = (badge_pk, user_pk)
+        with self._lock:
+            self._amounts[key] = self._amounts.get(key, 0) + amount
+            if goal:
+                self._goals[key] = goal
+            due = (time() - self._last_flush >=
+                   badger.settings.PROGRESS_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def pending(self, badge_pk, user_pk):
+        """Sum of increments not yet written for the badge and user"""
+        with self._lock:
+            return self._amounts.get((badge_pk, user_pk), 0)
+
+    def flush(self, **kwargs):
+        """Write all pending increments"""
+        with self._lock:
+            amounts, goals = self._amounts, self._goals
+            self._amounts, self._goals = dict(), dict()
+            self._last_flush = time()
+        if not amounts:
+            return
+        from badger.models import Progress
+        try:
+            Progress.objects.increment_many(amounts, goals)
+        except Exception:
+            log.exception('Failed to flush %s progress increments' %
+                          len(amounts))
+            raise
+
+
+progress_buffer = ProgressBuffer()
+
+request_finished.connect(progress_buffer.flush,
+                         dispatch_uid='badger.buffers.flush')
+atexit.register(progress_buffer.flush)
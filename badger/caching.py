@@ -0,0 +1,286 @@
+"""Caching helpers for badger
+
+Invalidation throughout badger works by bumping version numbers kept in
+Django's cache. Keys built from a version go stale all at once, across all
+processes, without having to track down and delete them individually.
+"""
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+
+import badger
+from .stats import cache_stats
+
+
+def get_version(key):
+    """Get the current version number stored under a key, starting at 1"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def get_versions(keys):
+    """Get the current version numbers stored under several keys, in one
+    trip to the cache for keys already there"""
+    found = cache.get_many(keys)
+    return [key in found and found[key] or get_version(key) for key in keys]
+
+
+def bump_version(key):
+    """Bump the version number stored under a key"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+        return 2
+
+
+class AwardedBadgesCache(object):
+    """Sets of awarded badge IDs by user
+
+    Sets are kept for the duration of a request (or an explicit
+    :py:meth:`scope`), and optionally in Django's cache for
+    ``BADGER_AWARDED_CACHE_TIMEOUT`` seconds.
+    """
+    key_tmpl = 'badger:awarded:%s'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def _sets(self):
+        """Awarded sets for the current scope, or None outside of one"""
+        return getattr(self._local, 'sets', None)
+
+    @contextmanager
+    def scope(self):
+        """Remember awarded sets for the duration of the block"""
+        outer = self._sets
+        if outer is None:
+            self._local.sets = dict()
+        try:
+            yield
+        finally:
+            if outer is None:
+                self._local.sets = None
+
+    def begin_request(self, **kwargs):
+        self._local.sets = dict()
+
+    def end_request(self, **kwargs):
+        self._local.sets = None
+
+    def get(self, user_pk, loader):
+        """Get the set of badge IDs awarded to the user, calling loader() to
+        produce it on a cache miss"""
+        sets = self._sets
+        if sets is not None and user_pk in sets:
+            return sets[user_pk]
+
+        timeout = badger.settings.AWARDED_CACHE_TIMEOUT
+        if timeout:
+            version_key = '%s:version' % (self.key_tmpl % user_pk)
+            key = '%s:%s' % (self.key_tmpl % user_pk, get_version(version_key))
+            badge_pks = cache.get(key)
+            if badge_pks is None:
+                badge_pks = loader()
+                cache.set(key, badge_pks, timeout)
+        else:
+            badge_pks = loader()
+
+        if sets is not None:
+            sets[user_pk] = badge_pks
+        return badge_pks
+
+    def add(self, user_pk, badge_pk):
+        """Note a new award of a badge to the user"""
+        sets = self._sets
+        if sets is not None and user_pk in sets:
+            sets[user_pk] = sets[user_pk] | frozenset([badge_pk])
+        if badger.settings.AWARDED_CACHE_TIMEOUT:
+            bump_version('%s:version' % (self.key_tmpl % user_pk))
+
+    def invalidate(self, user_pk):
+        """Forget the set of badge IDs awarded to the user"""
+        sets = self._sets
+        if sets is not None:
+            sets.pop(user_pk, None)
+        if badger.settings.AWARDED_CACHE_TIMEOUT:
+            bump_version('%s:version' % (self.key_tmpl % user_pk))
+
+
+awarded_badges = AwardedBadgesCache()
+
+
+class OBICache(object):
+    """Open Badges JSON for badges and award assertions, encoded once
+
+    JSON is kept in Django's cache for ``BADGER_OBI_CACHE_TIMEOUT`` seconds
+    per object and base URL, under keys including versions for every badge,
+    award and user it shows. Saving or deleting any of them bumps its
+    version, so the JSON is encoded again on the next request.
+    """
+    key_tmpl = 'badger:obi:%s'
+
+    def version_key(self, model, pk):
+        return self.key_tmpl % ('%s:%s:version' % (model._meta.db_table, pk))
+
+    def invalidate(self, model, pk):
+        """Throw away JSON that includes an object"""
+        if badger.settings.OBI_CACHE_TIMEOUT:
+            bump_version(self.version_key(model, pk))
+
+    def badge_json(self, badge, request=None):
+        """OBI serialization of a badge, as JSON"""
+        return self._get('badge', request, [badge, badge.creator_id], lambda:
+                         badge.as_obi_serialization(request))
+
+    def assertion_json(self, award, request=None):
+        """OBI assertion for an award, as JSON"""
+        badge = award.badge
+        return self._get('assertion', request,
+                         [award, badge, award.user_id, award.creator_id,
+                          badge.creator_id],
+                         lambda: award.as_obi_assertion(request))
+
+    def _get(self, kind, request, objects, serialize):
+        timeout = badger.settings.OBI_CACHE_TIMEOUT
+        if not timeout:
+            return json.dumps(serialize())
+
+        if request:
+            base_url = request.build_absolute_uri('/')[:-1]
+        else:
+            base_url = 'http://%s' % (Site.objects.get_current().domain,)
+        # Objects are given as instances, or as user IDs
+        ids = [hasattr(obj, 'pk') and (obj.__class__, obj.pk) or (User, obj)
+               for obj in objects if obj is not None]
+        versions = get_versions([self.version_key(model, pk)
+                                 for model, pk in ids])
+        key = self.key_tmpl % '%s:%s' % (kind, hashlib.md5(repr((
+            base_url, [(model._meta.db_table, pk) for model, pk in ids],
+            versions))).hexdigest())
+
+        data = cache.get(key)
+        cache_stats.record('obi_%s' % kind, data is not None)
+        if data is None:
+            data = json.dumps(serialize())
+            cache.set(key, data, timeout)
+        return data
+
+
+obi_cache = OBICache()
+
+
+class ImageCache(object):
+    """Bytes of badge images, and things made from them, kept per process
+
+    Entries are keyed by badge ID and image name along with the kind of
+    thing kept, such as PNG data with its chunks for baking, or an
+    ImageReader for printing. The least recently used are dropped once they
+    add up to more than ``BADGER_IMAGE_CACHE_SIZE`` bytes. Storages pick a
+    new name rather than overwrite an image, so a changed image is never
+    found under the old key, in this or any other process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = dict()
+        # Entry keys, least recently used first. There are few enough
+        # entries to keep in order with a plain list.
+        self._order = []
+        self.size = 0
+
+    def get(self, key, kind, build, size=len):
+        """Get the thing of a kind made from the image under a key, calling
+        build() to make it on a miss, and size() to count its bytes"""
+        budget = badger.settings.IMAGE_CACHE_SIZE
+        if not budget:
+            return build()
+
+        entry_key = (key, kind)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None:
+                # Back on the end, as the most recently used
+                self._order.remove(entry_key)
+                self._order.append(entry_key)
+        cache_stats.record('image', entry is not None)
+        if entry is not None:
+            return entry[0]
+
+        value = build()
+        value_size = size(value)
+        if value_size <= budget:
+            with self._lock:
+                old = self._entries.pop(entry_key, None)
+                if old is not None:
+                    self.size -= old[1]
+                    self._order.remove(entry_key)
+                self._entries[entry_key] = (value, value_size)
+                self._order.append(entry_key)
+                self.size += value_size
+                while self.size > budget:
+                    self.size -= self._entries.pop(self._order.pop(0))[1]
+        return value
+
+    def invalidate(self, badge_pk, keep_name=None):
+        """Drop everything kept for a badge's images, other than the one
+        named keep_name"""
+        with self._lock:
+            for entry_key in list(self._order):
+                pk, name = entry_key[0]
+                if pk == badge_pk and name != keep_name:
+                    self.size -= self._entries.pop(entry_key)[1]
+                    self._order.remove(entry_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            del self._order[:]
+            self.size = 0
+
+
+image_cache = ImageCache()
+
+
+class FeedStamp(object):
+    """When anything a feed could list last changed, shared through Django's
+    cache
+
+    Saving or deleting an award, badge or user moves the stamp on, so feeds
+    can answer polls without counting what they list. The stamp is a time
+    rather than a counter, so it never repeats one handed out before the
+    cache was cleared.
+    """
+    key = 'badger:feed:changed'
+
+    def get(self):
+        """Seconds since the epoch at the last change"""
+        stamp = cache.get(self.key)
+        if stamp is None:
+            cache.add(self.key, time.time(), None)
+            stamp = cache.get(self.key, time.time())
+        return stamp
+
+    def bump(self):
+        # Never backwards, even from a process with its clock behind
+        last = cache.get(self.key) or 0
+        cache.set(self.key, max(time.time(), last + 0.001), None)
+
+
+feed_stamp = FeedStamp()
+
+request_started.connect(awarded_badges.begin_request,
+                        dispatch_uid='badger.caching.begin_request')
+request_finished.connect(awarded_badges.end_request,
+                         dispatch_uid='badger.caching.end_request')
@@ -0,0 +1,219 @@
+"""Stateless, signed claim codes
+
+An alternative to DeferredAward for handing out large numbers of printed
+claim codes. A token encodes a badge ID, a claim group, and a serial number,
+signed with an HMAC. Minting tokens needs no database writes, forged or
+mistyped tokens are rejected without touching the database, and only
+redemptions get recorded.
+
+Tokens look like ``<badge>-<claim group>-<serial>-<signature>``, in
+lowercase base36 and hex so that they stay easy to type in from a label.
+"""
+import hashlib
+import hmac
+import random
+from binascii import hexlify
+from itertools import count, izip
+
+from django.conf import settings
+from django.db import IntegrityError
+
+try:
+    from funfactory.urlresolvers import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+from .models import (Badge, ClaimTokenRedemption,
+                     BadgeAlreadyAwardedException,
+                     BadgeAwardNotAllowedException, get_permissions_for,
+                     atomic)
+
+
+SECRET = getattr(settings, 'BADGER_CLAIM_TOKEN_SECRET', settings.SECRET_KEY)
+
+# Hex digits of the truncated HMAC kept in a token, so that tokens fit in
+# Award.claim_code
+SIGNATURE_LENGTH = 14
+
+# Claim groups are random, and must fit in a signed 32-bit DB column
+MAX_CLAIM_GROUP = 2 ** 31 - 1
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+_signer = hmac.new(hashlib.sha256(
+    'badger.claim_tokens:%s' % SECRET).digest(), digestmod=hashlib.sha256)
+
+# HMAC objects are slow to copy, so keep the keyed inner and outer hashes
+# around to copy directly when signing lots of tokens.
+_inner, _outer = _signer.inner, _signer.outer
+
+
+def to_base36(num):
+    out = []
+    while True:
+        num, rem = divmod(num, 36)
+        out.append(DIGITS[rem])
+        if not num:
+            return ''.join(reversed(out))
+
+
+def sign(payload, inner=_inner):
+    """Signature for a token payload. Pass the inner hash already updated
+    with the start of the payload to skip hashing that part again."""
+    inner = inner.copy()
+    inner.update(payload)
+    outer = _outer.copy()
+    outer.update(inner.digest())
+    return hexlify(outer.digest())[:SIGNATURE_LENGTH]
+
+
+def make_token(badge_pk, claim_group, serial):
+    """Build a signed claim token"""
+    payload = '%s-%s-%s' % (to_base36(badge_pk), to_base36(claim_group),
+                            to_base36(serial))
+    return '%s-%s' % (payload, sign(payload))
+
+
+def parse_token(token):
+    """Verify a claim token, returns (badge PK, claim group, serial) or None
+    if the token is not valid"""
+    try:
+        payload, signature = str(token).strip().lower().rsplit('-', 1)
+        parts = payload.split('-')
+        if len(parts) != 3:
+            return None
+        badge_pk, claim_group, serial = [int(p, 36) for p in parts]
+    except (ValueError, UnicodeError):
+        return None
+    if not _compare(sign(payload), signature):
+        return None
+    return badge_pk, claim_group, serial
+
+
+def is_token(code):
+    """Does the code look like a claim token, rather than a DeferredAward
+    claim code?"""
+    return '-' in code
+
+
+def _compare(a, b):
+    """Constant time string comparison"""
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+def new_claim_group():
+    """Pick a random claim group number"""
+    return random.SystemRandom().randint(1, MAX_CLAIM_GROUP)
+
+
+def mint_tokens(badge, amount, claim_group, start=0):
+    """Generate claim tokens for serial numbers start to start + amount,
+    without touching the database"""
+    badge_pk = getattr(badge, 'pk', badge)
+    prefix = '%s-%s-' % (to_base36(badge_pk), to_base36(claim_group))
+    inner = _inner.copy()
+    inner.update(prefix)
+    for serial in xrange(start, start + amount):
+        serial = to_base36(serial)
+        yield '%s%s-%s' % (prefix, serial, sign(serial, inner))
+
+
+class ClaimToken(object):
+    """A verified claim token, which stands in for a DeferredAward in
+    claim views and printing"""
+    email = None
+    reusable = False
+
+    def __init__(self, claim_code, badge_pk, claim_group, serial,
+                 badge=None):
+        self.claim_code = claim_code
+        self.badge_id = badge_pk
+        self.claim_group = claim_group
+        self.serial = serial
+        self._badge = badge
+
+    @classmethod
+    def from_code(cls, claim_code, badge=None):
+        """Build a ClaimToken from a code, or None if it's not valid"""
+        parsed = parse_token(claim_code)
+        if not parsed:
+            return None
+        if badge and badge.pk != parsed[0]:
+            return None
+        return cls(claim_code, *parsed, badge=badge)
+
+    @classmethod
+    def mint(cls, badge, amount, claim_group=None, start=0):
+        """Generate ClaimTokens for a badge, in the same claim group"""
+        if claim_group is None:
+            claim_group = new_claim_group()
+        codes = mint_tokens(badge, amount, claim_group, start)
+        for serial, code in izip(count(start), codes):
+            yield cls(code, badge.pk, claim_group, serial, badge=badge)
+
+    @property
+    def badge(self):
+        if self._badge is None:
+            self._badge = Badge.objects.get(pk=self.badge_id)
+        return self._badge
+
+    get_permissions_for = get_permissions_for
+
+    def allows_detail_by(self, user):
+        return True
+
+    def allows_claim_by(self, user):
+        if user.is_anonymous():
+            return False
+        return True
+
+    def allows_grant_by(self, user):
+        # Granting means reassigning a stored claim, and there is none.
+        return False
+
+    def get_claim_url(self):
+        """Get the URL to a page where this token can be claimed."""
+        return reverse('badger.views.claim_deferred_award',
+                       args=(self.claim_code,))
+
+    def redemption(self):
+        """The redemption of this token, if it has been claimed"""
+        try:
+            return (ClaimTokenRedemption.objects
+                        .select_related('award')
+                        .get(badge=self.badge_id,
+                             claim_group=self.claim_group,
+                             serial=self.serial))
+        except ClaimTokenRedemption.DoesNotExist:
+            return None
+
+    def claim(self, awardee):
+        """Claim the token for the given user, returns the award or None if
+        the token was already claimed or the award not allowed"""
+        with atomic():
+            try:
+                with atomic():
+                    redemption = ClaimTokenRedemption.objects.create(
+                        badge_id=self.badge_id, claim_group=self.claim_group,
+                        serial=self.serial, user=awardee)
+            except IntegrityError:
+                # Somebody got here first.
+                return None
+            try:
+                award = self.badge.award_to(awardee=awardee)
+                award.claim_code = self.claim_code
+                award.save()
+            except (BadgeAlreadyAwardedException,
+                    BadgeAwardNotAllowedException):
+                # Just swallow up and ignore any issues in awarding, but the
+                # token still counts as used.
+                award = None
+            if award:
+                redemption.award = award
+                redemption.save()
+        return award
@@ -1,10 +1,32 @@
-"""Feeds for badge"""
+"""Feeds for badge
+
+Feed readers poll, mostly to find nothing new. Saving or deleting any award,
+badge or user moves on a stamp kept in Django's cache, and feeds answer
+conditional requests with 304 Not Modified while it stays the same, without
+querying what they list. Otherwise, rendered feeds are kept in Django's cache
+for ``BADGER_FEED_CACHE_TIMEOUT`` seconds under a key that includes the
+stamp, so changes show up in them right away.
+
+Rather than fetching the latest items again and again, clients can poll for
+only what's new. The JSON envelope of each feed carries a ``next`` cursor
+for its newest item, and requesting the feed with ``?since=<cursor>`` lists
+only items created after it, up to ``BADGER_MAX_FEED_POLL_ITEMS`` of the
+oldest, along with the cursor to poll with next. ``?after_id=<id>`` does the
+same for items with greater IDs. Items are found by an index range scan on
+(``created``, ``id``), so polls cost as much as what's new.
+"""
 import datetime
 import hashlib
 import json
 import urllib
+from calendar import timegm
 
 from django.contrib.syndication.views import Feed, FeedDoesNotExist
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.translation import get_language
 from django.utils.feedgenerator import (SyndicationFeed, Rss201rev2Feed,
                                         Atom1Feed, get_tag_uri)
 from django.shortcuts import get_object_or_404
@@ -17,12 +39,23 @@ try:
 except ImportError:
     from django.utils.translation import ugettext_lazy as _
 
+# HACK: Django < 1.5 can't stream responses
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    StreamingHttpResponse = None
+
 try:
     from commons.urlresolvers import reverse
 except ImportError:
     from django.core.urlresolvers import reverse
 
+import badger
 from . import validate_jsonp
+from .caching import feed_stamp
+from .signals import feed_cache_lookup
+from .stats import cache_stats
+from .pagination import CursorPaginator, InvalidCursor, NEXT
 from .models import (Badge, Award, Nomination, Progress,
                      BadgeAwardNotAllowedException,
                      DEFAULT_BADGE_IMAGE)
@@ -30,6 +63,18 @@ from .models import (Badge, Award, Nomination, Progress,
 
 MAX_FEED_ITEMS = getattr(settings, 'BADGER_MAX_FEED_ITEMS', 15)
 
+# Order of the keys that polling cursors are made from, oldest first
+POLL_ORDERING = ('created', 'pk')
+
+
+def jsonp_callback(request):
+    """The callback param of a request, if it's valid"""
+    callback = request.GET.get('callback', None)
+    if callback is not None:
+        if not validate_jsonp.is_valid_jsonp_callback_value(callback):
+            callback = None
+    return callback
+
 
 class BaseJSONFeedGenerator(SyndicationFeed):
     """JSON feed generator"""
@@ -48,31 +93,49 @@ class BaseJSONFeedGenerator(SyndicationFeed):
         return dict((k, v) for k, v in item.items()
                     if v and k not in omit_keys)
 
-    def build_feed(self):
-        """Simple base feed formatter.
+    def build_envelope(self):
+        """Simple base feed formatter, with a placeholder for the items.
         Omit some named keys and any keys with false-y values"""
         omit_keys = ('obj', 'request', 'id', )
         feed_data = dict((k, v) for k, v in self.feed.items()
                          if v and k not in omit_keys)
-        feed_data['items'] = [self.build_item(item) for item in self.items]
+        feed_data['items'] = None
         return feed_data
 
-    def write(self, outfile, encoding):
-        request = self.feed['request']
-
-        # Check for a callback param, validate it before use
-        callback = request.GET.get('callback', None)
-        if callback is not None:
-            if not validate_jsonp.is_valid_jsonp_callback_value(callback):
-                callback = None
+    def build_feed(self):
+        """The whole feed, with its items"""
+        feed_data = self.build_envelope()
+        feed_data['items'] = [self.build_item(item) for item in self.items]
+        return feed_data
 
-        # Build the JSON string, wrapping it in a callback param if necessary.
-        json_string = json.dumps(self.build_feed(),
-                                 default=self._encode_complex)
+    def stream(self):
+        """The feed as JSON, a piece at a time, wrapped in a callback param
+        if necessary. Items are encoded one by one as they're reached, into
+        the same bytes as encoding :py:meth:`build_feed` all at once."""
+        callback = jsonp_callback(self.feed['request'])
+        encoder = json.JSONEncoder(default=self._encode_complex)
         if callback:
-            outfile.write('%s(%s)' % (callback, json_string))
-        else:
-            outfile.write(json_string)
+            yield '%s(' % callback
+        yield '{'
+        # Envelope keys come in the order json.dumps would take them from
+        # the whole feed, since the items are in the same dict.
+        for idx, (key, value) in enumerate(self.build_envelope().items()):
+            prefix = '%s%s: ' % (idx and ', ' or '', encoder.encode(key))
+            if key != 'items':
+                yield prefix + encoder.encode(value)
+                continue
+            yield prefix + '['
+            for item_idx, item in enumerate(self.items):
+                yield '%s%s' % (item_idx and ', ' or '',
+                                encoder.encode(self.build_item(item)))
+            yield ']'
+        yield '}'
+        if callback:
+            yield ')'
+
+    def write(self, outfile, encoding):
+        for chunk in self.stream():
+            outfile.write(chunk)
 
 
 class BaseFeed(Feed):
@@ -84,9 +147,139 @@ class BaseFeed(Feed):
     rss_feed_generator = Rss201rev2Feed
     atom_feed_generator = Atom1Feed
 
+    # (since, after_id) of the request being answered, see get_poll()
+    poll = None
+
     def __call__(self, request, *args, **kwargs):
         self.request = request
-        return super(BaseFeed, self).__call__(request, *args, **kwargs)
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Feed object does not exist.')
+
+        self.poll = self.get_poll(request)
+        last_modified, key = self.validator(request, obj, args, kwargs)
+        etag = '"%s"' % key
+        if self.not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = self.render(request, obj, key)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(
+                timegm(last_modified.utctimetuple()))
+        return response
+
+    def scope(self, obj):
+        """Queryset of everything the feed could list"""
+        raise NotImplementedError
+
+    def items(self, obj):
+        if self.poll is None:
+            return self.scope(obj).order_by('-created')[:MAX_FEED_ITEMS]
+        since, after_id = self.poll
+        qs = self.scope(obj)
+        if after_id is not None:
+            qs = qs.filter(pk__gt=after_id)
+        page = self.poll_paginator(qs).page(since)
+        # Newest first, as in the rest of the feeds
+        return list(reversed(page.object_list))
+
+    def get_poll(self, request):
+        """The (since, after_id) a request polls for new items after, or
+        None to list the latest items"""
+        since = request.GET.get('since', None)
+        after_id = request.GET.get('after_id', None)
+        if not since and not after_id:
+            return None
+        try:
+            if since and self.poll_paginator().decode(since)[0] != NEXT:
+                raise InvalidCursor(since)
+            return since or None, after_id and int(after_id) or None
+        except (InvalidCursor, ValueError):
+            raise Http404('Invalid since or after_id')
+
+    def poll_paginator(self, queryset=None):
+        if queryset is None:
+            queryset = self.scope(None).none()
+        return CursorPaginator(queryset, badger.settings.MAX_FEED_POLL_ITEMS,
+                               ordering=POLL_ORDERING)
+
+    def get_feed(self, obj, request):
+        feedgen = super(BaseFeed, self).get_feed(obj, request)
+        # Cursor for polling for items newer than any in the feed
+        objs = [item['obj'] for item in feedgen.items]
+        if objs:
+            paginator = self.poll_paginator()
+            newest = max(objs, key=paginator.key_for)
+            feedgen.feed['next'] = paginator.encode(NEXT, newest)
+        else:
+            feedgen.feed['next'] = self.poll and self.poll[0]
+        return feedgen
+
+    def validator(self, request, obj, args, kwargs):
+        """The last time anything the feed could list changed, and a key
+        that changes whenever the rendered feed would"""
+        # Items show the badges and users they're for, so the stamp moves on
+        # for any award, badge or user, not just what's in the scope.
+        stamp = feed_stamp.get()
+        last_modified = datetime.datetime.utcfromtimestamp(int(stamp))
+        parts = (self.__class__.__module__, self.__class__.__name__,
+                 self.feed_type.__name__, request.get_host(), get_language(),
+                 repr(args), repr(sorted(kwargs.items())),
+                 jsonp_callback(request), self.poll, repr(stamp))
+        return last_modified, hashlib.md5(
+            ':'.join(unicode(part) for part in parts).encode('utf-8')
+        ).hexdigest()
+
+    def not_modified(self, request, etag, last_modified):
+        """Whether the client already has the feed, by its validators"""
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+        if if_none_match is not None:
+            return etag in if_none_match
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return (if_modified_since is not None and last_modified is not None
+                and timegm(last_modified.utctimetuple()) <= if_modified_since)
+
+    def render(self, request, obj, key):
+        """Response with the rendered feed, from the cache if possible"""
+        timeout = badger.settings.FEED_CACHE_TIMEOUT
+        cache_key = 'badger:feed:%s' % key
+        cached = timeout and cache.get(cache_key) or None
+        if timeout:
+            cache_stats.record('feed', cached is not None)
+            feed_cache_lookup.send(sender=self.__class__, feed=self,
+                                   hit=cached is not None)
+        if cached is None:
+            feedgen = self.get_feed(obj, request)
+            if (StreamingHttpResponse is not None and
+                    hasattr(feedgen, 'stream')):
+                # Send the feed as it's encoded, and cache it once it's all
+                # been sent.
+                return StreamingHttpResponse(
+                    self.stream_to_cache(feedgen, cache_key, timeout),
+                    content_type=feedgen.mime_type)
+            response = HttpResponse(content_type=feedgen.mime_type)
+            feedgen.write(response, 'utf-8')
+            if timeout:
+                cache.set(cache_key, (feedgen.mime_type, response.content),
+                          timeout)
+            return response
+        content_type, content = cached
+        return HttpResponse(content, content_type=content_type)
+
+    def stream_to_cache(self, feedgen, cache_key, timeout):
+        """The chunks of a streamed feed, kept in the cache under a key once
+        the last is sent, if there's a timeout"""
+        chunks = []
+        for chunk in feedgen.stream():
+            if timeout:
+                chunks.append(chunk)
+            yield chunk
+        if timeout:
+            cache.set(cache_key, (feedgen.mime_type, ''.join(chunks)),
+                      timeout)
 
     def get_object(self, request, format):
         self.link = request.build_absolute_uri('/')
@@ -173,10 +366,8 @@ class AwardsFeed(BaseFeed):
 class AwardsRecentFeed(AwardsFeed):
     """Feed of all recent badge awards"""
 
-    def items(self):
-        return (Award.objects
-                .order_by('-created')
-                .all()[:MAX_FEED_ITEMS])
+    def scope(self, obj):
+        return Award.objects.for_feed()
 
 
 class AwardsByUserFeed(AwardsFeed):
@@ -191,11 +382,8 @@ class AwardsByUserFeed(AwardsFeed):
             reverse('badger.views.awards_by_user', args=(user.username,)))
         return user
 
-    def items(self, user):
-        return (Award.objects
-                .filter(user=user)
-                .order_by('-created')
-                .all()[:MAX_FEED_ITEMS])
+    def scope(self, user):
+        return Award.objects.for_feed().filter(user=user)
 
 
 class AwardsByBadgeFeed(AwardsFeed):
@@ -210,10 +398,8 @@ class AwardsByBadgeFeed(AwardsFeed):
             reverse('badger.views.awards_by_badge', args=(badge.slug,)))
         return badge
 
-    def items(self, badge):
-        return (Award.objects
-                .filter(badge=badge).order_by('-created')
-                .all()[:MAX_FEED_ITEMS])
+    def scope(self, badge):
+        return Award.objects.for_feed().filter(badge=badge)
 
 
 class BadgesJSONFeedGenerator(BaseJSONFeedGenerator):
@@ -237,10 +423,8 @@ class BadgesFeed(BaseFeed):
 
 class BadgesRecentFeed(BadgesFeed):
 
-    def items(self):
-        return (Badge.objects
-                .order_by('-created')
-                .all()[:MAX_FEED_ITEMS])
+    def scope(self, obj):
+        return Badge.objects.for_feed()
 
 
 class BadgesByUserFeed(BadgesFeed):
@@ -255,8 +439,5 @@ class BadgesByUserFeed(BadgesFeed):
             reverse('badger.views.badges_by_user', args=(user.username,)))
         return user
 
-    def items(self, user):
-        return (Badge.objects
-                .filter(creator=user)
-                .order_by('-created')
-                .all()[:MAX_FEED_ITEMS])
+    def scope(self, user):
+        return Badge.objects.for_feed().filter(creator=user)
@@ -0,0 +1,163 @@
+"""Leaderboards of users by the awards they have, and of badges by awards
+
+Users are scored on boards: ``GLOBAL`` counts all of a user's visible awards,
+and a board per tag counts their awards of badges with that tag. Scores are
+updated as awards are made, hidden and deleted while ``BADGER_LEADERBOARDS``
+is enabled. Run the ``badger_rebuild_leaderboards`` command after enabling it,
+or after changing the tags of badges already awarded.
+
+Along with each user's score, the number of users with each score is kept.
+Working out a user's rank then takes summing over the distinct scores above
+theirs, rather than counting every user ahead of them.
+
+Badges are ranked by ``Badge.award_count``, which is always kept up to date.
+"""
+from django.db.models import Count, Sum
+
+import badger
+
+
+GLOBAL = ''
+
+
+def tag_board(tag_slug):
+    """Name of the leaderboard for badges with a tag"""
+    return tag_slug and 'tag:%s' % tag_slug or GLOBAL
+
+
+def boards_for(badge):
+    """Names of the leaderboards that awards of a badge count towards"""
+    boards = [GLOBAL]
+    if hasattr(badge, 'tags'):
+        boards.extend(tag_board(slug) for slug in
+                      badge.tags.values_list('slug', flat=True))
+    return boards
+
+
+def add(badge, amounts):
+    """Add to the scores of users on the leaderboards of a badge, from a
+    dict of amounts by user PK"""
+    if not badger.settings.LEADERBOARDS:
+        return
+    from badger.models import (LeaderboardEntry, LeaderboardScore, atomic,
+                               add_to_counters)
+    amounts = dict((pk, amount) for pk, amount in amounts.items() if amount)
+    if not amounts:
+        return
+
+    with atomic():
+        for board in boards_for(badge):
+            before = _scores(board, amounts)
+            add_to_counters(LeaderboardEntry.objects, 'user_id', 'score',
+                            amounts, board=board)
+            after = _scores(board, amounts)
+
+            # Move each user from the count of users at their old score to
+            # the one at their new score. Counters aren't taken below zero,
+            # so some may not have moved at all.
+            moves = dict()
+            for user_pk in amounts:
+                old_score = before.get(user_pk, 0)
+                score = after.get(user_pk, 0)
+                if score != old_score:
+                    moves[score] = moves.get(score, 0) + 1
+                    moves[old_score] = moves.get(old_score, 0) - 1
+            # Users without awards aren't ranked.
+            add_to_counters(LeaderboardScore.objects, 'score', 'users',
+                            dict((score, users)
+                                 for score, users in moves.items()
+                                 if score > 0),
+                            board=board)
+
+
+def _scores(board, user_pks):
+    """Scores on a board by user PK, for those of the users with one"""
+    from badger.models import LeaderboardEntry, chunked
+    scores = dict()
+    for chunk in chunked(sorted(user_pks)):
+        scores.update(LeaderboardEntry.objects
+                          .filter(board=board, user__in=chunk)
+                          .values_list('user', 'score'))
+    return scores
+
+
+def top(n=10, offset=0, tag_slug=None):
+    """A page of the top earners, as LeaderboardEntry objects with the user
+    and their rank. Users with the same score share a rank."""
+    from badger.models import LeaderboardEntry
+    board = tag_board(tag_slug)
+    entries = list(LeaderboardEntry.objects
+                       .filter(board=board, score__gt=0)
+                       .order_by('-score', 'user')
+                       .select_related('user')[offset:offset + n])
+    if entries:
+        rank = _rank_for_score(board, entries[0].score)
+        for idx, entry in enumerate(entries):
+            if idx and entry.score < entries[idx - 1].score:
+                # Everyone before this entry has a higher score.
+                rank = offset + idx + 1
+            entry.rank = rank
+    return entries
+
+
+def rank(user, tag_slug=None):
+    """A (rank, score) tuple for the user, or None without a score"""
+    from badger.models import LeaderboardEntry
+    board = tag_board(tag_slug)
+    scores = (LeaderboardEntry.objects.filter(board=board, user=user)
+                                      .values_list('score', flat=True))
+    if not scores or not scores[0]:
+        return None
+    return _rank_for_score(board, scores[0]), scores[0]
+
+
+def _rank_for_score(board, score):
+    from badger.models import LeaderboardScore
+    ahead = (LeaderboardScore.objects.filter(board=board, score__gt=score)
+                                     .aggregate(ahead=Sum('users'))['ahead'])
+    return (ahead or 0) + 1
+
+
+def most_awarded(n=10, offset=0, tag_slug=None):
+    """A page of the most awarded badges"""
+    from badger.models import Badge
+    qs = Badge.objects.filter(award_count__gt=0)
+    if tag_slug:
+        qs = qs.filter(tags__slug=tag_slug)
+    return list(qs.order_by('-award_count', 'pk')[offset:offset + n])
+
+
+def rebuild():
+    """Recount every leaderboard from scratch"""
+    from badger.models import (Award, Badge, LeaderboardEntry,
+                               LeaderboardScore, atomic, taggit)
+    awards = Award.objects.all()
+    boards = [(GLOBAL, awards)]
+    if taggit:
+        from django.contrib.contenttypes.models import ContentType
+        from taggit.models import TaggedItem
+        slugs = (TaggedItem.objects
+                     .filter(content_type=ContentType.objects
+                                                     .get_for_model(Badge))
+                     .values_list('tag__slug', flat=True).distinct())
+        boards.extend((tag_board(slug), awards.filter(badge__tags__slug=slug))
+                      for slug in sorted(slugs))
+
+    with atomic():
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardScore.objects.all().delete()
+        for board, qs in boards:
+            scores = dict(qs.values_list('user')
+                            .annotate(Count('pk')).order_by())
+            LeaderboardEntry.objects.bulk_create([
+                LeaderboardEntry(board=board, user_id=user_pk, score=score)
+                for user_pk, score in sorted(scores.items())],
+                batch_size=500)
+            users_by_score = dict()
+            for score in scores.values():
+                users_by_score[score] = users_by_score.get(score, 0) + 1
+            LeaderboardScore.objects.bulk_create([
+                LeaderboardScore(board=board, score=score, users=users)
+                for score, users in sorted(users_by_score.items())],
+                batch_size=500)
+    return len(boards)
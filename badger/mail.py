@@ -0,0 +1,113 @@
+"""Batched delivery of claim invitation emails
+
+Templates are compiled once per process and rendered against one shared
+context, and messages go out in batches of ``BADGER_MAIL_BATCH_SIZE`` over a
+single mail connection. ``BADGER_MAIL_RATE_LIMIT`` caps the messages sent per
+second, for mail services that throttle senders.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.mail import get_connection, EmailMessage
+from django.template import Context, TemplateDoesNotExist
+from django.template.loader import get_template
+
+import badger
+
+
+log = logging.getLogger('badger.mail')
+
+INVITATION_TEMPLATE = 'badger/deferred_award_%s.txt'
+
+_templates = dict()
+_templates_lock = threading.Lock()
+
+
+def compiled_template(name):
+    """Load and compile a template once, returns None if it's missing.
+    Missing templates are looked for again next time, in case they've been
+    added since."""
+    with _templates_lock:
+        if name not in _templates:
+            try:
+                template = get_template(name)
+            except TemplateDoesNotExist:
+                return None
+            # HACK: Django 1.8 wraps templates for its pluggable backends,
+            # and the wrapper won't take a Context without a warning.
+            _templates[name] = getattr(template, 'template', template)
+        return _templates[name]
+
+
+def render_claim_invitations(deferred_awards):
+    """Yield an EmailMessage inviting the recipient of each DeferredAward to
+    claim it"""
+    for da, message in _render_claim_invitations(deferred_awards):
+        yield message
+
+
+def _render_claim_invitations(deferred_awards):
+    from badger.models import DEFAULT_HTTP_PROTOCOL
+    subject_tmpl = compiled_template(INVITATION_TEMPLATE % 'subject')
+    body_tmpl = compiled_template(INVITATION_TEMPLATE % 'body')
+    if not subject_tmpl or not body_tmpl:
+        return
+
+    context = Context(dict(protocol=DEFAULT_HTTP_PROTOCOL,
+                           current_site=Site.objects.get_current()))
+    for da in deferred_awards:
+        context.update(dict(deferred_award=da, badge=da.badge))
+        try:
+            # Email subjects can't contain newlines, so we strip it. It makes
+            # the template less fragile.
+            subject = subject_tmpl.render(context).strip()
+            body = body_tmpl.render(context)
+        finally:
+            context.pop()
+        yield da, EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL,
+                               [da.email])
+
+
+def send_claim_invitations(deferred_awards, connection=None, done=None):
+    """Send claim invitations for DeferredAwards in batches over one mail
+    connection, returns the number of messages sent. done() is called with
+    each DeferredAward once its batch is sent."""
+    deferred_awards = list(deferred_awards)
+    if not deferred_awards:
+        return 0
+    batch_size = max(1, badger.settings.MAIL_BATCH_SIZE)
+    rate = badger.settings.MAIL_RATE_LIMIT
+    connection = connection or get_connection(fail_silently=False)
+
+    sent, started = 0, time.time()
+    batch = []
+    opened = connection.open()
+    try:
+        for da, message in _render_claim_invitations(deferred_awards):
+            batch.append((da, message))
+            if len(batch) >= batch_size:
+                sent += _send_batch(connection, batch, sent, started, rate,
+                                    done)
+                batch = []
+        if batch:
+            sent += _send_batch(connection, batch, sent, started, rate, done)
+    finally:
+        if opened:
+            connection.close()
+    return sent
+
+
+def _send_batch(connection, batch, sent, started, rate, done):
+    if rate:
+        # Wait until sending this batch keeps us within the rate limit.
+        delay = started + float(sent + len(batch)) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    count = connection.send_messages([message for da, message in batch]) or 0
+    if done:
+        for da, message in batch:
+            done(da)
+    return count
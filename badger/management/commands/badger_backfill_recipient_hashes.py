@@ -0,0 +1,31 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from badger.models import Award, atomic, chunked
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Store the salt and recipient hash of awards without them, for '
+            'looking up awards by recipient hash')
+    option_list = BaseCommand.option_list + (
+        make_option('--all', dest='all', action='store_true', default=False,
+                    help='Work out every award again, not just those '
+                         'without a hash'),
+    )
+
+    def handle(self, *args, **options):
+        qs = Award.admin_objects.all()
+        if not options['all']:
+            qs = qs.filter(recipient_hash='')
+        pks = list(qs.order_by('pk').values_list('pk', flat=True))
+        for chunk in chunked(pks):
+            with atomic():
+                for award in (Award.admin_objects.filter(pk__in=chunk)
+                                  .select_related('user')
+                                  .only('pk', 'badge', 'user__email')):
+                    award.store_recipient_hash()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Stored recipient hashes for %s awards\n'
+                              % len(pks))
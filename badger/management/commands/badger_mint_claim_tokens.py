@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from badger.models import Badge
+from badger.claim_tokens import mint_tokens, new_claim_group
+
+
+class Command(BaseCommand):
+    args = '<badge slug> <amount>'
+    help = ('Print signed claim tokens for a badge, one per line, without '
+            'storing anything')
+    option_list = BaseCommand.option_list + (
+        make_option('--group', dest='claim_group', type='int', default=None,
+                    help='Claim group to mint in, instead of a new one'),
+        make_option('--start', dest='start', type='int', default=0,
+                    help='Serial number of the first token'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: %s' % self.args)
+        slug, amount = args
+        try:
+            badge = Badge.objects.get(slug=slug)
+        except Badge.DoesNotExist:
+            raise CommandError('No such badge, %s' % slug)
+
+        claim_group = options['claim_group'] or new_claim_group()
+        self.stderr.write('Claim group %s\n' % claim_group)
+        for token in mint_tokens(badge, int(amount), claim_group,
+                                 options['start']):
+            self.stdout.write('%s\n' % token)
@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+import badger
+from badger import publishing
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Write the JSON of every award assertion and badge to storage, '
+            'removing any left over, see BADGER_PUBLISH_ASSERTIONS')
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', dest='threads', type='int', default=None,
+                    help='Writer threads, default BADGER_WORKER_THREADS'),
+        make_option('--batch', dest='batch', type='int', default=None,
+                    help='Badges or awards per batch'),
+    )
+
+    def handle(self, *args, **options):
+        if not badger.settings.PUBLISH_ASSERTIONS:
+            self.stderr.write('BADGER_PUBLISH_ASSERTIONS is disabled\n')
+        threads = options['threads'] or badger.settings.WORKER_THREADS
+        badges, awards = publishing.publish_all(threads=threads,
+                                                batch_size=options['batch'])
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Published %s badges and %s awards\n' %
+                              (badges, awards))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from badger import leaderboards
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Recount the leaderboards of users by awards from scratch'
+
+    def handle(self, *args, **options):
+        count = leaderboards.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Rebuilt %s leaderboards\n' % count)
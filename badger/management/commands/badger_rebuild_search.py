@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from badger import search
+from badger.models import Badge, Award
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Index every badge and award for search from scratch, see '
+            'BADGER_SEARCH_BACKEND')
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        counts = [backend.rebuild(model) for model in (Badge, Award)]
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Indexed %s badges and %s awards\n'
+                              % tuple(counts))
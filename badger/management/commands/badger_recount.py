@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from badger.models import (Badge, Award, DeferredAward, UserAwardCount,
+                           atomic, chunked)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Recount awards and deferred awards per badge and awards per '
+            'user, repairing the counters')
+
+    def handle(self, *args, **options):
+        with atomic():
+            badge_counts = dict(
+                (field, self._count(qs, 'badge'))
+                for field, qs in (('award_count', Award.objects),
+                                  ('deferred_award_count',
+                                   DeferredAward.objects)))
+            user_counts = self._count(Award.objects, 'user')
+
+            Badge.objects.update(award_count=0, deferred_award_count=0)
+            for field, counts in badge_counts.items():
+                for count, pks in self._group(counts).items():
+                    for chunk in chunked(pks):
+                        (Badge.objects.filter(pk__in=chunk)
+                                      .update(**{field: count}))
+
+            UserAwardCount.objects.all().delete()
+            UserAwardCount.objects.bulk_create([
+                UserAwardCount(user_id=user_pk, award_count=count)
+                for user_pk, count in sorted(user_counts.items())],
+                batch_size=500)
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Recounted awards for %s badges and %s users\n'
+                              % (Badge.objects.count(), len(user_counts)))
+
+    def _count(self, qs, field):
+        """Counts of rows by the value of a field"""
+        return dict(qs.values_list(field).annotate(Count('pk')).order_by())
+
+    def _group(self, counts):
+        """PKs by count, so each distinct count takes one UPDATE"""
+        pks_by_count = dict()
+        for pk, count in counts.items():
+            pks_by_count.setdefault(count, []).append(pk)
+        return pks_by_count
@@ -0,0 +1,47 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from badger.stats import signal_stats, cache_stats
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Show call counts and timings of badger signal receivers, see '
+            'BADGER_SIGNAL_STATS, and hit ratios of badger caches')
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', dest='reset', action='store_true',
+                    default=False,
+                    help='Clear the statistics after showing them'),
+    )
+
+    def handle(self, *args, **options):
+        rows = signal_stats.snapshot()
+        if not rows:
+            if not signal_stats.is_enabled():
+                self.stderr.write('BADGER_SIGNAL_STATS is disabled\n')
+            self.stdout.write('No signal receiver calls recorded\n')
+        else:
+            self.stdout.write('%-28s %-50s %8s %10s %10s %10s %6s\n' % (
+                'signal', 'receiver', 'calls', 'total ms', 'avg ms',
+                'max ms', 'errors'))
+            for row in rows:
+                self.stdout.write(
+                    '%-28s %-50s %8d %10.1f %10.2f %10.2f %6d\n' % (
+                        row['signal'], row['receiver'], row['calls'],
+                        row['total'] * 1000,
+                        row['total'] * 1000 / row['calls'],
+                        row['max'] * 1000, row['errors']))
+
+        cache_rows = cache_stats.snapshot()
+        if cache_rows:
+            self.stdout.write('\n%-28s %8s %8s %8s\n' % (
+                'cache', 'hits', 'misses', 'ratio'))
+            for row in cache_rows:
+                self.stdout.write('%-28s %8d %8d %7.1f%%\n' % (
+                    row['cache'], row['hits'], row['misses'],
+                    row['ratio'] * 100))
+
+        if options['reset']:
+            signal_stats.reset()
+            cache_stats.reset()
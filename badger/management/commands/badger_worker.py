@@ -0,0 +1,39 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+import badger
+from badger import outbox
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Carry out award side effects waiting in the outbox, see '
+            'BADGER_ASYNC_SIDE_EFFECTS')
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', dest='threads', type='int', default=None,
+                    help='Worker threads, default BADGER_WORKER_THREADS'),
+        make_option('--batch', dest='batch', type='int', default=None,
+                    help='Messages per batch, default '
+                         'BADGER_WORKER_BATCH_SIZE'),
+        make_option('--sleep', dest='sleep', type='float', default=1.0,
+                    help='Seconds to wait when the outbox is empty'),
+        make_option('--once', dest='once', action='store_true',
+                    default=False,
+                    help='Exit once the outbox is empty'),
+    )
+
+    def handle(self, *args, **options):
+        threads = options['threads'] or badger.settings.WORKER_THREADS
+        total = 0
+        while True:
+            count = outbox.process_batch(size=options['batch'],
+                                         threads=threads)
+            total += count
+            if not count:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Handled %s outbox messages\n' % total)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('badger', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaimTokenRedemption',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('claim_group', models.IntegerField()),
+                ('serial', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('award', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='badger.Award', null=True)),
+                ('badge', models.ForeignKey(to='badger.Badge')),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='claimtokenredemption',
+            unique_together=set([('badge', 'claim_group', 'serial')]),
+        ),
+    ]
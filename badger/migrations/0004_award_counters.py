@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.conf import settings
+
+
+def count_awards(apps, schema_editor):
+    """Start the counters off from the awards already there"""
+    Badge = apps.get_model('badger', 'Badge')
+    Award = apps.get_model('badger', 'Award')
+    DeferredAward = apps.get_model('badger', 'DeferredAward')
+    UserAwardCount = apps.get_model('badger', 'UserAwardCount')
+
+    awards = Award.objects.filter(hidden=False)
+    for field, qs in (('award_count', awards),
+                      ('deferred_award_count', DeferredAward.objects)):
+        for badge_pk, count in (qs.values_list('badge')
+                                  .annotate(Count('pk')).order_by()):
+            Badge.objects.filter(pk=badge_pk).update(**{field: count})
+    UserAwardCount.objects.bulk_create([
+        UserAwardCount(user_id=user_pk, award_count=count)
+        for user_pk, count in (awards.values_list('user')
+                                     .annotate(Count('pk')).order_by())],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('badger', '0003_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAwardCount',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('award_count', models.PositiveIntegerField(default=0)),
+                ('user', models.OneToOneField(related_name='badger_award_count', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='badge',
+            name='award_count',
+            field=models.PositiveIntegerField(default=0, help_text=b'Number of visible awards of this badge', editable=False),
+        ),
+        migrations.AddField(
+            model_name='badge',
+            name='deferred_award_count',
+            field=models.PositiveIntegerField(default=0, help_text=b'Number of deferred awards waiting to be claimed', editable=False),
+        ),
+        migrations.RunPython(count_awards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('badger', '0004_award_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('board', models.CharField(default=b'', max_length=128, blank=True)),
+                ('score', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(related_name='badger_leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LeaderboardScore',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('board', models.CharField(default=b'', max_length=128, blank=True)),
+                ('score', models.PositiveIntegerField()),
+                ('users', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='badge',
+            name='award_count',
+            field=models.PositiveIntegerField(default=0, help_text=b'Number of visible awards of this badge', editable=False, db_index=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='leaderboardscore',
+            unique_together=set([('board', 'score')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='leaderboardentry',
+            unique_together=set([('board', 'user')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='leaderboardentry',
+            index_together=set([('board', 'score')]),
+        ),
+    ]
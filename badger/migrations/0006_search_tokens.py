@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from badger.search import token_weights
+
+
+BATCH_SIZE = 500
+
+
+def index_existing(apps, schema_editor):
+    """Index the badges and awards already there, a batch of tokens at a
+    time"""
+    SearchToken = apps.get_model('badger', 'SearchToken')
+    for model_name, fields in (('badge', ('title', 'slug', 'description')),
+                               ('award', ('description',))):
+        model = apps.get_model('badger', model_name)
+        tokens = list()
+        for instance in model.objects.only('pk', *fields).iterator():
+            for token, weight in sorted(token_weights(instance,
+                                                      fields).items()):
+                tokens.append(SearchToken(model='badger.%s' % model_name,
+                                          object_id=instance.pk,
+                                          token=token, weight=weight))
+            if len(tokens) >= BATCH_SIZE:
+                SearchToken.objects.bulk_create(tokens, batch_size=BATCH_SIZE)
+                tokens = list()
+        SearchToken.objects.bulk_create(tokens, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badger', '0005_leaderboards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('model', models.CharField(max_length=64)),
+                ('object_id', models.PositiveIntegerField()),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='searchtoken',
+            index_together=set([('model', 'object_id', 'token'), ('model', 'token', 'object_id')]),
+        ),
+        migrations.RunPython(index_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badger', '0006_search_tokens'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='award',
+            index_together=set([('modified', 'id'), ('user', 'modified', 'id'), ('badge', 'modified', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='badge',
+            index_together=set([('creator', 'modified', 'id'), ('modified', 'id')]),
+        ),
+    ]
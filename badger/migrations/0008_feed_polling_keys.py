@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badger', '0007_cursor_pagination_keys'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='award',
+            index_together=set([('badge', 'created', 'id'), ('badge', 'modified', 'id'), ('user', 'modified', 'id'), ('user', 'created', 'id'), ('modified', 'id'), ('created', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='badge',
+            index_together=set([('creator', 'modified', 'id'), ('created', 'id'), ('modified', 'id')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badger', '0008_feed_polling_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='award',
+            name='recipient_hash',
+            field=models.CharField(default=b'', max_length=71, db_index=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='award',
+            name='salt',
+            field=models.CharField(default=b'', max_length=32, blank=True),
+        ),
+    ]
@@ -1,9 +1,11 @@
+import copy
 import hashlib
 import json
 import logging
 import os.path
 import random
 import re
+from contextlib import contextmanager
 from datetime import datetime, timedelta, tzinfo
 from os.path import dirname
 from time import time, gmtime, strftime
@@ -11,19 +13,18 @@ from urlparse import urljoin
 
 import django
 from django.conf import settings
+from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
-from django.db.models import signals, Q, Count, Max
+from django.db import models, IntegrityError
+from django.db.models import signals, F, Count, Max
 from django.db.models.fields.files import FieldFile, ImageFieldFile
-from django.core.mail import send_mail
 from django.core.exceptions import ValidationError
 from django.core.files.storage import FileSystemStorage
 from django.core.files.base import ContentFile
 from django.contrib.auth.models import User, AnonymousUser
 from django.contrib.sites.models import Site
 from django.contrib.contenttypes.models import ContentType
-from django.template import Context, TemplateDoesNotExist
-from django.template.loader import render_to_string
+from django.utils import timezone
 
 # HACK: Django 1.2 is missing receiver and user_logged_in
 try:
@@ -48,6 +49,41 @@ try:
 except ImportError:
     from StringIO import StringIO
 
+# HACK: Django < 1.6 is missing atomic
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    from django.db import transaction
+
+    @contextmanager
+    def atomic(using=None):
+        """Commit the block on success at the top level, like atomic(), and
+        use a savepoint when nested, so that errors roll back only the block
+        rather than committing or aborting the outer transaction"""
+        if not transaction.is_managed(using=using):
+            with transaction.commit_on_success(using=using):
+                yield
+            return
+        sid = transaction.savepoint(using=using)
+        try:
+            yield
+        except Exception:
+            transaction.savepoint_rollback(sid, using=using)
+            raise
+        transaction.savepoint_commit(sid, using=using)
+
+try:
+    from secrets import choice as random_choice
+except ImportError:
+    # HACK: Python < 3.6 has no secrets module, which wraps this anyway
+    random_choice = random.SystemRandom().choice
+
+try:
+    from django.db.models import Case, When
+except ImportError:
+    # HACK: Django < 1.8 has no conditional expressions
+    Case = When = None
+
 try:
     from PIL import Image
 except ImportError:
@@ -70,8 +106,17 @@ from .signals import (badge_will_be_awarded, badge_was_awarded,
                       nomination_will_be_approved, nomination_was_approved,
                       nomination_will_be_accepted, nomination_was_accepted,
                       nomination_will_be_rejected, nomination_was_rejected,
-                      user_will_be_nominated, user_was_nominated)
+                      user_will_be_nominated, user_was_nominated,
+                      award_batch)
+from .prerequisites import graph as prerequisite_graph
+from .autocomplete import prefix_index
+from .caching import (awarded_badges, bump_version, feed_stamp, get_version,
+                      image_cache, obi_cache)
+from .buffers import progress_buffer
+from . import baking, leaderboards, mail, outbox, publishing, search
+
 
+log = logging.getLogger('badger.models')
 
 OBI_VERSION = "0.5.0"
 
@@ -100,12 +145,25 @@ DEFAULT_BADGE_IMAGE_URL = getattr(settings, 'BADGER_DEFAULT_BADGE_IMAGE_URL',
 
 TIME_ZONE_OFFSET = getattr(settings, "TIME_ZONE_OFFSET", timedelta(0))
 
+# Recipient hashes as made by Award.make_recipient_hash()
+RECIPIENT_HASH_RE = re.compile(r'^sha256\$[0-9a-f]{64}$')
+
 MK_UPLOAD_TMPL = '%(base)s/%(h1)s/%(h2)s/%(hash)s_%(field_fn)s_%(now)s_%(rand)04d.%(ext)s'
 
 DEFAULT_HTTP_PROTOCOL = getattr(settings, "DEFAULT_HTTP_PROTOCOL", "http")
 
 CLAIM_CODE_LENGTH = getattr(settings, "CLAIM_CODE_LENGTH", 6)
 
+# Alphanumeric characters for claim codes, avoiding ambiguously similar shapes
+CLAIM_CODE_CHARS = '3479acefhjkmnprtuvwxy'
+
+# Times to retry inserting a batch of claim codes that lost a race
+CLAIM_CODE_ATTEMPTS = 3
+
+# Max # of rows per query / INSERT in bulk operations. Keeps IN clauses under
+# the bound parameter limits of databases like sqlite3.
+BULK_CHUNK_SIZE = getattr(settings, "BADGER_BULK_CHUNK_SIZE", 500)
+
 
 def _document_django_model(cls):
     """Adds meta fields to the docstring for better autodoccing"""
@@ -187,6 +245,61 @@ def slugify(txt):
     return txt
 
 
+def chunked(items, size=BULK_CHUNK_SIZE):
+    """Split a list into a series of lists no longer than size"""
+    for idx in range(0, len(items), size):
+        yield items[idx:idx + size]
+
+
+def add_to_counter(qs, field, amount):
+    """Atomically add to a counter field on the rows of a queryset, leaving
+    alone any rows it would take below zero"""
+    if amount < 0:
+        qs = qs.filter(**{'%s__gte' % field: -amount})
+    return qs.update(**{field: F(field) + amount})
+
+
+def add_to_counters(manager, key_field, field, amounts, **filters):
+    """Add to a counter field on rows found by their key_field, from a dict
+    of amounts by key. Rows missing for positive amounts are created, with
+    the filters as further field values."""
+    keys_by_amount = dict()
+    for key, amount in amounts.items():
+        if amount:
+            keys_by_amount.setdefault(amount, []).append(key)
+
+    qs = manager.filter(**filters)
+    for amount, keys in keys_by_amount.items():
+        for chunk in chunked(sorted(keys)):
+            chunk_qs = qs.filter(**{'%s__in' % key_field: chunk})
+            updated = add_to_counter(chunk_qs, field, amount)
+            if amount < 0 or updated == len(chunk):
+                continue
+            missing = chunk
+            if updated:
+                existing = set(chunk_qs.values_list(key_field, flat=True))
+                missing = [key for key in chunk if key not in existing]
+
+            def new_row(key):
+                values = dict(filters)
+                values[key_field] = key
+                values[field] = amount
+                return manager.model(**values)
+            try:
+                with atomic():
+                    manager.bulk_create([new_row(key) for key in missing])
+            except IntegrityError:
+                # Someone else created some of these rows in the meantime,
+                # so add to theirs.
+                for key in missing:
+                    try:
+                        with atomic():
+                            new_row(key).save(force_insert=True)
+                    except IntegrityError:
+                        add_to_counter(qs.filter(**{key_field: key}), field,
+                                       amount)
+
+
 def get_permissions_for(self, user):
     """Mixin method to collect permissions for a model instance"""
     pre = 'allows_'
@@ -298,40 +411,18 @@ class SearchManagerMixin(object):
         """
         return [normspace(' ', (t[0] or t[1]).strip()) for t in findterms(query_string)]
 
-    # See: http://www.julienphalip.com/blog/2008/08/16/adding-search-django-site-snap/
-    def _get_query(self, query_string, search_fields):
-        """
-        Returns a query, that is a combination of Q objects. That
-        combination aims to search keywords within a model by testing
-        the given search fields.
-
-        """
-        query = None  # Query to search for every search term
-        terms = self._normalize_query(query_string)
-        for term in terms:
-            or_query = None  # Query to search for a given term in each field
-            for field_name in search_fields:
-                q = Q(**{"%s__icontains" % field_name: term})
-                if or_query is None:
-                    or_query = q
-                else:
-                    or_query = or_query | q
-            if query is None:
-                query = or_query
-            else:
-                query = query & or_query
-        return query
-
     def search(self, query_string, sort='title'):
-        """Quick and dirty keyword search on submissions"""
-        # TODO: Someday, replace this with something like Sphinx or another real
-        # search engine
+        """Keyword search on search_fields, most important first, through
+        the backend set by BADGER_SEARCH_BACKEND. A sort of 'relevance'
+        puts the best matches first."""
         strip_qs = query_string.strip()
         if not strip_qs:
             return self.all_sorted(sort).order_by('-modified')
         else:
-            query = self._get_query(strip_qs, self.search_fields)
-            return self.all_sorted(sort).filter(query).order_by('-modified')
+            return search.get_backend().search(
+                self.all_sorted(sort).order_by('-modified'),
+                self._normalize_query(strip_qs), self.search_fields,
+                ranked=(sort == 'relevance'))
 
     def all_sorted(self, sort=None):
         """Apply to .all() one of the sort orders supported for views"""
@@ -362,6 +453,10 @@ class BadgeDeferredAwardManagementNotAllowedException(BadgeException):
     """Attempt to manage deferred awards not allowed."""
 
 
+class BadgePrerequisiteCycleException(BadgeException):
+    """Attempt to make a badge a prerequisite of itself, however indirectly."""
+
+
 class BadgeManager(models.Manager, SearchManagerMixin):
     """Manager for Badge model objects"""
     search_fields = ('title', 'slug', 'description', )
@@ -382,35 +477,54 @@ class BadgeManager(models.Manager, SearchManagerMixin):
             return True
         return False
 
-    def top_tags(self, min_count=2, limit=20):
-        """Assemble list of top-used tags"""
-        if not taggit:
-            return []
+    def for_feed(self):
+        """Badges along with their creators, shown in feed items"""
+        return self.select_related('creator')
 
-        # TODO: There has got to be a better way to do this. I got lost in
-        # Django model bits, though.
+    tag_counts_key = 'badger:badge_tag_counts'
 
-        # Gather list of tags sorted by use frequency
+    def tag_counts(self):
+        """List of tags used on badges, each in a dict with the number of
+        badges using it, most used first. Cached until badge tags change."""
+        if not taggit:
+            return []
+        timeout = badger.settings.TAG_COUNTS_CACHE_TIMEOUT
+        if not timeout:
+            return self._count_tags()
+        version = get_version('%s:version' % self.tag_counts_key)
+        key = '%s:%s' % (self.tag_counts_key, version)
+        tag_counts = cache.get(key)
+        if tag_counts is None:
+            tag_counts = self._count_tags()
+            cache.set(key, tag_counts, timeout)
+        return tag_counts
+
+    def _count_tags(self):
         ct = ContentType.objects.get_for_model(Badge)
-        tag_counts = (TaggedItem.objects
-            .values('tag')
-            .annotate(count=Count('id'))
-            .filter(content_type=ct, count__gte=min_count)
-            .order_by('-count'))[:limit]
-
-        # Gather set of tag IDs from list
-        tag_ids = set(x['tag'] for x in tag_counts)
-
-        # Gather and map tag objects to IDs
-        tags_by_id = dict((x.pk, x)
-            for x in Tag.objects.filter(pk__in=tag_ids))
+        rows = (TaggedItem.objects.filter(content_type=ct)
+                                  .values('tag', 'tag__name', 'tag__slug')
+                                  .annotate(count=Count('id'))
+                                  .order_by('-count', 'tag__name'))
+        return [dict(count=row['count'],
+                     tag=Tag(pk=row['tag'], name=row['tag__name'],
+                             slug=row['tag__slug']))
+                for row in rows]
+
+    def invalidate_tag_counts(self):
+        """Forget cached tag counts everywhere"""
+        bump_version('%s:version' % self.tag_counts_key)
 
-        # Join tag objects up with counts
-        tags_with_counts = [
-            dict(count=x['count'], tag=tags_by_id[x['tag']])
-            for x in tag_counts]
-
-        return tags_with_counts
+    def top_tags(self, min_count=2, limit=20):
+        """Assemble list of top-used tags"""
+        return [x for x in self.tag_counts()
+                if x['count'] >= min_count][:limit]
+
+    def tag_named(self, name):
+        """Find a tag used on badges by name, or None"""
+        for x in self.tag_counts():
+            if x['tag'].name == name:
+                return x['tag']
+        return None
 
 
 @_document_django_model
@@ -451,9 +565,27 @@ class Badge(models.Model):
     created = models.DateTimeField(auto_now_add=True, blank=False)
     modified = models.DateTimeField(auto_now=True, blank=False)
 
+    # Kept up to date as awards and deferred awards come and go, see
+    # badger_recount to repair them.
+    award_count = models.PositiveIntegerField(default=0, editable=False,
+            db_index=True,
+            help_text='Number of visible awards of this badge')
+    deferred_award_count = models.PositiveIntegerField(default=0,
+            editable=False,
+            help_text='Number of deferred awards waiting to be claimed')
+
+    counter_fields = ('award_count', 'deferred_award_count')
+
     class Meta:
         unique_together = ('title', 'slug')
         ordering = ['-modified', '-created']
+        # HACK: Django < 1.5 has no index_together
+        if django.VERSION >= (1, 5):
+            # Keys for cursor pagination, see badger.pagination, and for
+            # polling feeds, see badger.feeds
+            index_together = [('modified', 'id'),
+                              ('creator', 'modified', 'id'),
+                              ('created', 'id')]
         permissions = (
             ('manage_deferredawards',
              _(u'Can manage deferred awards for this badge')),
@@ -482,6 +614,15 @@ class Badge(models.Model):
         if not self.slug:
             self.slug = slugify(self.title)
 
+        # Counters are only ever changed in the database, so don't overwrite
+        # them with whatever this instance was loaded with.
+        # HACK: Django < 1.5 can't save only some fields
+        if (not self._state.adding and 'update_fields' not in kwargs and
+                django.VERSION >= (1, 5)):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.local_fields
+                if not f.primary_key and f.name not in self.counter_fields]
+
         super(Badge, self).save(**kwargs)
 
         if notification:
@@ -548,6 +689,14 @@ class Badge(models.Model):
             raise BadgeDeferredAwardManagementNotAllowedException()
         return (DeferredAward.objects.generate(self, user, amount, reusable))
 
+    def mint_claim_tokens(self, user, amount=10, claim_group=None, start=0):
+        """Generate signed claim tokens with a claim group, without storing
+        anything until they're claimed. See badger.claim_tokens"""
+        if not self.allows_manage_deferred_awards_by(user):
+            raise BadgeDeferredAwardManagementNotAllowedException()
+        from badger.claim_tokens import ClaimToken
+        return ClaimToken.mint(self, amount, claim_group, start)
+
     def get_claim_group(self, claim_group):
         """Get all the deferred awards for a claim group code"""
         return DeferredAward.objects.filter(claim_group=claim_group)
@@ -601,6 +750,176 @@ class Badge(models.Model):
                                     creator=awarder,
                                     description=description)
 
+    def award_to_many(self, awardees, awarder=None, description=''):
+        """Award this badge to many users and / or email addresses at once
+
+        Existing awards are looked up in bulk, missing Award and DeferredAward
+        rows are inserted in batches, and prerequisites of dependent badges
+        are checked once for the whole batch.
+
+        :arg awardees: list of User instances and / or email addresses
+        :arg awarder: User who awarded this Badge, defaults to badge creator
+        :arg description: Explanation and evidence for the awards
+
+        :returns: list of (awardee, result) tuples in the order given, where
+            result is the Award (new or existing), a new DeferredAward, or
+            None if an unclaimed DeferredAward of this unique badge already
+            exists for the email address
+
+        :raise BadgeAwardNotAllowedException: if the awarder is not allowed
+            to award this badge
+
+        """
+        if not awarder:
+            awarder = self.creator
+
+        if not self.allows_award_to(awarder):
+            raise BadgeAwardNotAllowedException()
+
+        users_by_pk, emails = dict(), list()
+        for awardee in awardees:
+            if isinstance(awardee, basestring):
+                if awardee not in emails:
+                    emails.append(awardee)
+            else:
+                users_by_pk[awardee.pk] = awardee
+
+        # Look up users for email addresses, using the most recently created
+        # user for each address like award_to() does.
+        users_by_email = dict()
+        for chunk in chunked(emails):
+            for user in (User.objects.filter(email__in=chunk)
+                                     .order_by('date_joined')):
+                users_by_email[user.email] = user
+        for user in users_by_email.values():
+            users_by_pk.setdefault(user.pk, user)
+
+        results = dict()
+        with award_batch.collect():
+            with atomic():
+                awards_by_user = self._award_to_users(users_by_pk.values(),
+                                                      awarder, description)
+                for email, user in users_by_email.items():
+                    results[email] = awards_by_user[user.pk]
+                for user_pk, award in awards_by_user.items():
+                    results[user_pk] = award
+
+                pending = [e for e in emails if e not in users_by_email]
+                deferreds, invites = self._defer_to_emails(
+                    pending, awarder, description)
+                results.update(deferreds)
+
+        if invites:
+            # Sent once the awards are in, which a mail server being down
+            # shouldn't undo.
+            try:
+                mail.send_claim_invitations(invites)
+            except Exception:
+                log.exception('Failed to send %s claim invitations for %s' %
+                              (len(invites), self.slug))
+
+        return [(awardee, results[isinstance(awardee, basestring) and
+                                  awardee or awardee.pk])
+                for awardee in awardees]
+
+    def _award_to_users(self, users, awarder, description):
+        """Bulk part of award_to_many() for users, returns awards by user PK"""
+        awards_by_user = dict()
+        if self.unique:
+            for chunk in chunked([u.pk for u in users]):
+                for award in Award.objects.filter(badge=self, user__in=chunk):
+                    awards_by_user.setdefault(award.user_id, award)
+
+        new_awards = [Award(user=user, badge=self, creator=awarder,
+                            description=description)
+                      for user in users if user.pk not in awards_by_user]
+        if not new_awards:
+            return awards_by_user
+
+        for award in new_awards:
+            badge_will_be_awarded.send(sender=Award, award=award)
+
+        # Bulk inserts don't give us primary keys, so fetch the new awards
+        # back out by looking past the highest existing ID.
+        last_pk = (Award.admin_objects.aggregate(last_pk=Max('pk'))
+                                      ['last_pk'] or 0)
+        Award.objects.bulk_create(new_awards, batch_size=BULK_CHUNK_SIZE)
+        users_by_pk = dict((a.user.pk, a.user) for a in new_awards)
+        created = list()
+        for chunk in chunked(users_by_pk.keys()):
+            qs = Award.objects.filter(badge=self, user__in=chunk,
+                                      pk__gt=last_pk)
+            for award in qs:
+                # Bulk inserts skip post_save, so update the cache by hand.
+                awarded_badges.add(award.user_id, self.pk)
+                # Reuse the user instances we already have on hand.
+                award.user = users_by_pk[award.user_id]
+                award.badge = self
+                award.store_recipient_hash()
+                awards_by_user[award.user_id] = award
+                created.append(award)
+
+        feed_stamp.bump()
+
+        # Counters too.
+        add_to_counter(Badge.objects.filter(pk=self.pk), 'award_count',
+                       len(created))
+        UserAwardCount.objects.add(dict((a.user_id, 1) for a in created))
+        leaderboards.add(self, dict((a.user_id, 1) for a in created))
+        search.get_backend().index(Award, created, created=True)
+        publishing.publish_changed(award_ids=[a.pk for a in created])
+
+        if badger.settings.ASYNC_SIDE_EFFECTS:
+            outbox.enqueue(outbox.AWARD_SIDE_EFFECTS,
+                           [award.pk for award in created])
+        else:
+            for award in created:
+                award._after_create()
+
+            prerequisite_graph.cascade_many(users_by_pk.values(), [self.pk])
+
+        for chunk in chunked(users_by_pk.keys()):
+            Progress.objects.filter(badge=self, user__in=chunk).delete()
+
+        return awards_by_user
+
+    def _defer_to_emails(self, emails, awarder, description):
+        """Bulk part of award_to_many() for emails with no matching users,
+        returns new deferred awards by email, and those still to be sent
+        claim invitations"""
+        results, skip_emails, has_deferreds = dict(), set(), set()
+        for chunk in chunked(emails):
+            qs = DeferredAward.objects.filter(email__in=chunk)
+            for email, badge_pk in qs.values_list('email', 'badge'):
+                has_deferreds.add(email)
+                if self.unique and badge_pk == self.pk:
+                    skip_emails.add(email)
+                    results[email] = None
+
+        new_deferreds = [DeferredAward(badge=self, email=email,
+                                       creator=awarder,
+                                       description=description)
+                         for email in emails if email not in skip_emails]
+        DeferredAward.objects.bulk_create(new_deferreds,
+                                          batch_size=BULK_CHUNK_SIZE)
+        add_to_counter(Badge.objects.filter(pk=self.pk),
+                       'deferred_award_count', len(new_deferreds))
+        codes = [da.claim_code for da in new_deferreds]
+        invites = []
+        for chunk in chunked(codes):
+            for da in DeferredAward.objects.filter(claim_code__in=chunk):
+                da.badge = self
+                results[da.email] = da
+                if da.email not in has_deferreds:
+                    invites.append(da)
+
+        if badger.settings.ASYNC_SIDE_EFFECTS:
+            outbox.enqueue(outbox.DEFERRED_AWARD_INVITE,
+                           [da.pk for da in invites])
+            invites = []
+
+        return results, invites
+
     def check_prerequisites(self, awardee, dep_badge, award):
         """Check the prerequisites for this badge. If they're all met, award
         this badge to the user."""
@@ -616,7 +935,7 @@ class Badge(models.Model):
 
     def is_awarded_to(self, user):
         """Has this badge been awarded to the user?"""
-        return Award.objects.filter(user=user, badge=self).count() > 0
+        return self.pk in Award.objects.awarded_badge_ids(user)
 
     def progress_for(self, user):
         """Get or create (but not save) a progress record for a user"""
@@ -626,6 +945,9 @@ class Badge(models.Model):
         except Progress.DoesNotExist:
             # If none found, create a new one but don't save it yet.
             p = Progress(user=user, badge=self)
+        if badger.settings.PROGRESS_FLUSH_INTERVAL:
+            p.counter = ((p.counter or 0) +
+                         progress_buffer.pending(self.pk, user.pk))
         return p
 
     def allows_nominate_for(self, user):
@@ -699,10 +1021,85 @@ class Badge(models.Model):
 
         return data
 
-
-class AwardManager(models.Manager):
-    def get_query_set(self):
-        return super(AwardManager, self).get_query_set().exclude(hidden=True)
+    def image_cache_key(self):
+        """Key for this badge's image in image_cache, shared by all badges
+        using the default image"""
+        if not self.image:
+            return (None, DEFAULT_BADGE_IMAGE)
+        return (self.pk, self.image.name)
+
+    def read_image(self):
+        """Bytes of this badge's image, or of the default badge image"""
+        if not self.image:
+            return open(DEFAULT_BADGE_IMAGE, 'rb').read()
+        self.image.open()
+        try:
+            return self.image.file.read()
+        finally:
+            self.image.close()
+
+    def image_png(self):
+        """This badge's image as PNG data, with its chunks as found by
+        baking.iter_chunks(), from image_cache. Raises IOError for images
+        that can't be read as PNG."""
+        return image_cache.get(self.image_cache_key(), 'png',
+                               self._build_image_png,
+                               size=lambda png: len(png[0]))
+
+    def _build_image_png(self):
+        data = self.read_image()
+        try:
+            return data, list(baking.iter_chunks(data))
+        except baking.BakingError:
+            # Not a PNG, so convert it to one.
+            png = StringIO()
+            Image.open(StringIO(data)).save(png, "PNG")
+            data = png.getvalue()
+            return data, list(baking.iter_chunks(data))
+
+
+class AwardManager(models.Manager, SearchManagerMixin):
+    search_fields = ('description', )
+
+    def get_queryset(self):
+        manager = super(AwardManager, self)
+        if hasattr(manager, 'get_queryset'):
+            qs = manager.get_queryset()
+        else:
+            qs = manager.get_query_set()
+        return qs.exclude(hidden=True)
+
+    # HACK: Django < 1.6 only knows this by its old name
+    get_query_set = get_queryset
+
+    # Objects related to each award that listings and feeds show, fetched
+    # by join in the same query rather than by a query per award
+    listing_related = ('badge', 'user')
+    feed_related = ('badge', 'user', 'creator')
+
+    def for_listing(self):
+        """Awards along with what listings of them show"""
+        return self.select_related(*self.listing_related)
+
+    def for_feed(self):
+        """Awards along with what feed items for them show"""
+        return self.select_related(*self.feed_related)
+
+    def for_recipient_hash(self, recipient_hash):
+        """Awards to the recipient identified by a hash from an assertion.
+        Anything but a well-formed hash finds nothing, rather than awards
+        whose hashes haven't been filled in yet."""
+        if not RECIPIENT_HASH_RE.match(recipient_hash or ''):
+            return self.none()
+        return self.filter(recipient_hash=recipient_hash)
+
+    def awarded_badge_ids(self, user):
+        """Set of IDs for badges awarded to the user, served from cache
+        where possible"""
+        if user is None or not user.pk:
+            return frozenset()
+        return awarded_badges.get(user.pk, lambda: frozenset(
+            self.filter(user=user).values_list('badge', flat=True)))
 
 
 @_document_django_model
@@ -725,6 +1122,11 @@ class Award(models.Model):
     creator = models.ForeignKey(User, related_name="award_creator",
                                 blank=True, null=True)
     hidden = models.BooleanField(default=False)
+    # Recipient identity for OBI assertions, kept current by
+    # store_recipient_hash() and indexed for verifiers looking awards up
+    salt = models.CharField(max_length=32, blank=True, default='')
+    recipient_hash = models.CharField(max_length=71, blank=True, default='',
+                                      db_index=True)
     created = models.DateTimeField(auto_now_add=True, blank=False)
     modified = models.DateTimeField(auto_now=True, blank=False)
 
@@ -732,6 +1134,16 @@ class Award(models.Model):
 
     class Meta:
         ordering = ['-modified', '-created']
+        # HACK: Django < 1.5 has no index_together
+        if django.VERSION >= (1, 5):
+            # Keys for cursor pagination, see badger.pagination, and for
+            # polling feeds, see badger.feeds
+            index_together = [('modified', 'id'),
+                              ('user', 'modified', 'id'),
+                              ('badge', 'modified', 'id'),
+                              ('created', 'id'),
+                              ('user', 'created', 'id'),
+                              ('badge', 'created', 'id')]
 
     def __unicode__(self):
         by = self.creator and (u' by %s' % self.creator) or u''
@@ -763,9 +1175,19 @@ class Award(models.Model):
     def save(self, *args, **kwargs):
 
         # Signals and some bits of logic only happen on a new award.
-        is_new = not self.pk
+        if self.pk:
+            super(Award, self).save(*args, **kwargs)
+            # Called after super.save(), so we have some auto-gen fields
+            if badger.settings.ASYNC_SIDE_EFFECTS:
+                outbox.enqueue(outbox.AWARD_BAKE, [self.pk])
+            elif badger.settings.BAKE_AWARD_IMAGES:
+                self.bake_obi_image()
+            return
+
+        # Share the user's awarded set between the checks below and the
+        # prerequisite cascade, rather than fetching it for each.
+        with awarded_badges.scope():
 
-        if is_new:
             # Bail if this is an attempt to double-award a unique badge
             if self.badge.unique and self.badge.is_awarded_to(self.user):
                 raise BadgeAlreadyAwardedException()
@@ -773,38 +1195,77 @@ class Award(models.Model):
             # Only fire will-be-awarded signal on a new award.
             badge_will_be_awarded.send(sender=self.__class__, award=self)
 
-        super(Award, self).save(*args, **kwargs)
-
-        # Called after super.save(), so we have some auto-gen fields
+            if badger.settings.ASYNC_SIDE_EFFECTS:
+                # Leave the rest to badger_worker, committing the award along
+                # with the outbox messages for it.
+                with atomic():
+                    super(Award, self).save(*args, **kwargs)
+                    self.store_recipient_hash()
+                    outbox.enqueue(outbox.AWARD_SIDE_EFFECTS, [self.pk])
+                    Progress.objects.filter(user=self.user,
+                                            badge=self.badge).delete()
+                return
+
+            super(Award, self).save(*args, **kwargs)
+            self.store_recipient_hash()
+
+            # Send this award along with any it unlocks in one batch.
+            with award_batch.collect():
+                self._after_create()
+
+                # Since this badge was just awarded, check the prerequisites
+                # on all badges that count this as one.
+                prerequisite_graph.cascade(self.user, [self.badge_id])
+
+        # Reset any progress for this user & badge upon award.
+        Progress.objects.filter(user=self.user, badge=self.badge).delete()
+
+    def _after_create(self):
+        """Bake, signal, and notify for a newly created award"""
+        # Called after the award was saved, so we have some auto-gen fields
         if badger.settings.BAKE_AWARD_IMAGES:
             self.bake_obi_image()
+        self._notify()
 
-        if is_new:
-            # Only fire was-awarded signal on a new award.
+    def _notify(self):
+        """Signal and notify for a newly created award"""
+        # Only fire was-awarded signal on a new award.
+        if badger.settings.PER_AWARD_SIGNALS:
             badge_was_awarded.send(sender=self.__class__, award=self)
+        award_batch.add(self)
 
-            if notification:
-                if self.creator:
-                    notification.send([self.badge.creator], 'badge_awarded',
-                                      dict(award=self,
-                                           protocol=DEFAULT_HTTP_PROTOCOL))
-                notification.send([self.user], 'award_received',
+        if notification:
+            if self.creator:
+                notification.send([self.badge.creator], 'badge_awarded',
                                   dict(award=self,
                                        protocol=DEFAULT_HTTP_PROTOCOL))
-
-            # Since this badge was just awarded, check the prerequisites on all
-            # badges that count this as one.
-            for dep_badge in self.badge.badge_set.all():
-                dep_badge.check_prerequisites(self.user, self.badge, self)
-
-            # Reset any progress for this user & badge upon award.
-            Progress.objects.filter(user=self.user, badge=self.badge).delete()
+            notification.send([self.user], 'award_received',
+                              dict(award=self,
+                                   protocol=DEFAULT_HTTP_PROTOCOL))
 
     def delete(self):
         """Make sure nominations get deleted along with awards"""
         Nomination.objects.filter(award=self).delete()
         super(Award, self).delete()
 
+    def make_recipient_hash(self, email=None):
+        """The (salt, recipient hash) identifying the recipient of this
+        award by email in OBI assertions"""
+        # TODO: This salt is stable, and the badge.pk is generally not
+        # disclosed anywhere, but is it obscured enough?
+        salt = hashlib.md5('%s-%s' % (self.badge_id, self.pk)).hexdigest()
+        if email is None:
+            email = self.user.email
+        recipient_text = '%s%s' % (email, salt)
+        return salt, 'sha256$%s' % hashlib.sha256(recipient_text).hexdigest()
+
+    def store_recipient_hash(self, email=None):
+        """Work out and save the salt and recipient hash, without saving
+        anything else"""
+        self.salt, self.recipient_hash = self.make_recipient_hash(email)
+        Award.admin_objects.filter(pk=self.pk).update(
+            salt=self.salt, recipient_hash=self.recipient_hash)
+
     def as_obi_assertion(self, request=None):
         badge_data = self.badge.as_obi_serialization(request)
 
@@ -825,13 +1286,9 @@ class Award(models.Model):
             }
 
         # see: https://github.com/brianlovesdata/openbadges/wiki/Assertions
-        # TODO: This salt is stable, and the badge.pk is generally not
-        # disclosed anywhere, but is it obscured enough?
-        hash_salt = (hashlib.md5('%s-%s' % (self.badge.pk, self.pk))
-                            .hexdigest())
-        recipient_text = '%s%s' % (self.user.email, hash_salt)
-        recipient_hash = ('sha256$%s' % hashlib.sha256(recipient_text)
-                                               .hexdigest())
+        hash_salt, recipient_hash = self.salt, self.recipient_hash
+        if not recipient_hash:
+            hash_salt, recipient_hash = self.make_recipient_hash()
         assertion = {
             "recipient": recipient_hash,
             "salt": hash_salt,
@@ -852,46 +1309,35 @@ class Award(models.Model):
         else:
             base_url = 'http://%s' % (Site.objects.get_current().domain,)
 
-        if self.badge.image:
-            # Make a duplicate of the badge image
-            self.badge.image.open()
-            img_copy_fh = StringIO(self.badge.image.file.read())
-        else:
-            # Make a copy of the default badge image
-            img_copy_fh = StringIO(open(DEFAULT_BADGE_IMAGE, 'rb').read())
-
+        # The badge image, converted to PNG if need be, comes from
+        # image_cache, so baking a batch of awards reads it just once. Bail
+        # if the image is bad.
         try:
-            # Try processing the image copy, bail if the image is bad.
-            img = Image.open(img_copy_fh)
+            img_copy_data, chunks = self.badge.image_png()
         except IOError:
             return False
 
-        # Here's where the baking gets done. JSON representation of the OBI
-        # assertion gets written into the "openbadges" metadata field
-        # see: http://blog.client9.com/2007/08/python-pil-and-png-metadata-take-2.html
-        # see: https://github.com/mozilla/openbadges/blob/development/lib/baker.js
-        # see: https://github.com/mozilla/openbadges/blob/development/controllers/baker.js
-        try:
-            from PIL import PngImagePlugin
-        except ImportError:
-            import PngImagePlugin
-        meta = PngImagePlugin.PngInfo()
-
         # TODO: Will need this, if we stop doing hosted assertions
         # assertion = self.as_obi_assertion(request)
-        # meta.add_text('openbadges', json.dumps(assertion))
-        hosted_assertion_url = '%s%s' % (
-            base_url, reverse('badger.award_detail_json',
-                              args=(self.badge.slug, self.id)))
-        meta.add_text('openbadges', hosted_assertion_url)
+        # baking.bake(img_copy_data, json.dumps(assertion))
+        if badger.settings.PUBLISH_ASSERTIONS:
+            hosted_assertion_url = publishing.award_url(self, base_url)
+        else:
+            hosted_assertion_url = '%s%s' % (
+                base_url, reverse('badger.award_detail_json',
+                                  args=(self.badge.slug, self.id)))
+
+        # Here's where the baking gets done. The hosted assertion URL gets
+        # written into the "openbadges" text chunk of the PNG, leaving the
+        # image itself as it was.
+        # see: https://github.com/mozilla/openbadges/blob/development/lib/baker.js
+        img_data = baking.bake(img_copy_data, hosted_assertion_url,
+                               chunks=chunks)
 
         # And, finally save out the baked image.
-        new_img = StringIO()
-        img.save(new_img, "PNG", pnginfo=meta)
-        img_data = new_img.getvalue()
         name_before = self.image.name
         self.image.save('', ContentFile(img_data), False)
-        if (self.image.storage.exists(name_before)):
+        if name_before and self.image.storage.exists(name_before):
             self.image.storage.delete(name_before)
 
         # Update the image field with the new image name
@@ -910,12 +1356,174 @@ class Award(models.Model):
             return None
 
 
+class UserAwardCountManager(models.Manager):
+
+    def count_for(self, user):
+        """Number of visible awards for the user"""
+        counts = self.filter(user=user).values_list('award_count', flat=True)
+        return counts and counts[0] or 0
+
+    def add(self, amounts):
+        """Add to award counts, from a dict of amounts by user PK"""
+        add_to_counters(self, 'user_id', 'award_count', amounts)
+
+
+class UserAwardCount(models.Model):
+    """Number of visible awards for a user, kept up to date as awards come
+    and go"""
+    objects = UserAwardCountManager()
+
+    user = models.OneToOneField(User, related_name='badger_award_count')
+    award_count = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return u'%s awards for %s' % (self.award_count, self.user)
+
+
+class LeaderboardEntry(models.Model):
+    """A user's score on a leaderboard, see :py:mod:`badger.leaderboards`"""
+    board = models.CharField(max_length=128, blank=True, default='')
+    user = models.ForeignKey(User, related_name='badger_leaderboard_entries')
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('board', 'user')
+        # HACK: Django < 1.5 has no index_together
+        if django.VERSION >= (1, 5):
+            index_together = [('board', 'score')]
+
+    def __unicode__(self):
+        return u'%s has %s on %s' % (self.user, self.score,
+                                     self.board or 'all badges')
+
+
+class LeaderboardScore(models.Model):
+    """Number of users with a score on a leaderboard, from which ranks are
+    worked out"""
+    board = models.CharField(max_length=128, blank=True, default='')
+    score = models.PositiveIntegerField()
+    users = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('board', 'score')
+
+    def __unicode__(self):
+        return u'%s users have %s on %s' % (self.users, self.score,
+                                            self.board or 'all badges')
+
+
+class SearchToken(models.Model):
+    """A word in the search fields of an object, see
+    :py:mod:`badger.search`"""
+    model = models.CharField(max_length=64)
+    object_id = models.PositiveIntegerField()
+    token = models.CharField(max_length=search.MAX_TOKEN_LENGTH)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        # HACK: Django < 1.5 has no index_together
+        if django.VERSION >= (1, 5):
+            # Words by prefix for matching, and by object for ranking and
+            # reindexing
+            index_together = [('model', 'token', 'object_id'),
+                              ('model', 'object_id', 'token')]
+
+    def __unicode__(self):
+        return u'%s in %s %s' % (self.token, self.model, self.object_id)
+
+
 class ProgressManager(models.Manager):
-    pass
+
+    def increment_many(self, amounts, goals=None):
+        """Atomically add to many counters at once
+
+        :arg amounts: dict of amounts to add, keyed by (badge PK, user PK).
+            Missing records are created.
+        :arg goals: optional dict of counter values, by the same keys, at
+            which percent reaches 100 and the badge gets auto-awarded.
+
+        Checking for unique badges already awarded is left to the caller.
+        """
+        goals = goals or dict()
+        with atomic():
+            pks = self._ensure_records(amounts.keys())
+            now = timezone.now()
+
+            counters = dict((pks[key], amount)
+                            for key, amount in amounts.items())
+            for pk_chunk in chunked(sorted(counters)):
+                self._update_by_pk(pk_chunk, 'counter', dict(
+                    (pk, F('counter') + counters[pk]) for pk in pk_chunk),
+                    modified=now)
+
+            # Done after the counters, since not every database evaluates SET
+            # clauses against the row as it was before the UPDATE.
+            goal_pks = dict((pks[key], goal) for key, goal in goals.items()
+                            if key in pks)
+            for pk_chunk in chunked(sorted(goal_pks)):
+                self._update_by_pk(pk_chunk, 'percent', dict(
+                    (pk, F('counter') * 100.0 / goal_pks[pk])
+                    for pk in pk_chunk))
+
+        if goal_pks:
+            completed = (self.filter(pk__in=goal_pks.keys(), percent__gte=100)
+                             .select_related('badge', 'user'))
+            with award_batch.collect():
+                for progress in completed:
+                    progress.badge.award_to(progress.user)
+
+    def _ensure_records(self, keys):
+        """Find or create records for (badge PK, user PK) keys, returns a
+        dict of record PKs by key"""
+        pks = self._find_records(keys)
+        missing = [key for key in keys if key not in pks]
+        if not missing:
+            return pks
+        try:
+            with atomic():
+                self.bulk_create([
+                    Progress(badge_id=badge_pk, user_id=user_pk, counter=0)
+                    for badge_pk, user_pk in missing])
+        except IntegrityError:
+            # Lost a race with another process creating some of these, so
+            # fall back to one at a time.
+            for badge_pk, user_pk in missing:
+                pks[(badge_pk, user_pk)] = self.get_or_create(
+                    badge_id=badge_pk, user_id=user_pk,
+                    defaults=dict(counter=0))[0].pk
+        else:
+            pks.update(self._find_records(missing))
+        return pks
+
+    def _find_records(self, keys):
+        keys = set(keys)
+        pks = dict()
+        for key_chunk in chunked(sorted(keys)):
+            qs = (self.filter(badge__in=set(k[0] for k in key_chunk),
+                              user__in=set(k[1] for k in key_chunk))
+                      .values_list('badge', 'user', 'pk'))
+            for badge_pk, user_pk, pk in qs:
+                if (badge_pk, user_pk) in keys:
+                    pks[(badge_pk, user_pk)] = pk
+        return pks
+
+    def _update_by_pk(self, pks, field, values, **extra):
+        """Set a field to a different expression per PK, in a single UPDATE
+        where the database API allows it"""
+        if Case is not None:
+            extra[field] = Case(*[When(pk=pk, then=value)
+                                  for pk, value in values.items()])
+            self.filter(pk__in=pks).update(**extra)
+        else:
+            for pk, value in values.items():
+                extra[field] = value
+                self.filter(pk=pk).update(**extra)
 
 
 class Progress(models.Model):
     """Record tracking progress toward auto-award of a badge"""
+    objects = ProgressManager()
+
     badge = models.ForeignKey(Badge)
     user = models.ForeignKey(User, related_name="progress_user")
     percent = models.FloatField(default=0)
@@ -945,11 +1553,22 @@ class Progress(models.Model):
             raise BadgeAlreadyAwardedException()
 
         super(Progress, self).save(*args, **kwargs)
+        self._remember_fields()
 
         # If the percent is over/equal to 1.0, auto-award on save.
         if self.percent >= 100:
             self.badge.award_to(self.user)
 
+    def _remember_fields(self):
+        """Note the fields other than the counter as they are in the DB"""
+        self._saved_fields = dict(percent=self.percent,
+                                  notes=copy.deepcopy(self.notes))
+
+    def _changed_fields(self):
+        """Fields other than the counter changed since loading or saving"""
+        return [name for name in ('percent', 'notes')
+                if getattr(self, name) != self._saved_fields[name]]
+
     def _quiet_save(self, raise_exception=False):
         try:
             self.save()
@@ -966,18 +1585,59 @@ class Progress(models.Model):
         self.percent = value
         self._quiet_save(raise_exception)
 
-    def increment_by(self, amount, raise_exception=False):
-        # TODO: Do this with an UPDATE counter+amount in DB
-        self.counter += amount
-        self._quiet_save(raise_exception)
-        return self
+    def increment_by(self, amount, raise_exception=False, goal=None):
+        """Add to the counter, with an atomic UPDATE in the database
 
-    def decrement_by(self, amount, raise_exception=False):
-        # TODO: Do this with an UPDATE counter-amount in DB
-        self.counter -= amount
-        self._quiet_save(raise_exception)
+        :arg goal: optional counter value at which percent reaches 100 and
+            the badge is auto-awarded
+
+        As with :py:meth:`save`, a percent or notes changed on this record
+        are saved along with the counter, and the badge is auto-awarded if
+        percent has reached 100. Otherwise, if
+        ``BADGER_PROGRESS_FLUSH_INTERVAL`` is set, the increment is
+        buffered and written later along with others.
+        """
+        if self.badge.unique and self.badge.is_awarded_to(self.user):
+            if raise_exception:
+                raise BadgeAlreadyAwardedException()
+            return self
+
+        # A goal sets percent itself.
+        changed = [name for name in self._changed_fields()
+                   if not (goal and name == 'percent')]
+        self.counter = (self.counter or 0) + amount
+        if goal:
+            self.percent = self.counter * 100.0 / goal
+        needs_save = changed or (not goal and self.percent >= 100)
+
+        if badger.settings.PROGRESS_FLUSH_INTERVAL and not needs_save:
+            progress_buffer.add(self.badge_id, self.user_id, amount, goal)
+            return self
+
+        key = (self.badge_id, self.user_id)
+        Progress.objects.increment_many({key: amount},
+                                        goal and {key: goal} or None)
+
+        # Pick up increments made concurrently elsewhere. If there's no
+        # record, the badge was just awarded.
+        row = (Progress.objects.filter(badge=self.badge_id, user=self.user_id)
+                               .values_list('pk', 'counter', 'percent',
+                                            'created'))
+        if not row:
+            return self
+        self.pk, self.counter, percent, self.created = row[0]
+        if 'percent' not in changed:
+            self.percent = percent
+        if changed or self.percent >= 100:
+            self._quiet_save(raise_exception)
+        else:
+            self._remember_fields()
         return self
 
+    def decrement_by(self, amount, raise_exception=False, goal=None):
+        """Subtract from the counter, see :py:meth:`increment_by`"""
+        return self.increment_by(-amount, raise_exception, goal)
+
 
 class DeferredAwardManager(models.Manager):
 
@@ -990,14 +1650,61 @@ class DeferredAwardManager(models.Manager):
                 for x in qs
                 if x['claim_group']]
 
-    def generate(self, badge, user=None, amount=10, reusable=False):
-        """Generate a number of deferred awards for a badge"""
+    def generate(self, badge, user=None, amount=10, reusable=False,
+                 return_counts=False):
+        """Generate a number of deferred awards for a badge
+
+        Claim codes are allocated up front, checked for collisions against
+        existing codes in bulk, and the deferred awards inserted in chunks.
+
+        :returns: the claim group, or a (claim group, counts) tuple if
+            return_counts is True. Counts is a dict with the number of
+            deferred awards ``created`` and the number of claim codes
+            ``regenerated`` because of collisions.
+        """
         claim_group = '%s-%s' % (time(), random.randint(0, 10000))
-        for i in range(0, amount):
-            (DeferredAward(badge=badge, creator=user, reusable=reusable,
-                           claim_group=claim_group).save())
+        codes = make_random_codes(amount)
+        regenerated = 0
+
+        for attempt in range(CLAIM_CODE_ATTEMPTS):
+            collisions = self._existing_claim_codes(codes)
+            while collisions:
+                # Only the replacements need checking on the next pass.
+                regenerated += len(collisions)
+                fresh = make_random_codes(len(collisions), exclude=codes)
+                codes = (codes - collisions) | fresh
+                collisions = self._existing_claim_codes(fresh)
+            try:
+                with atomic():
+                    self.bulk_create([
+                        DeferredAward(badge=badge, creator=user,
+                                      reusable=reusable,
+                                      claim_group=claim_group,
+                                      claim_code=code)
+                        for code in sorted(codes)],
+                        batch_size=BULK_CHUNK_SIZE)
+                    add_to_counter(Badge.objects.filter(pk=badge.pk),
+                                   'deferred_award_count', len(codes))
+                break
+            except IntegrityError:
+                # Someone else claimed one of these codes in the meantime,
+                # so check them all again.
+                if attempt == CLAIM_CODE_ATTEMPTS - 1:
+                    raise
+
+        if return_counts:
+            return claim_group, dict(created=len(codes),
+                                     regenerated=regenerated)
         return claim_group
 
+    def _existing_claim_codes(self, codes):
+        """The subset of codes already in use"""
+        existing = set()
+        for chunk in chunked(sorted(codes)):
+            existing.update(self.filter(claim_code__in=chunk)
+                                .values_list('claim_code', flat=True))
+        return existing
+
     def claim_by_email(self, awardee):
         """Claim all deferred awards that match the awardee's email"""
         return self._claim_qs(awardee, self.filter(email=awardee.email))
@@ -1015,8 +1722,19 @@ class DeferredAwardManager(models.Manager):
 def make_random_code():
     """Generare a random code, using a set of alphanumeric characters that
     attempts to avoid ambiguously similar shapes."""
-    s = '3479acefhjkmnprtuvwxy'
-    return ''.join([random.choice(s) for x in range(CLAIM_CODE_LENGTH)])
+    return ''.join([random_choice(CLAIM_CODE_CHARS)
+                    for x in range(CLAIM_CODE_LENGTH)])
+
+
+def make_random_codes(amount, exclude=()):
+    """Generate a set of distinct random codes, none of which are in
+    exclude"""
+    codes = set()
+    while len(codes) < amount:
+        code = make_random_code()
+        if code not in exclude:
+            codes.add(code)
+    return codes
 
 
 class DeferredAwardGrantNotAllowedException(BadgerException):
@@ -1081,33 +1799,26 @@ class DeferredAward(models.Model):
 
     def save(self, **kwargs):
         """Save the DeferredAward, sending a claim email if it's new"""
-        is_new = not self.pk
-        has_existing_deferreds = False
-        if self.email:
-            has_existing_deferreds = DeferredAward.objects.filter(
-                email=self.email).exists()
-
-        super(DeferredAward, self).save(**kwargs)
+        # Only the first deferred award for an email address gets an invite,
+        # so existing ones can skip the query.
+        send_invite = (not self.pk and self.email and
+                       not DeferredAward.objects.filter(
+                           email=self.email).exists())
+        if not send_invite:
+            super(DeferredAward, self).save(**kwargs)
+            return
+
+        if badger.settings.ASYNC_SIDE_EFFECTS:
+            with atomic():
+                super(DeferredAward, self).save(**kwargs)
+                outbox.enqueue(outbox.DEFERRED_AWARD_INVITE, [self.pk])
+        else:
+            super(DeferredAward, self).save(**kwargs)
+            self.send_claim_invitation()
 
-        if is_new and self.email and not has_existing_deferreds:
-            try:
-                # If this is new and there's an email, send an invite to claim.
-                context = Context(dict(
-                    deferred_award=self,
-                    badge=self.badge,
-                    protocol=DEFAULT_HTTP_PROTOCOL,
-                    current_site=Site.objects.get_current()
-                ))
-                tmpl_name = 'badger/deferred_award_%s.txt'
-                subject = render_to_string(tmpl_name % 'subject', {}, context)
-                # Email subjects can't contain newlines, so we strip it. It makes
-                # the template less fragile.
-                subject = subject.strip()
-                body = render_to_string(tmpl_name % 'body', {}, context)
-                send_mail(subject, body, settings.DEFAULT_FROM_EMAIL,
-                          [self.email], fail_silently=False)
-            except TemplateDoesNotExist:
-                pass
+    def send_claim_invitation(self):
+        """Send an email inviting the recipient to claim this award"""
+        mail.send_claim_invitations([self])
 
     def claim(self, awardee):
         """Claim the deferred award for the given user"""
@@ -1141,6 +1852,45 @@ class DeferredAward(models.Model):
             return new_da
 
 
+@_document_django_model
+class ClaimTokenRedemption(models.Model):
+    """Record of a signed claim token having been claimed, see
+    badger.claim_tokens"""
+    badge = models.ForeignKey(Badge)
+    claim_group = models.IntegerField()
+    serial = models.IntegerField()
+    user = models.ForeignKey(User)
+    award = models.ForeignKey(Award, blank=True, null=True,
+                              on_delete=models.SET_NULL)
+    created = models.DateTimeField(auto_now_add=True, blank=False)
+
+    class Meta:
+        unique_together = ('badge', 'claim_group', 'serial')
+
+    def __unicode__(self):
+        return u'Claim token %s/%s for %s by %s' % (
+            self.claim_group, self.serial, self.badge, self.user)
+
+
+class OutboxMessage(models.Model):
+    """Side effect waiting to be carried out by badger_worker, see
+    badger.outbox"""
+    kind = models.CharField(max_length=32)
+    object_id = models.PositiveIntegerField()
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    lock_token = models.CharField(max_length=32, blank=True, db_index=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True, blank=False)
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __unicode__(self):
+        return u'%s %s' % (self.kind, self.object_id)
+
+
 class NominationException(BadgerException):
     """Nomination model exception"""
 
@@ -1349,6 +2099,215 @@ class Nomination(models.Model):
         return self
 
 
+def check_prerequisite_cycles(sender, instance, action, reverse, model,
+                              pk_set, **kwargs):
+    """Refuse prerequisite changes that would make a cycle, and rebuild the
+    prerequisite graph after any change"""
+    if action == 'pre_add':
+        if not reverse:
+            edges = [(instance.pk, pk_set)]
+        else:
+            edges = [(pk, [instance.pk]) for pk in pk_set]
+        for badge_pk, prereq_pks in edges:
+            if prerequisite_graph.would_cycle(badge_pk, prereq_pks):
+                raise BadgePrerequisiteCycleException()
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        prerequisite_graph.invalidate()
+
+
+def update_awarded_badges(sender, instance, created=False, **kwargs):
+    """Keep the cached set of awarded badges current for a changed award"""
+    if created and not instance.hidden:
+        awarded_badges.add(instance.user_id, instance.badge_id)
+    else:
+        awarded_badges.invalidate(instance.user_id)
+
+
+def remember_award_hidden(sender, instance, **kwargs):
+    """Note whether an award was hidden as loaded, to tell when that
+    changes"""
+    instance._was_hidden = instance.hidden
+
+
+def _user_shown_fields(user):
+    # Deferred fields that were never loaded or set can't have changed.
+    return tuple(user.__dict__.get(name) for name in USER_SHOWN_FIELDS)
+
+
+def remember_user_shown_fields(sender, instance, **kwargs):
+    """Note what badges and assertions show of a user as loaded, and the
+    email their recipient hashes are made from, to tell when those
+    change"""
+    instance._shown_fields = _user_shown_fields(instance)
+    instance._hashed_email = instance.__dict__.get('email')
+
+
+def remember_progress_fields(sender, instance, **kwargs):
+    """Note the fields of progress as loaded, or as they'd be saved by
+    default if new, to tell which were changed before an increment"""
+    if instance.pk:
+        instance._remember_fields()
+    else:
+        fields = [sender._meta.get_field(name)
+                  for name in ('percent', 'notes')]
+        instance._saved_fields = dict(
+            (field.name, field.to_python(field.get_default()))
+            for field in fields)
+
+
+def update_award_counts(sender, instance, created=False, signal=None,
+                        **kwargs):
+    """Keep award counters current for a saved or deleted award"""
+    was_visible = not created and not instance._was_hidden
+    is_visible = (signal is not signals.post_delete and
+                  not instance.hidden)
+    instance._was_hidden = instance.hidden
+    if was_visible == is_visible:
+        return
+    amount = is_visible and 1 or -1
+    add_to_counter(Badge.objects.filter(pk=instance.badge_id),
+                   'award_count', amount)
+    UserAwardCount.objects.add({instance.user_id: amount})
+    if badger.settings.LEADERBOARDS:
+        leaderboards.add(instance.badge, {instance.user_id: amount})
+
+
+def update_deferred_award_counts(sender, instance, created=False,
+                                 signal=None, **kwargs):
+    """Keep the deferred award counter current for a saved or deleted
+    deferred award"""
+    if created or signal is signals.post_delete:
+        add_to_counter(Badge.objects.filter(pk=instance.badge_id),
+                       'deferred_award_count', created and 1 or -1)
+
+
+def update_search_index(sender, instance, created=False, **kwargs):
+    """Index the search fields of a saved badge or award"""
+    search.get_backend().index(sender, [instance], created=created)
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    search.get_backend().unindex(sender, [instance.pk])
+
+
+def _saved_only_last_login(update_fields):
+    # Logging in saves just the last_login of a user, which isn't shown.
+    return (update_fields is not None and
+            set(update_fields) == set(['last_login']))
+
+
+def invalidate_obi_cache(sender, instance, update_fields=None, **kwargs):
+    """Forget OBI JSON showing a saved or deleted badge, award or user"""
+    if not _saved_only_last_login(update_fields):
+        obi_cache.invalidate(sender, instance.pk)
+
+
+def invalidate_image_cache(sender, instance, **kwargs):
+    """Drop cached images of a deleted badge, or those a saved badge no
+    longer uses"""
+    keep_name = None
+    if kwargs.get('signal') is signals.post_save:
+        keep_name = instance.image_cache_key()[1]
+    image_cache.invalidate(instance.pk, keep_name)
+
+
+def update_recipient_hashes(sender, instance, created=False, **kwargs):
+    """Keep the recipient hashes of a user's awards matching their email"""
+    email = instance.__dict__.get('email')
+    changed = email != getattr(instance, '_hashed_email', None)
+    instance._hashed_email = email
+    if created or not changed:
+        return
+    awards = (Award.admin_objects.filter(user=instance)
+                                 .only('pk', 'badge', 'recipient_hash'))
+    for award in awards.iterator():
+        salt, recipient_hash = award.make_recipient_hash(instance.email)
+        if recipient_hash != award.recipient_hash:
+            award.store_recipient_hash(instance.email)
+
+
+# Keyword arguments for publishing functions, by model
+PUBLISHING_KWARGS = {Badge: 'badge_ids', Award: 'award_ids', User: 'user_ids'}
+
+# Fields of users shown in badge JSON and assertions
+USER_SHOWN_FIELDS = ('username', 'email')
+
+
+def bump_feed_stamp(sender, instance, update_fields=None, **kwargs):
+    """Let feeds know something they could list was saved or deleted"""
+    if not _saved_only_last_login(update_fields):
+        feed_stamp.bump()
+
+
+def publish_assertions(sender, instance, created=False, **kwargs):
+    """Publish JSON showing a saved badge, award or user again"""
+    if sender is User:
+        shown = _user_shown_fields(instance)
+        changed = shown != getattr(instance, '_shown_fields', None)
+        instance._shown_fields = shown
+        # New users have nothing published yet.
+        if created or not changed:
+            return
+    publishing.publish_changed(**{PUBLISHING_KWARGS[sender]: [instance.pk]})
+
+
+def unpublish_assertions(sender, instance, **kwargs):
+    """Remove published JSON for a deleted badge or award"""
+    publishing.unpublish(**{PUBLISHING_KWARGS[sender]: [instance.pk]})
+
+
+def invalidate_tag_counts(sender, instance, **kwargs):
+    """Forget cached badge tag counts and tag completions when tags or
+    badge taggings change"""
+    if (sender is TaggedItem and instance.content_type_id !=
+            ContentType.objects.get_for_model(Badge).pk):
+        return
+    Badge.objects.invalidate_tag_counts()
+    prefix_index.invalidate()
+
+
+signals.post_init.connect(remember_award_hidden, sender=Award)
+signals.post_init.connect(remember_progress_fields, sender=Progress)
+signals.post_init.connect(remember_user_shown_fields, sender=User)
+signals.post_save.connect(update_awarded_badges, sender=Award)
+signals.post_delete.connect(update_awarded_badges, sender=Award)
+signals.post_save.connect(update_award_counts, sender=Award)
+signals.post_delete.connect(update_award_counts, sender=Award)
+signals.post_save.connect(update_deferred_award_counts, sender=DeferredAward)
+signals.post_delete.connect(update_deferred_award_counts,
+                            sender=DeferredAward)
+signals.post_save.connect(update_search_index, sender=Badge)
+signals.post_save.connect(invalidate_image_cache, sender=Badge)
+signals.post_delete.connect(invalidate_image_cache, sender=Badge)
+signals.post_save.connect(update_recipient_hashes, sender=User)
+for _model in (Badge, Award, User):
+    signals.post_save.connect(invalidate_obi_cache, sender=_model)
+    signals.post_delete.connect(invalidate_obi_cache, sender=_model)
+    signals.post_save.connect(bump_feed_stamp, sender=_model)
+    signals.post_delete.connect(bump_feed_stamp, sender=_model)
+    # Connected after invalidating, so what's published is current.
+    signals.post_save.connect(publish_assertions, sender=_model)
+for _model in (Badge, Award):
+    signals.post_delete.connect(unpublish_assertions, sender=_model)
+signals.post_delete.connect(remove_from_search_index, sender=Badge)
+signals.post_save.connect(update_search_index, sender=Award)
+signals.post_delete.connect(remove_from_search_index, sender=Award)
+if taggit:
+    signals.post_save.connect(invalidate_tag_counts, sender=Tag)
+    signals.post_delete.connect(invalidate_tag_counts, sender=Tag)
+    signals.post_save.connect(invalidate_tag_counts, sender=TaggedItem)
+    signals.post_delete.connect(invalidate_tag_counts, sender=TaggedItem)
+signals.m2m_changed.connect(check_prerequisite_cycles,
+                            sender=Badge.prerequisites.through)
+signals.post_delete.connect(lambda *args, **kwargs:
+                                prerequisite_graph.invalidate(),
+                            sender=Badge, weak=False)
+signals.post_save.connect(lambda *args, **kwargs: prefix_index.invalidate(),
+                          sender=Badge, weak=False)
+signals.post_delete.connect(lambda *args, **kwargs: prefix_index.invalidate(),
+                            sender=Badge, weak=False)
+
+
 # HACK: Django 1.2 is missing receiver and user_logged_in
 if receiver and user_logged_in:
     @receiver(user_logged_in)
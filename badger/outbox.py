@@ -0,0 +1,271 @@
+"""Outbox for award side effects
+
+With ``BADGER_ASYNC_SIDE_EFFECTS`` enabled, baking award images, sending
+``badge_was_awarded``, notifications, claim emails and prerequisite cascades
+are not done while awarding. Instead, a row per side effect is written to the
+outbox in the same transaction as the award, and the ``badger_worker``
+management command carries them out later.
+
+Messages are unique by kind and object, so enqueueing the same side effect
+twice before it has been handled does it only once. Enqueueing it again while
+a worker is handling it has it handled once more afterwards, since the worker
+may have read the object before it changed. A message is deleted once
+handled, and retried with a growing delay when its handler fails.
+"""
+import logging
+import sys
+import traceback
+import uuid
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.db import IntegrityError, connection
+from django.utils import timezone
+
+import badger
+
+
+log = logging.getLogger('badger.outbox')
+
+AWARD_BAKE = 'award.bake'
+AWARD_NOTIFY = 'award.notify'
+AWARD_CASCADE = 'award.cascade'
+DEFERRED_AWARD_INVITE = 'deferredaward.invite'
+BADGE_PUBLISH = 'badge.publish'
+AWARD_PUBLISH = 'award.publish'
+
+# Side effects of a new award, in the order they happen synchronously
+AWARD_SIDE_EFFECTS = (AWARD_BAKE, AWARD_NOTIFY, AWARD_CASCADE)
+
+handlers = dict()
+
+
+def handler(kind):
+    """Decorator to register the function handling a kind of message. It
+    gets called with a list of object IDs and a done() callback, and should
+    be idempotent. Handlers with effects that mustn't be repeated, such as
+    sending mail, call done(object_id) as soon as each object is handled,
+    so that it isn't handled again if a later one fails."""
+    def register(fn):
+        handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kinds, object_ids):
+    """Add messages of a kind, or of each of a list of kinds, for each of the
+    object IDs, skipping any already waiting, re-arming any being handled
+    and starting over any that ran out of attempts"""
+    from badger.models import OutboxMessage, atomic, chunked
+    if isinstance(kinds, basestring):
+        kinds = [kinds]
+    keys = [(kind, object_id) for kind in kinds
+            for object_id in sorted(set(object_ids))]
+    for chunk in chunked(keys):
+        try:
+            with atomic():
+                OutboxMessage.objects.bulk_create([
+                    OutboxMessage(kind=kind, object_id=object_id)
+                    for kind, object_id in chunk])
+        except IntegrityError:
+            for kind, object_id in chunk:
+                message, created = OutboxMessage.objects.get_or_create(
+                    kind=kind, object_id=object_id)
+                if not created:
+                    # Without its lock token, the worker handling it won't
+                    # delete it when done, but release it to be handled
+                    # again.
+                    (OutboxMessage.objects.filter(pk=message.pk)
+                                          .exclude(lock_token='')
+                                          .update(lock_token=''))
+                    # Workers skip messages out of attempts for good, so
+                    # it's a new side effect as far as they're concerned.
+                    (OutboxMessage.objects.filter(
+                        pk=message.pk,
+                        attempts__gte=badger.settings.OUTBOX_MAX_ATTEMPTS)
+                     .update(attempts=0, available_at=timezone.now(),
+                             last_error=''))
+
+
+def claim_batch(size=None):
+    """Lease a batch of messages that are due, so that other workers leave
+    them alone for BADGER_OUTBOX_LEASE seconds"""
+    from badger.models import OutboxMessage
+    size = size or badger.settings.WORKER_BATCH_SIZE
+    now = timezone.now()
+    due = (OutboxMessage.objects
+               .filter(available_at__lte=now,
+                       attempts__lt=badger.settings.OUTBOX_MAX_ATTEMPTS)
+               .order_by('available_at', 'pk'))
+    pks = list(due.filter(locked_until__isnull=True)
+                  .values_list('pk', flat=True)[:size])
+    if len(pks) < size:
+        pks += list(due.filter(locked_until__lt=now)
+                       .values_list('pk', flat=True)[:size - len(pks)])
+    if not pks:
+        return []
+
+    # Only the rows still unleased by the time of this UPDATE end up with
+    # our token, whatever other workers are doing.
+    token = uuid.uuid4().hex
+    lease = timedelta(seconds=badger.settings.OUTBOX_LEASE)
+    (OutboxMessage.objects.filter(pk__in=pks)
+                          .exclude(locked_until__gte=now)
+                          .update(lock_token=token, locked_until=now + lease))
+    return list(OutboxMessage.objects.filter(lock_token=token))
+
+
+def process_batch(size=None, threads=None):
+    """Claim and handle a batch of messages, returns the number handled"""
+    messages = claim_batch(size)
+    if not messages:
+        return 0
+
+    by_kind = dict()
+    for message in messages:
+        by_kind.setdefault(message.kind, []).append(message)
+
+    # Messages of a kind are handled in slices, one per thread.
+    threads = threads or badger.settings.WORKER_THREADS
+    jobs = []
+    for kind, kind_messages in sorted(by_kind.items()):
+        step = max(1, len(kind_messages) // max(1, threads))
+        for idx in range(0, len(kind_messages), step):
+            jobs.append((kind, kind_messages[idx:idx + step]))
+
+    if threads > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(threads, len(jobs)))
+        try:
+            pool.map(_threaded_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            _run_job(*job)
+    return len(messages)
+
+
+def _threaded_job(job):
+    try:
+        _run_job(*job)
+    finally:
+        # Each thread gets its own DB connection, which would otherwise be
+        # left open.
+        connection.close()
+
+
+def _run_job(kind, messages):
+    try:
+        fn = handlers[kind]
+    except KeyError:
+        return _failed(messages, 'No handler for %s' % kind)
+    pending = dict((m.object_id, m) for m in messages)
+
+    def done(object_id):
+        message = pending.pop(object_id, None)
+        if message is not None:
+            _finish([message])
+
+    try:
+        fn([m.object_id for m in messages], done)
+    except Exception:
+        log.exception('Outbox handler for %s failed' % kind)
+        remaining = [m for m in messages if m.object_id in pending]
+        if len(remaining) <= 1:
+            return _failed(remaining, traceback.format_exc())
+        # Try again one at a time, so only the messages at fault get
+        # retried later.
+        for message in remaining:
+            _run_job(kind, [message])
+        return
+    _finish(pending.values())
+
+
+def _finish(messages):
+    """Delete handled messages, releasing any enqueued again meanwhile"""
+    from badger.models import OutboxMessage
+    if not messages:
+        return
+    pks, token = [m.pk for m in messages], messages[0].lock_token
+    OutboxMessage.objects.filter(pk__in=pks, lock_token=token).delete()
+    (OutboxMessage.objects.filter(pk__in=pks, lock_token='')
+                          .update(locked_until=None))
+
+
+def _failed(messages, error):
+    """Put messages back to be retried after a delay, doubling each time"""
+    from badger.models import OutboxMessage
+    now = timezone.now()
+    for message in messages:
+        delay = badger.settings.OUTBOX_RETRY_DELAY * (2 ** message.attempts)
+        (OutboxMessage.objects.filter(pk=message.pk)
+                              .update(attempts=message.attempts + 1,
+                                      available_at=now + timedelta(
+                                          seconds=delay),
+                                      locked_until=None, lock_token='',
+                                      last_error=error))
+
+
+@handler(AWARD_BAKE)
+def bake_awards(award_ids, done):
+    from badger.models import Award
+    if not badger.settings.BAKE_AWARD_IMAGES:
+        return
+    for award in Award.objects.filter(pk__in=award_ids).select_related('badge'):
+        award.bake_obi_image()
+
+
+@handler(AWARD_NOTIFY)
+def notify_awards(award_ids, done):
+    from badger.models import Award
+    from badger.signals import award_batch
+    error = None
+    with award_batch.collect():
+        for award in (Award.objects.filter(pk__in=award_ids)
+                                   .select_related('badge', 'user',
+                                                   'creator')):
+            try:
+                award._notify()
+            except Exception:
+                # Stop here, but still send the batch for the awards done.
+                error = sys.exc_info()
+                break
+            done(award.pk)
+    if error:
+        raise error[0], error[1], error[2]
+
+
+@handler(AWARD_CASCADE)
+def cascade_awards(award_ids, done):
+    from badger.models import Award
+    from badger.prerequisites import graph
+    users_by_badge = dict()
+    for award in Award.objects.filter(pk__in=award_ids).select_related('user'):
+        users_by_badge.setdefault(award.badge_id, []).append(award.user)
+    for badge_pk, users in users_by_badge.items():
+        graph.cascade_many(users, [badge_pk])
+
+
+@handler(BADGE_PUBLISH)
+def publish_badges(badge_ids, done):
+    from badger.publishing import publish
+    if badger.settings.PUBLISH_ASSERTIONS:
+        publish(badge_ids=badge_ids)
+
+
+@handler(AWARD_PUBLISH)
+def publish_awards(award_ids, done):
+    from badger.publishing import publish
+    if badger.settings.PUBLISH_ASSERTIONS:
+        publish(award_ids=award_ids)
+
+
+@handler(DEFERRED_AWARD_INVITE)
+def invite_deferred_awards(deferred_award_ids, done):
+    from badger.mail import send_claim_invitations
+    from badger.models import DeferredAward
+    send_claim_invitations(DeferredAward.objects
+                               .filter(pk__in=deferred_award_ids)
+                               .select_related('badge'),
+                           done=lambda da: done(da.pk))
@@ -0,0 +1,213 @@
+"""Keyset pagination for long listings of badges and awards
+
+Paging by OFFSET makes the database walk past every row before the page,
+and Django's paginator adds a COUNT(*) on every request, so deep pages get
+slower the further in they are. A cursor instead names the row a page starts
+after, by its (``modified``, ``id``) key, and each page is found with an index
+range scan however deep it is. Rows added or changed while someone is paging
+don't shift the rows of the pages they're on.
+
+Cursors are opaque tokens for the ``?cursor=`` parameter. Counts for
+listings, when needed at all, come from counters or Django's cache rather
+than a COUNT on every request.
+"""
+import base64
+import hashlib
+import json
+from math import ceil
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+import badger
+
+
+# Order of the keys that cursors are made from, newest first
+DEFAULT_ORDERING = ('-modified', '-pk')
+
+# Directions a cursor can page in
+NEXT, PREVIOUS = 'n', 'p'
+
+
+class InvalidCursor(ValueError):
+    """A cursor token that can't be decoded"""
+
+
+def cached_count(queryset):
+    """Number of rows in a queryset, kept in Django's cache for
+    BADGER_COUNT_CACHE_TIMEOUT seconds"""
+    timeout = badger.settings.COUNT_CACHE_TIMEOUT
+    if not timeout:
+        return queryset.count()
+    key = 'badger:count:%s' % hashlib.md5(
+        str(queryset.query).encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class CursorPaginator(object):
+    """Pages of a queryset, by cursors rather than page numbers
+
+    The count is only worked out if asked for, from ``count``, which may be
+    a number or a callable, or otherwise with :py:func:`cached_count`.
+    """
+
+    def __init__(self, queryset, per_page, ordering=DEFAULT_ORDERING,
+                 count=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self._count = count
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = cached_count(self.queryset)
+        elif callable(self._count):
+            self._count = self._count()
+        return self._count
+
+    @property
+    def num_pages(self):
+        return max(1, int(ceil(self.count / float(self.per_page))))
+
+    def page(self, cursor=None):
+        """The page a cursor token leads to, the first without one"""
+        direction, key = self.decode(cursor)
+        qs = self.queryset
+        if key is not None:
+            qs = qs.filter(self._after(key, reverse=(direction == PREVIOUS)))
+        ordering = self.ordering
+        if direction == PREVIOUS:
+            # Pages going backwards are fetched in reverse, then flipped.
+            ordering = [_reverse(field) for field in ordering]
+        rows = list(qs.order_by(*ordering)[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == PREVIOUS:
+            rows.reverse()
+            # A cursor without a key leads back from the very end.
+            return CursorPage(rows, self, has_previous=more,
+                              has_next=key is not None)
+        return CursorPage(rows, self, has_previous=key is not None,
+                          has_next=more)
+
+    def _after(self, key, reverse=False):
+        """Filter for rows past a key in the paging order, or before it if
+        reverse"""
+        query, equal = None, dict()
+        for field, value in zip(self.ordering, key):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = '%s__%s' % (name, descending and 'lt' or 'gt')
+            q = Q(**dict(equal, **{lookup: value}))
+            if query is None:
+                query = q
+            else:
+                query = query | q
+            equal[name] = value
+
+        # The same bound on the first field alone, which is redundant but
+        # lets databases scan an index range rather than the whole index.
+        name = self.ordering[0].lstrip('-')
+        descending = self.ordering[0].startswith('-') != reverse
+        return Q(**{'%s__%s' % (name, descending and 'lte' or 'gte'):
+                    key[0]}) & query
+
+    def key_for(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode(self, direction, obj=None):
+        """Opaque cursor token for paging from an object in a direction"""
+        values = obj is not None and [
+            hasattr(value, 'isoformat') and value.isoformat() or value
+            for value in self.key_for(obj)] or []
+        return base64.urlsafe_b64encode(
+            json.dumps([direction] + values)).rstrip('=')
+
+    def decode(self, cursor):
+        """The direction and key from a cursor token"""
+        if not cursor:
+            return NEXT, None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(
+                str(cursor) + '=' * (-len(cursor) % 4)))
+            if not isinstance(data, list):
+                raise ValueError(data)
+            direction, values = data[0], data[1:]
+            if direction not in (NEXT, PREVIOUS):
+                raise ValueError(direction)
+            if not values:
+                return direction, None
+            if len(values) != len(self.ordering):
+                raise ValueError(values)
+            opts = self.queryset.model._meta
+            return direction, [
+                _field(opts, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, IndexError, ValidationError):
+            raise InvalidCursor(cursor)
+
+
+class CursorPage(object):
+    """A page of rows, with cursors to the pages around it. Quacks enough
+    like Django's Page for list templates."""
+
+    cursor_based = True
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next:
+            return self.paginator.encode(NEXT, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous:
+            return self.paginator.encode(PREVIOUS, self.object_list[0])
+
+    @property
+    def last_cursor(self):
+        """Cursor to the final page"""
+        return self.paginator.encode(PREVIOUS)
+
+
+def _reverse(field):
+    return field.startswith('-') and field[1:] or '-%s' % field
+
+
+def _field(opts, name):
+    return name == 'pk' and opts.pk or opts.get_field(name)
+
+
+def paginate(request, queryset, per_page, count=None):
+    """A page of a queryset for the ?cursor= of a request, as a dict of
+    context for list templates"""
+    paginator = CursorPaginator(queryset, per_page, count=count)
+    page = paginator.page(request.GET.get('cursor', None))
+    return dict(paginator=paginator, page_obj=page,
+                is_paginated=page.has_other_pages())
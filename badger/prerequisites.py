@@ -0,0 +1,174 @@
+"""Prerequisite dependency graph for auto-awarding badges
+
+Badges with prerequisites get awarded automatically once all of their
+prerequisites have been awarded. Rather than walking ``Badge.prerequisites``
+with a query per badge on every award, the whole graph is loaded once per
+process and kept until the prerequisites change anywhere. A version number in
+Django's cache tells other processes when to reload.
+"""
+import logging
+import threading
+
+from .caching import get_version, bump_version
+
+
+VERSION_CACHE_KEY = 'badger:prerequisites:version'
+
+log = logging.getLogger('badger.prerequisites')
+
+
+class PrerequisiteGraph(object):
+    """Cached adjacency and topological order of badge prerequisites"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._version = None
+        self.prerequisites = dict()
+        self.dependents = dict()
+        self.order = dict()
+
+    def invalidate(self):
+        """Throw away the graph in this and every other process"""
+        bump_version(VERSION_CACHE_KEY)
+        self._version = None
+
+    def load(self):
+        """Ensure the graph is current, reloading from the DB if necessary"""
+        version = get_version(VERSION_CACHE_KEY)
+        if self._version is not None and self._version == version:
+            return self
+        with self._lock:
+            if self._version != version:
+                self._build()
+                self._version = version
+        return self
+
+    def _build(self):
+        from badger.models import Badge
+        through = Badge.prerequisites.through
+        prerequisites, dependents = dict(), dict()
+        edges = through.objects.values_list('from_badge', 'to_badge')
+        for badge_pk, prereq_pk in edges:
+            prerequisites.setdefault(badge_pk, set()).add(prereq_pk)
+            dependents.setdefault(prereq_pk, set()).add(badge_pk)
+
+        # Kahn's algorithm: a badge comes after all of its prerequisites.
+        nodes = set(prerequisites) | set(dependents)
+        remaining = dict((pk, len(prerequisites.get(pk, ()))) for pk in nodes)
+        ready = sorted(pk for pk, ct in remaining.items() if not ct)
+        order = dict()
+        while ready:
+            pk = ready.pop(0)
+            order[pk] = len(order)
+            for dep_pk in sorted(dependents.get(pk, ())):
+                remaining[dep_pk] -= 1
+                if not remaining[dep_pk]:
+                    ready.append(dep_pk)
+
+        cyclic = sorted(nodes - set(order))
+        if cyclic:
+            log.warning('Prerequisite cycle among badges %s; these will '
+                        'not be auto-awarded' % cyclic)
+
+        self.prerequisites = prerequisites
+        self.dependents = dependents
+        self.order = order
+
+    def ancestors(self, badge_pks):
+        """All the badges required, directly or not, by the given badges"""
+        return self._walk(badge_pks, self.prerequisites)
+
+    def descendants(self, badge_pks):
+        """All the badges depending, directly or not, on the given badges"""
+        return self._walk(badge_pks, self.dependents)
+
+    def _walk(self, badge_pks, edges):
+        found, todo = set(), list(badge_pks)
+        while todo:
+            for pk in edges.get(todo.pop(), ()):
+                if pk not in found:
+                    found.add(pk)
+                    todo.append(pk)
+        return found
+
+    def would_cycle(self, badge_pk, prerequisite_pks):
+        """Would requiring these prerequisites for the badge make a cycle?"""
+        self.load()
+        prerequisite_pks = set(prerequisite_pks)
+        if badge_pk in prerequisite_pks:
+            return True
+        return badge_pk in self.ancestors(prerequisite_pks)
+
+    def candidates(self, badge_pks):
+        """Badges that could be unlocked by awards of the given badges, in
+        the order in which they should be checked"""
+        self.load()
+        return sorted((pk for pk in self.descendants(badge_pks)
+                       if pk in self.order),
+                      key=self.order.get)
+
+    def _cascading(self):
+        if not hasattr(self._local, 'users'):
+            self._local.users = set()
+        return self._local.users
+
+    def cascade(self, user, badge_pks):
+        """Award every badge newly unlocked for the user by awards of the
+        given badges, returns the list of new awards"""
+        return self.cascade_many([user], badge_pks).get(user.pk, [])
+
+    def cascade_many(self, users, badge_pks):
+        """Award every badge newly unlocked for each of the users by awards
+        of the given badges, returns lists of new awards by user PK"""
+        from badger.models import Award, Badge, chunked
+
+        candidates = self.candidates(badge_pks)
+        cascading = self._cascading()
+        users = [u for u in users if u.pk not in cascading]
+        if not candidates or not users:
+            return dict()
+
+        # Awards made along the way end up back in here via Award.save(), so
+        # flag these users as already being taken care of.
+        users_by_pk = dict((u.pk, u) for u in users)
+        cascading.update(users_by_pk)
+        try:
+            awarded = dict((pk, set()) for pk in users_by_pk)
+            if len(users) == 1:
+                awarded[users[0].pk].update(
+                    Award.objects.awarded_badge_ids(users[0]))
+            else:
+                for chunk in chunked(users_by_pk.keys()):
+                    qs = (Award.objects.filter(user__in=chunk)
+                                       .values_list('user', 'badge')
+                                       .distinct())
+                    for user_pk, badge_pk in qs:
+                        awarded[user_pk].add(badge_pk)
+
+            results = dict()
+            for badge_pk in candidates:
+                prereqs = self.prerequisites[badge_pk]
+                eligible = [users_by_pk[user_pk]
+                            for user_pk, badge_pks in awarded.items()
+                            if badge_pk not in badge_pks and
+                               prereqs <= badge_pks]
+                if not eligible:
+                    continue
+                try:
+                    badge = Badge.objects.get(pk=badge_pk)
+                except Badge.DoesNotExist:
+                    continue
+                if len(eligible) == 1:
+                    new_awards = [(eligible[0], badge.award_to(eligible[0]))]
+                else:
+                    new_awards = badge.award_to_many(eligible)
+                for user, award in new_awards:
+                    awarded[user.pk].add(badge_pk)
+                    results.setdefault(user.pk, []).append(award)
+            return results
+        finally:
+            cascading.difference_update(users_by_pk)
+
+
+graph = PrerequisiteGraph()
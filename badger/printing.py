@@ -3,6 +3,7 @@
 
 import logging
 import math
+from itertools import islice
 import urllib
 import urllib2
 try:
@@ -33,6 +34,8 @@ from django.http import (HttpResponseRedirect, HttpResponse,
 
 from django.utils.html import conditional_escape
 
+from badger.caching import image_cache
+
 
 def render_claims_to_pdf(request, slug, claim_group, deferred_awards):
     """Currently hard-coded to print to Avery 22805 labels"""
@@ -62,11 +65,11 @@ def render_claims_to_pdf(request, slug, claim_group, deferred_awards):
     rows = int((metrics['page_height'] - metrics['top_margin']) /
                (metrics['height'] + metrics['vertical_spacing']))
     per_page = (cols * rows)
-    label_ct = len(deferred_awards)
-    page_ct = math.ceil(label_ct / per_page)
 
-    pages = [deferred_awards[x:x + (per_page)]
-             for x in range(0, label_ct, per_page)]
+    # Take a page's worth of labels at a time, so that claim tokens can be
+    # minted as they're printed rather than all held in memory.
+    labels = iter(deferred_awards)
+    pages = iter(lambda: list(islice(labels, per_page)), [])
 
     response = HttpResponse(content_type='application/pdf; charset=utf-8')
     if not debug:
@@ -95,9 +98,7 @@ def render_claims_to_pdf(request, slug, claim_group, deferred_awards):
                     continue
 
                 if not badge_img:
-                    image_fin = da.badge.image.file
-                    image_fin.open()
-                    badge_img = ImageReader(StringIO(image_fin.read()))
+                    badge_img = badge_image_reader(da.badge)
 
                 c.saveState()
                 render_label(request, c, metrics, da, badge_img, debug)
@@ -116,6 +117,17 @@ def render_claims_to_pdf(request, slug, claim_group, deferred_awards):
     return response
 
 
+def badge_image_reader(badge):
+    """ImageReader for a badge's image, kept in image_cache between PDFs"""
+    def build():
+        reader = ImageReader(StringIO(badge.image_png()[0]))
+        # Readers keep hold of the decoded pixels once drawn.
+        width, height = reader.getSize()
+        return reader, width * height * 4
+    return image_cache.get(badge.image_cache_key(), 'reader', build,
+                           size=lambda built: built[1])[0]
+
+
 def render_label(request, c, metrics, da, badge_img, debug):
     """Render a single label"""
     badge = da.badge
@@ -0,0 +1,256 @@
+"""Static hosted assertions
+
+With ``BADGER_PUBLISH_ASSERTIONS`` enabled, the Open Badges assertion of each
+award and the serialization of each badge are written as JSON files to
+storage, and baked award images point at the published assertion rather
+than at the ``award_detail_json`` view. A plain web server can then answer
+verifiers without going through Django.
+
+Files are written when awards are made, rewritten when the awards, their
+badges or the users they show change, and removed when awards are deleted or
+hidden. Rewrites are left to ``badger_worker`` with
+``BADGER_ASYNC_SIDE_EFFECTS``, and otherwise done at the end of the request,
+after the response. On local storage, files are replaced by renaming, so a
+web server never finds one missing or half written.
+``BADGER_PUBLISH_STORAGE`` names the storage class to write to, the badge
+uploads storage by default. Run the ``badger_publish_assertions`` command
+after enabling publishing, to write files for existing awards.
+"""
+import errno
+import os
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+from urlparse import urljoin
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.files.base import ContentFile
+from django.core.files.storage import get_storage_class
+from django.core.signals import request_started, request_finished
+from django.db import connection
+from django.db.models import Q
+
+import badger
+
+
+BADGES_DIR = 'obi/badges'
+AWARDS_DIR = 'obi/awards'
+
+_storages = dict()
+
+
+def get_storage():
+    """The storage configured by BADGER_PUBLISH_STORAGE"""
+    path = badger.settings.PUBLISH_STORAGE
+    if not path:
+        from badger.models import BADGE_UPLOADS_FS
+        return BADGE_UPLOADS_FS
+    storage = _storages.get(path)
+    if storage is None:
+        storage = _storages[path] = get_storage_class(path)()
+    return storage
+
+
+def badge_path(badge_pk):
+    return '%s/%s.json' % (BADGES_DIR, badge_pk)
+
+
+def award_path(award_pk):
+    return '%s/%s.json' % (AWARDS_DIR, award_pk)
+
+
+def award_url(award, base_url=None):
+    """Absolute URL of an award's published assertion"""
+    if base_url is None:
+        base_url = 'http://%s' % (Site.objects.get_current().domain,)
+    return urljoin(base_url, get_storage().url(award_path(award.pk)))
+
+
+def _write(storage, name, content):
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Storages pick another name rather than overwrite a file.
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(content))
+        return
+
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    # Written beside the file and renamed over it, which is atomic, so the
+    # file is never missing or half written.
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(content)
+        os.chmod(temp_path, getattr(storage, 'file_permissions_mode', None)
+                 or getattr(settings, 'FILE_UPLOAD_PERMISSIONS', None)
+                 or 0644)
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def _remove(storage, names):
+    for name in names:
+        if storage.exists(name):
+            storage.delete(name)
+
+
+def publish(badge_ids=(), award_ids=()):
+    """Write the JSON of badges and awards, removing files for any no
+    longer visible"""
+    from badger.caching import obi_cache
+    from badger.models import Award, Badge, chunked
+    storage = get_storage()
+    for chunk in chunked(sorted(set(badge_ids))):
+        found = set()
+        for badge in Badge.objects.filter(pk__in=chunk):
+            _write(storage, badge_path(badge.pk), obi_cache.badge_json(badge))
+            found.add(badge.pk)
+        _remove(storage, [badge_path(pk) for pk in chunk if pk not in found])
+    for chunk in chunked(sorted(set(award_ids))):
+        found = set()
+        for award in (Award.objects.filter(pk__in=chunk)
+                                   .select_related('badge', 'user')):
+            _write(storage, award_path(award.pk),
+                   obi_cache.assertion_json(award))
+            found.add(award.pk)
+        _remove(storage, [award_path(pk) for pk in chunk if pk not in found])
+
+
+class PendingChanges(object):
+    """Badges, awards and users changed during a request, to be published
+    again once it's finished"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def begin_request(self, **kwargs):
+        self._local.changed = (set(), set(), set())
+
+    def add(self, badge_ids, award_ids, user_ids):
+        """Note changes, publishing them right away outside of a request"""
+        changed = getattr(self._local, 'changed', None)
+        if changed is None:
+            _publish_changed(badge_ids, award_ids, user_ids)
+            return
+        for ids, more in zip(changed, (badge_ids, award_ids, user_ids)):
+            ids.update(more)
+
+    def flush(self, **kwargs):
+        changed = getattr(self._local, 'changed', None)
+        self._local.changed = None
+        if changed and any(changed):
+            _publish_changed(*changed)
+
+
+pending_changes = PendingChanges()
+
+
+def publish_changed(badge_ids=(), award_ids=(), user_ids=()):
+    """Publish again everything showing the changed badges, awards or users,
+    leaving it to badger_worker with BADGER_ASYNC_SIDE_EFFECTS, or otherwise
+    to the end of the request"""
+    if not badger.settings.PUBLISH_ASSERTIONS:
+        return
+    if badger.settings.ASYNC_SIDE_EFFECTS:
+        _publish_changed(badge_ids, award_ids, user_ids)
+    else:
+        pending_changes.add(badge_ids, award_ids, user_ids)
+
+
+def _publish_changed(badge_ids, award_ids, user_ids):
+    from badger.models import Award, Badge
+    badge_ids, award_ids = set(badge_ids), set(award_ids)
+    if user_ids:
+        badge_ids.update(Badge.objects.filter(creator__in=user_ids)
+                                      .values_list('pk', flat=True))
+        award_ids.update(Award.objects.filter(Q(user__in=user_ids) |
+                                              Q(creator__in=user_ids))
+                                      .values_list('pk', flat=True))
+    if badge_ids:
+        # Assertions include their badge.
+        award_ids.update(Award.objects.filter(badge__in=badge_ids)
+                                      .values_list('pk', flat=True))
+    if badger.settings.ASYNC_SIDE_EFFECTS:
+        from badger import outbox
+        outbox.enqueue(outbox.BADGE_PUBLISH, badge_ids)
+        outbox.enqueue(outbox.AWARD_PUBLISH, award_ids)
+    else:
+        publish(badge_ids, award_ids)
+
+
+def unpublish(badge_ids=(), award_ids=()):
+    """Remove the files for deleted badges and awards"""
+    if not badger.settings.PUBLISH_ASSERTIONS:
+        return
+    _remove(get_storage(), [badge_path(pk) for pk in badge_ids] +
+                           [award_path(pk) for pk in award_ids])
+
+
+def publish_all(threads=1, batch_size=None):
+    """Write the JSON of every badge and award, in batches spread over
+    threads, and remove files for any others. Returns the number of badges
+    and awards."""
+    from badger.models import Award, Badge, BULK_CHUNK_SIZE
+    batch_size = batch_size or BULK_CHUNK_SIZE
+    badge_ids = list(Badge.objects.order_by('pk')
+                                  .values_list('pk', flat=True))
+    award_ids = list(Award.objects.order_by('pk')
+                                  .values_list('pk', flat=True))
+    jobs = ([(badge_ids[idx:idx + batch_size], ())
+             for idx in range(0, len(badge_ids), batch_size)] +
+            [((), award_ids[idx:idx + batch_size])
+             for idx in range(0, len(award_ids), batch_size)])
+    if threads > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(threads, len(jobs)))
+        try:
+            pool.map(_threaded_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            publish(*job)
+    _prune(BADGES_DIR, set(badge_ids))
+    _prune(AWARDS_DIR, set(award_ids))
+    return len(badge_ids), len(award_ids)
+
+
+def _threaded_job(job):
+    try:
+        publish(*job)
+    finally:
+        # Each thread gets its own DB connection, which would otherwise be
+        # left open.
+        connection.close()
+
+
+def _prune(directory, ids):
+    """Remove files in a directory for objects not among the IDs"""
+    storage = get_storage()
+    try:
+        names = storage.listdir(directory)[1]
+    except OSError:
+        return
+    for name in names:
+        if name.startswith('.'):
+            # Still being written
+            continue
+        pk = name.split('.')[0]
+        if not pk.isdigit() or int(pk) not in ids:
+            storage.delete('%s/%s' % (directory, name))
+
+
+request_started.connect(pending_changes.begin_request,
+                        dispatch_uid='badger.publishing.begin_request')
+request_finished.connect(pending_changes.flush,
+                         dispatch_uid='badger.publishing.flush')
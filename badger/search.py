@@ -0,0 +1,212 @@
+"""Keyword search over badges and awards
+
+Managers using ``SearchManagerMixin`` hand searches to the backend named by
+``BADGER_SEARCH_BACKEND``, the dotted path of a class:
+
+``badger.search.TokenIndexBackend``
+    The default. An inverted index in the ``SearchToken`` table, with a row
+    for each word in each object's search fields, kept current as objects
+    are saved and deleted. Every word in a query is matched as the prefix of
+    a word in the index, found through an index range scan rather than by
+    scanning every row. Results can be ranked by relevance, weighting words
+    from earlier search fields more heavily, and whole words above prefixes.
+
+``badger.search.IcontainsBackend``
+    Case-insensitive substring matching straight against the search fields.
+    Needs no index, but reads every row for every search.
+
+Other backends, for example on SQLite FTS5 tables or Postgres tsvector
+columns, can subclass ``SearchBackend``. Run the ``badger_rebuild_search``
+command after switching to the token index from another backend.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.importlib import import_module
+
+import badger
+
+
+# Longest word kept in the index, longer ones are cut short
+MAX_TOKEN_LENGTH = 64
+
+# Weight of whole-word matches relative to prefix matches when ranking
+WHOLE_WORD_BOOST = 2
+
+find_tokens = re.compile(r'\w+', re.U).findall
+
+
+def tokenize(text):
+    """Lowercased words in a text"""
+    return [token[:MAX_TOKEN_LENGTH] for token in find_tokens(text.lower())]
+
+
+def model_key(model):
+    """Name a model is indexed under"""
+    opts = model._meta
+    return '%s.%s' % (opts.app_label, opts.object_name.lower())
+
+
+def token_weights(instance, fields):
+    """Weights of the words in an object's search fields, by word. Each
+    field outweighs those after it."""
+    weights = dict()
+    for idx, field in enumerate(fields):
+        weight = len(fields) - idx
+        for token in tokenize(getattr(instance, field) or u''):
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def search_fields(model):
+    return model.objects.search_fields
+
+
+class SearchBackend(object):
+    """Base class for search backends"""
+
+    def search(self, qs, terms, fields, ranked=False):
+        """Filter a queryset down to objects matching every term in a list
+        of normalized query terms, best matches first if ranked"""
+        raise NotImplementedError
+
+    def index(self, model, instances, created=False):
+        """Bring the index up to date for saved objects of a model"""
+
+    def unindex(self, model, pks):
+        """Drop deleted objects of a model from the index"""
+
+    def rebuild(self, model):
+        """Index every object of a model from scratch, returning how many"""
+        return 0
+
+
+class IcontainsBackend(SearchBackend):
+    """Case-insensitive substring matching against the search fields"""
+
+    def search(self, qs, terms, fields, ranked=False):
+        query = None  # Query to search for every search term
+        for term in terms:
+            or_query = None  # Query to search for a given term in each field
+            for field_name in fields:
+                q = Q(**{"%s__icontains" % field_name: term})
+                if or_query is None:
+                    or_query = q
+                else:
+                    or_query = or_query | q
+            if query is None:
+                query = or_query
+            else:
+                query = query & or_query
+        if query is None:
+            return qs
+        return qs.filter(query)
+
+
+class TokenIndexBackend(SearchBackend):
+    """Inverted index of words in the search fields, see the module
+    docstring"""
+
+    def search(self, qs, terms, fields, ranked=False):
+        from badger.models import SearchToken
+        prefixes = [token for term in terms for token in tokenize(term)]
+        if not prefixes:
+            return qs.none()
+        key = model_key(qs.model)
+        tokens = SearchToken.objects.filter(model=key)
+        for prefix in prefixes:
+            qs = qs.filter(pk__in=tokens.filter(_prefix_query(prefix))
+                                        .values('object_id'))
+        if ranked:
+            # Best matches first, falling back on the order already set
+            qs = (qs.extra(select={'relevance': self._relevance_sql(
+                               qs.model, len(prefixes))},
+                           select_params=self._relevance_params(
+                               key, prefixes))
+                    .order_by('-relevance', *qs.query.order_by))
+        return qs
+
+    def _relevance_sql(self, model, count):
+        from badger.models import SearchToken
+        qn = connection.ops.quote_name
+        opts = model._meta
+        return ('SELECT SUM(st.%(weight)s * CASE WHEN st.%(token)s IN '
+                '(%(terms)s) THEN %(boost)s ELSE 1 END) FROM %(table)s st '
+                'WHERE st.%(model)s = %%s AND st.%(object_id)s = '
+                '%(outer)s.%(pk)s AND (%(prefixes)s)' % dict(
+                    weight=qn('weight'), token=qn('token'),
+                    model=qn('model'), object_id=qn('object_id'),
+                    table=qn(SearchToken._meta.db_table),
+                    outer=qn(opts.db_table), pk=qn(opts.pk.column),
+                    boost=WHOLE_WORD_BOOST,
+                    terms=', '.join(['%s'] * count),
+                    prefixes=' OR '.join(
+                        ['(st.%s >= %%s AND st.%s < %%s)' %
+                         (qn('token'), qn('token'))] * count)))
+
+    def _relevance_params(self, key, prefixes):
+        params = list(prefixes) + [key]
+        for prefix in prefixes:
+            params.extend(_prefix_range(prefix))
+        return params
+
+    def index(self, model, instances, created=False):
+        from badger.models import SearchToken, chunked
+        key = model_key(model)
+        fields = search_fields(model)
+        if not created:
+            self.unindex(model, [instance.pk for instance in instances])
+        new_tokens = list()
+        for instance in instances:
+            for token, weight in sorted(
+                    token_weights(instance, fields).items()):
+                new_tokens.append(SearchToken(model=key,
+                                              object_id=instance.pk,
+                                              token=token, weight=weight))
+        for chunk in chunked(new_tokens):
+            SearchToken.objects.bulk_create(chunk)
+
+    def unindex(self, model, pks):
+        from badger.models import SearchToken, chunked
+        key = model_key(model)
+        for chunk in chunked(pks):
+            SearchToken.objects.filter(model=key,
+                                       object_id__in=chunk).delete()
+
+    def rebuild(self, model):
+        from badger.models import SearchToken, atomic, chunked
+        manager = model._default_manager
+        pks = list(manager.order_by('pk').values_list('pk', flat=True))
+        with atomic():
+            SearchToken.objects.filter(model=model_key(model)).delete()
+            for chunk in chunked(pks):
+                instances = (manager.filter(pk__in=chunk)
+                                    .only('pk', *search_fields(model)))
+                self.index(model, instances, created=True)
+        return len(pks)
+
+
+def _prefix_range(prefix):
+    """Bounds of the words starting with a prefix, so the lookup can use an
+    index range scan in any database, where LIKE may not"""
+    return prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+
+def _prefix_query(prefix):
+    lower, upper = _prefix_range(prefix)
+    return Q(token__gte=lower, token__lt=upper)
+
+
+_backends = dict()
+
+
+def get_backend():
+    """The search backend instance configured by BADGER_SEARCH_BACKEND"""
+    path = badger.settings.SEARCH_BACKEND
+    backend = _backends.get(path)
+    if backend is None:
+        module_name, class_name = path.rsplit('.', 1)
+        backend = _backends[path] = getattr(import_module(module_name),
+                                            class_name)()
+    return backend
@@ -20,14 +20,71 @@ The sender will be :py:class:`badges.models.Award` class. The
 ``award`` argument will be the ``Award`` instance that is being
 awarded.
 
+Receivers doing work per award can instead listen for
+:py:func:`badges.signals.badges_were_awarded`, which delivers every award
+made during an operation in one call. Set ``BADGER_PER_AWARD_SIGNALS`` to
+``False`` to send only that one.
+
 """
+import sys
+import threading
+from contextlib import contextmanager
+from time import time
+
+import django
 from django.dispatch import Signal
+from django.dispatch.dispatcher import _make_id
+
+from .stats import signal_stats
+
+
+class InstrumentedSignal(Signal):
+    """Signal that times its receivers while enabled, see
+    :py:mod:`badger.stats`"""
+    name = None
+
+    def send(self, sender, **named):
+        if not signal_stats.is_enabled():
+            return super(InstrumentedSignal, self).send(sender, **named)
+        return self._send_timed(sender, named, robust=False)
+
+    def send_robust(self, sender, **named):
+        if not signal_stats.is_enabled():
+            return super(InstrumentedSignal, self).send_robust(sender,
+                                                               **named)
+        return self._send_timed(sender, named, robust=True)
+
+    def _send_timed(self, sender, named, robust):
+        responses = []
+        if not self.receivers:
+            return responses
+        # HACK: Django < 1.6 looks up receivers by sender ID
+        if django.VERSION < (1, 6):
+            receivers = self._live_receivers(_make_id(sender))
+        else:
+            receivers = self._live_receivers(sender)
+        for receiver in receivers:
+            start = time()
+            try:
+                response = receiver(signal=self, sender=sender, **named)
+            except Exception as err:
+                signal_stats.record(self.name, receiver, time() - start,
+                                    failed=True)
+                if not robust:
+                    raise
+                if not hasattr(err, '__traceback__'):
+                    err.__traceback__ = sys.exc_info()[2]
+                responses.append((receiver, err))
+            else:
+                signal_stats.record(self.name, receiver, time() - start)
+                responses.append((receiver, response))
+        return responses
 
 
 def _signal_with_docs(args, doc):
     # FIXME - this fixes the docstring, but not the provided arguments
     # so the API docs look weird.
-    signal = Signal(providing_args=args)
+    signal = InstrumentedSignal(providing_args=args)
     signal.__doc__ = doc
     return signal
 
@@ -52,6 +109,24 @@ badge_was_awarded = _signal_with_docs(
 
     """)
 
+badges_were_awarded = _signal_with_docs(
+    ['awards'],
+    """Fires off once after a batch of badges is awarded
+
+    Awards made during a single operation, such as
+    :py:meth:`badger.models.Badge.award_to_many`, a Progress update, or a
+    worker batch, including any made by prerequisite cascades, are sent
+    together once the operation is done. ``award_to_many`` sends them after
+    its own transaction is done, which commits it unless it was called
+    inside a transaction of the caller's. Listeners called before an outer
+    transaction commits may see awards that are then rolled back.
+
+    Signal receiver parameters:
+
+    :arg awards: list of Award instances
+
+    """)
+
 user_will_be_nominated = _signal_with_docs(
     ['nomination'],
     """Fires off before user is nominated for a badge
@@ -131,3 +206,59 @@ nomination_was_rejected = _signal_with_docs(
     :arg nomination: the Nomination instance being rejected
 
     """)
+
+feed_cache_lookup = _signal_with_docs(
+    ['feed', 'hit'],
+    """Fires off when a feed is looked up in the rendered-feed cache
+
+    Hits and misses are also counted by :py:data:`badger.stats.cache_stats`
+    under ``feed``; receivers can report them elsewhere.
+
+    Signal receiver parameters:
+
+    :arg feed: the Feed instance
+    :arg hit: whether the rendered feed was found in the cache
+
+    """)
+
+# Name each signal for its stats.
+for _name, _signal in globals().items():
+    if isinstance(_signal, InstrumentedSignal):
+        _signal.name = _name
+
+
+class AwardBatch(object):
+    """Collects new awards for :py:func:`badges_were_awarded`"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def collect(self):
+        """Collect awards made in the block, sending them in one batch when
+        the outermost block is done. Nothing is sent if it raises."""
+        outer = getattr(self._local, 'awards', None)
+        if outer is not None:
+            yield
+            return
+        self._local.awards = awards = []
+        try:
+            yield
+        finally:
+            self._local.awards = None
+        if awards:
+            self._send(awards)
+
+    def add(self, award):
+        """Note a new award, sending it right away outside of collect()"""
+        awards = getattr(self._local, 'awards', None)
+        if awards is None:
+            self._send([award])
+        else:
+            awards.append(award)
+
+    def _send(self, awards):
+        badges_were_awarded.send(sender=awards[0].__class__, awards=awards)
+
+
+award_batch = AwardBatch()
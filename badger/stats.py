@@ -0,0 +1,283 @@
+"""Timing statistics for badger signal receivers
+
+With ``BADGER_SIGNAL_STATS`` enabled, or ``signal_stats.enabled`` set to
+True at runtime, every receiver of a badger signal is timed, and calls,
+cumulative and maximum wall time, and exceptions are counted per signal and
+receiver. Receivers slower than ``BADGER_SIGNAL_SLOW_THRESHOLD`` seconds are
+logged as they happen.
+
+Each process counts in memory, and adds its counts to shared totals in
+Django's cache at the end of a request once ``BADGER_STATS_PUBLISH_INTERVAL``
+seconds have passed since it last did, and when the process exits. Each
+total is its own cache key, added to with ``cache.incr()``, so concurrent
+processes don't lose each other's counts. The ``badger_stats`` management
+command shows the shared totals. Maximum times are only compared and set,
+so treat those as approximate.
+
+Hits and misses of badger's caches, such as the rendered-feed cache, are
+counted the same way by ``cache_stats``, whether or not signals are timed.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+from time import time
+
+from django.core.cache import cache
+from django.core.signals import request_finished
+
+import badger
+
+
+log = logging.getLogger('badger.stats')
+
+CACHE_KEY = 'badger:signal_stats'
+
+# Fields of each entry, keyed by (signal name, receiver name)
+CALLS, TOTAL, MAX, ERRORS = range(4)
+
+CACHE_STATS_KEY = 'badger:cache_stats'
+
+# Fields of each cache entry, keyed by cache name
+HITS, MISSES = range(2)
+
+# Times are shared as whole microseconds, since cache.incr() takes integers.
+MICROSECONDS = 1000000
+
+
+class SharedCounters(object):
+    """Lists of counters by name, totalled across processes in Django's
+    cache
+
+    Every counter is a cache key of its own. An index of the names counted
+    is kept under one more key, and only written when a name is new to it.
+    """
+
+    def __init__(self, prefix, size, maxima=()):
+        self.prefix = prefix
+        self.size = size
+        # Fields holding the largest value seen rather than a sum
+        self.maxima = maxima
+        self.index_key = '%s:index' % prefix
+
+    def _key(self, digest, field):
+        return '%s:%s:%s' % (self.prefix, digest, field)
+
+    def add(self, entries):
+        """Add lists of integer counts by name to the totals"""
+        digests = dict((hashlib.md5(repr(name)).hexdigest(), name)
+                       for name in entries)
+        index = cache.get(self.index_key) or dict()
+        if not set(digests) <= set(index):
+            index.update(digests)
+            cache.set(self.index_key, index, None)
+        for digest, name in digests.items():
+            for field, value in enumerate(entries[name]):
+                key = self._key(digest, field)
+                if field in self.maxima:
+                    if value > (cache.get(key) or 0):
+                        cache.set(key, value, None)
+                elif value:
+                    _incr(key, value)
+
+    def totals(self):
+        """Lists of counts by name"""
+        index = cache.get(self.index_key) or dict()
+        keys = [self._key(digest, field) for digest in index
+                for field in range(self.size)]
+        found = keys and cache.get_many(keys) or dict()
+        return dict((name, [found.get(self._key(digest, field), 0)
+                            for field in range(self.size)])
+                    for digest, name in index.items())
+
+    def clear(self):
+        index = cache.get(self.index_key) or dict()
+        cache.delete_many([self._key(digest, field) for digest in index
+                           for field in range(self.size)] +
+                          [self.index_key])
+
+
+def _incr(key, delta):
+    """Add to a counter in the cache, atomically where the backend can"""
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Not there yet, unless another process has just added it.
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+class Publisher(object):
+    """Counts kept in memory by each process, and published to the
+    SharedCounters of the subclass"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self._last_publish = time()
+
+    def local(self):
+        """Entries counted by this process and not yet published"""
+        with self._lock:
+            return dict((key, list(entry))
+                        for key, entry in self._entries.items())
+
+    def publish(self):
+        """Add this process's counts to the shared totals in the cache"""
+        with self._lock:
+            entries, self._entries = self._entries, dict()
+            self._last_publish = time()
+        if entries:
+            self.shared.add(dict((key, self._to_shared(entry))
+                                 for key, entry in entries.items()))
+
+    def publish_due(self, **kwargs):
+        """Publish if BADGER_STATS_PUBLISH_INTERVAL has passed"""
+        if (time() - self._last_publish >=
+                badger.settings.STATS_PUBLISH_INTERVAL):
+            self.publish()
+
+    def reset(self):
+        """Forget all counts, both local and shared"""
+        with self._lock:
+            self._entries = dict()
+        self.shared.clear()
+
+    def _to_shared(self, entry):
+        return entry
+
+
+def receiver_name(receiver):
+    """Dotted name for a signal receiver, including the class of a bound
+    method"""
+    name = getattr(receiver, '__name__', None) or repr(receiver)
+    owner = getattr(receiver, '__self__', None) or getattr(
+        receiver, 'im_self', None)
+    if owner is not None:
+        name = '%s.%s' % (owner.__class__.__name__, name)
+    module = getattr(receiver, '__module__', None)
+    return module and '%s.%s' % (module, name) or name
+
+
+class SignalStats(Publisher):
+    """Per-receiver call statistics for badger signals"""
+
+    # Whether to time receivers, None to read BADGER_SIGNAL_STATS on next use
+    enabled = None
+
+    shared = SharedCounters(CACHE_KEY, 4, maxima=(MAX,))
+
+    def is_enabled(self):
+        # Checked on every signal sent, so the setting is only read once.
+        if self.enabled is None:
+            self.enabled = bool(badger.settings.SIGNAL_STATS)
+        return self.enabled
+
+    def setting_changed(self, setting, **kwargs):
+        if setting == 'BADGER_SIGNAL_STATS':
+            self.enabled = None
+
+    def record(self, signal_name, receiver, elapsed, failed=False):
+        """Count one call of a receiver that took elapsed seconds"""
+        key = (signal_name, receiver_name(receiver))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [0, 0.0, 0.0, 0]
+            entry[CALLS] += 1
+            entry[TOTAL] += elapsed
+            entry[MAX] = max(entry[MAX], elapsed)
+            if failed:
+                entry[ERRORS] += 1
+
+        threshold = badger.settings.SIGNAL_SLOW_THRESHOLD
+        if threshold and elapsed >= threshold:
+            log.warning('Slow receiver %s for %s took %.3fs' %
+                        (key[1], signal_name, elapsed))
+
+    def _to_shared(self, entry):
+        entry = list(entry)
+        for field in (TOTAL, MAX):
+            entry[field] = int(round(entry[field] * MICROSECONDS))
+        return entry
+
+    def snapshot(self):
+        """Shared totals along with this process's unpublished counts, as a
+        list of dicts sorted by cumulative time"""
+        entries = dict()
+        for key, entry in self.shared.totals().items():
+            for field in (TOTAL, MAX):
+                entry[field] = float(entry[field]) / MICROSECONDS
+            entries[key] = entry
+        _merge(entries, self.local())
+        rows = []
+        for (signal_name, receiver), entry in entries.items():
+            rows.append(dict(signal=signal_name, receiver=receiver,
+                             calls=entry[CALLS], total=entry[TOTAL],
+                             max=entry[MAX], errors=entry[ERRORS]))
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows
+
+
+def _merge(into, entries):
+    for key, entry in entries.items():
+        total = into.get(key)
+        if total is None:
+            into[key] = list(entry)
+        else:
+            total[CALLS] += entry[CALLS]
+            total[TOTAL] += entry[TOTAL]
+            total[MAX] = max(total[MAX], entry[MAX])
+            total[ERRORS] += entry[ERRORS]
+
+
+class CacheStats(Publisher):
+    """Hit and miss counts for badger's caches"""
+
+    shared = SharedCounters(CACHE_STATS_KEY, 2)
+
+    def record(self, name, hit):
+        """Count one lookup in the named cache"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._entries[name] = [0, 0]
+            if hit:
+                entry[HITS] += 1
+            else:
+                entry[MISSES] += 1
+
+    def snapshot(self):
+        """Shared totals along with this process's unpublished counts, as a
+        list of dicts sorted by cache name"""
+        entries = self.shared.totals()
+        for name, entry in self.local().items():
+            total = entries.setdefault(name, [0, 0])
+            total[HITS] += entry[HITS]
+            total[MISSES] += entry[MISSES]
+        rows = []
+        for name, entry in sorted(entries.items()):
+            lookups = entry[HITS] + entry[MISSES]
+            rows.append(dict(cache=name, hits=entry[HITS],
+                             misses=entry[MISSES],
+                             ratio=lookups and float(entry[HITS]) / lookups))
+        return rows
+
+    def hit_ratio(self, name):
+        """Share of lookups in the named cache that were hits, or None
+        before any lookups"""
+        for row in self.snapshot():
+            if row['cache'] == name:
+                return row['ratio']
+        return None
+
+
+signal_stats = SignalStats()
+cache_stats = CacheStats()
+
+request_finished.connect(signal_stats.publish_due,
+                         dispatch_uid='badger.stats.publish')
+request_finished.connect(cache_stats.publish_due,
+                         dispatch_uid='badger.stats.publish_cache_stats')
+atexit.register(signal_stats.publish)
+atexit.register(cache_stats.publish)
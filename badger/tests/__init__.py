@@ -1,10 +1,14 @@
 import logging
 
 from contextlib import contextmanager
+from functools import wraps
 
 from django.conf import settings
 from django.core.management import call_command
+from django.core.signals import request_started, request_finished
+from django.db import connection, reset_queries
 from django.db.models import loading
+from django.test.signals import setting_changed
 from django.contrib.auth.models import User
 from django import test
 from django.utils.translation import get_language
@@ -21,6 +25,54 @@ except ImportError:
 import badger
 
 from badger.models import (Badge, Award, Progress, DeferredAward)
+from badger.prerequisites import graph as prerequisite_graph
+from badger.stats import signal_stats
+
+
+# Tests overriding BADGER_SIGNAL_STATS have it read again.
+setting_changed.connect(signal_stats.setting_changed,
+                        dispatch_uid='badger.tests.signal_stats')
+
+
+try:
+    from django.test.utils import CaptureQueriesContext
+except ImportError:
+    # HACK: Django < 1.6 has no CaptureQueriesContext, so here's its code
+    class CaptureQueriesContext(object):
+        """Context manager that captures queries executed by the specified
+        connection"""
+
+        def __init__(self, connection):
+            self.connection = connection
+
+        def __iter__(self):
+            return iter(self.captured_queries)
+
+        def __getitem__(self, index):
+            return self.captured_queries[index]
+
+        def __len__(self):
+            return len(self.captured_queries)
+
+        @property
+        def captured_queries(self):
+            return self.connection.queries[self.initial_queries:
+                                           self.final_queries]
+
+        def __enter__(self):
+            self.use_debug_cursor = self.connection.use_debug_cursor
+            self.connection.use_debug_cursor = True
+            self.initial_queries = len(self.connection.queries)
+            self.final_queries = None
+            request_started.disconnect(reset_queries)
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.connection.use_debug_cursor = self.use_debug_cursor
+            request_started.connect(reset_queries)
+            if exc_type is not None:
+                return
+            self.final_queries = len(self.connection.queries)
 
 
 class SettingDoesNotExist:
@@ -38,12 +90,59 @@ def patch_settings(**kwargs):
         old_value = getattr(settings, key, SettingDoesNotExist)
         old_settings.append((key, old_value))
         setattr(settings, key, new_value)
-    yield
-    for key, old_value in old_settings:
-        if old_value is SettingDoesNotExist:
-            delattr(settings, key)
-        else:
-            setattr(settings, key, old_value)
+    try:
+        yield
+    finally:
+        for key, old_value in old_settings:
+            if old_value is SettingDoesNotExist:
+                delattr(settings, key)
+            else:
+                setattr(settings, key, old_value)
+
+
+@contextmanager
+def query_budget(testcase, limit):
+    """Contextmanager to fail a test if the block runs more than limit
+    queries"""
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    testcase.assertTrue(len(context) <= limit,
+        '%s queries executed, %s allowed:\n%s' % (
+            len(context), limit,
+            '\n'.join(q['sql'] for q in context.captured_queries)))
+
+
+def view_query_budget(limit):
+    """Decorator to fail a test if any request it makes runs more than limit
+    queries, so views are held to a fixed number of queries however many
+    objects they show"""
+    def decorator(test_fn):
+        @wraps(test_fn)
+        def wrapped(testcase, *args, **kwargs):
+            requests = []
+
+            def started(environ=None, **kwargs):
+                requests.append((environ and environ.get('PATH_INFO'),
+                                 len(context)))
+
+            def finished(**kwargs):
+                path, start = requests.pop()
+                queries = context.captured_queries[start:]
+                testcase.assertTrue(len(queries) <= limit,
+                    '%s queries executed for %s, %s allowed:\n%s' % (
+                        len(queries), path, limit,
+                        '\n'.join(q['sql'] for q in queries)))
+
+            request_started.connect(started)
+            request_finished.connect(finished)
+            try:
+                with CaptureQueriesContext(connection) as context:
+                    return test_fn(testcase, *args, **kwargs)
+            finally:
+                request_started.disconnect(started)
+                request_finished.disconnect(finished)
+        return wrapped
+    return decorator
 
 
 class BadgerTestCase(test.TestCase):
@@ -78,6 +177,9 @@ class BadgerTestCase(test.TestCase):
         Award.objects.all().delete()
         Badge.objects.all().delete()
 
+        # Rolled back transactions don't signal, so start each test afresh.
+        prerequisite_graph.invalidate()
+
         loading.cache.loaded = False
 
         if get_url_prefix:
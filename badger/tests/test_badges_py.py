@@ -11,11 +11,12 @@ from nose.plugins.attrib import attr
 from . import BadgerTestCase
 
 import badger
-from badger.utils import get_badge, award_badge
+from badger.utils import get_badge, award_badge, award_badge_many
 
 from badger.models import (Badge, Award, Progress,
         BadgeAwardNotAllowedException,
-        BadgeAlreadyAwardedException)
+        BadgeAlreadyAwardedException,
+        BadgePrerequisiteCycleException, atomic)
 
 from badger_example.models import GuestbookEntry
 
@@ -154,6 +155,55 @@ class BadgesPyTest(BadgerTestCase):
         
         ok_(get_badge('master-badger').is_awarded_to(user))
 
+    def test_metabadge_awarded_in_bulk(self):
+        """Bulk awards trigger the meta-badge for everyone who qualifies"""
+        users = [self._get_user(username='bulk_%s' % idx,
+                                email='bulk_%s@example.com' % idx)
+                 for idx in range(4)]
+        qualified, unqualified = users[:3], users[3:]
+
+        for slug in ('test-1', 'test-2', 'awesomeness'):
+            award_badge_many(slug, qualified)
+        award_badge_many('button-clicker', users)
+
+        master = get_badge('master-badger')
+        for user in qualified:
+            ok_(master.is_awarded_to(user))
+        for user in unqualified:
+            ok_(not master.is_awarded_to(user))
+
+    def test_prerequisite_chain_awarded(self):
+        """Awards cascade down a chain of prerequisites in one go"""
+        user = self._get_user()
+        chain = [self._get_badge('Chain %s' % idx) for idx in range(4)]
+        for prereq, badge in zip(chain, chain[1:]):
+            badge.prerequisites.add(prereq)
+        # The last badge also needs an extra, unrelated badge.
+        extra = self._get_badge('Extra')
+        chain[-1].prerequisites.add(extra)
+
+        chain[0].award_to(user)
+        for badge in chain[:-1]:
+            ok_(badge.is_awarded_to(user))
+        ok_(not chain[-1].is_awarded_to(user))
+
+        extra.award_to(user)
+        ok_(chain[-1].is_awarded_to(user))
+        eq_(1, Award.objects.filter(badge=chain[-1], user=user).count())
+
+    def test_prerequisite_cycle_refused(self):
+        """A badge cannot become its own prerequisite, however indirectly"""
+        master = get_badge('master-badger')
+        test_1 = get_badge('test-1')
+        attempts = (lambda: test_1.prerequisites.add(master),
+                    lambda: master.badge_set.add(test_1),
+                    lambda: master.prerequisites.add(master))
+        for attempt in attempts:
+            # Keep the failed m2m add from spoiling the test transaction
+            with atomic():
+                self.assertRaises(BadgePrerequisiteCycleException, attempt)
+        eq_(0, test_1.prerequisites.count())
+
     def test_progress_quiet_save(self):
         """Progress will not raise a BadgeAlreadyAwardedException unless told"""
         b = self._get_badge('imunique')
@@ -1,10 +1,11 @@
+import json
 import logging
 import feedparser
 
 from django.conf import settings
 
 from django.http import HttpRequest
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
 
 from pyquery import PyQuery as pq
 
@@ -20,11 +21,21 @@ try:
 except ImportError:
     from django.core.urlresolvers import reverse
 
-from . import BadgerTestCase
+from . import BadgerTestCase, patch_settings, query_budget, view_query_budget
 
 from badger.models import (Badge, Award, Progress,
         BadgeAwardNotAllowedException)
 from badger.utils import get_badge, award_badge
+from badger.feeds import AwardsRecentFeed
+from badger.signals import feed_cache_lookup
+from badger.stats import cache_stats
+
+
+def content_of(response):
+    """All of a response's content, whether it's streamed or not"""
+    if getattr(response, 'streaming', False):
+        return ''.join(response.streaming_content)
+    return response.content
 
 
 class BadgerFeedsTest(BadgerTestCase):
@@ -72,6 +83,178 @@ class BadgerFeedsTest(BadgerTestCase):
 
             ok_(found_it)
 
+    @view_query_budget(3)
+    def test_feed_query_budget(self):
+        """Feeds take the same few queries however many items they show"""
+        user = self._get_user()
+        users = [self._get_user(username='tester%s' % idx) for idx in range(8)]
+        for idx in range(8):
+            badge = Badge.objects.create(creator=user,
+                                         title="Code Badge #%s" % idx)
+            badge.award_to_many(users)
+
+        for feed_url in (
+                reverse('badger.feeds.awards_recent', args=('atom', )),
+                reverse('badger.feeds.awards_by_badge',
+                        args=('rss', badge.slug, )),
+                reverse('badger.feeds.awards_by_user',
+                        args=('json', users[0].username,)),
+                reverse('badger.feeds.badges_recent', args=('atom', )),
+                reverse('badger.feeds.badges_by_user',
+                        args=('json', user.username,))):
+            r = self.client.get(feed_url)
+            eq_(200, r.status_code)
+            ok_(user.username in content_of(r))
+
+    def test_conditional_get(self):
+        """Unchanged feeds are answered with 304, or from the cache"""
+        user = self._get_user()
+        user2 = self._get_user(username='tester2')
+        b1 = Badge.objects.create(creator=user, title="Code Badge #1")
+        b1.award_to(user2)
+        feed_url = reverse('badger.feeds.awards_by_badge',
+                           args=('json', b1.slug, ))
+
+        lookups = []
+
+        def lookup(sender, feed, hit, **kwargs):
+            lookups.append(hit)
+        feed_cache_lookup.connect(lookup)
+        cache_stats.reset()
+        try:
+            r = self.client.get(feed_url)
+            eq_(200, r.status_code)
+            etag, last_modified = r['ETag'], r['Last-Modified']
+
+            r = self.client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+            eq_(304, r.status_code)
+            eq_('', r.content)
+            r = self.client.get(feed_url,
+                                HTTP_IF_MODIFIED_SINCE=last_modified)
+            eq_(304, r.status_code)
+
+            # A JSONP callback is part of the cached feed.
+            r = self.client.get(feed_url, dict(callback='show'),
+                                HTTP_IF_NONE_MATCH=etag)
+            eq_(200, r.status_code)
+            body = content_of(r)
+            ok_(body.startswith('show('))
+            with query_budget(self, 2):
+                r2 = self.client.get(feed_url, dict(callback='show'))
+            eq_(body, content_of(r2))
+            eq_([False, False, True], lookups)
+            eq_(1 / 3.0, cache_stats.hit_ratio('feed'))
+
+            # New awards change the feed.
+            b1.award_to(self._get_user(username='tester3'))
+            r = self.client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+            eq_(200, r.status_code)
+            ok_('tester3' in content_of(r))
+
+            etag = r['ETag']
+
+            # So do changes to the badge and users the awards show, but not
+            # logging in.
+            b1.title = 'Renamed Badge'
+            b1.save()
+            r = self.client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+            eq_(200, r.status_code)
+            ok_('Renamed Badge' in content_of(r))
+            etag = r['ETag']
+            user2.save(update_fields=['last_login'])
+            # Only the badge is looked up to answer with 304.
+            with query_budget(self, 1):
+                r = self.client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+            eq_(304, r.status_code)
+            user2.first_name = 'Tess'
+            user2.save()
+            r = self.client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+            eq_(200, r.status_code)
+
+            with patch_settings(BADGER_FEED_CACHE_TIMEOUT=0):
+                eq_(200, self.client.get(feed_url).status_code)
+            eq_(6, len(lookups))
+        finally:
+            feed_cache_lookup.disconnect(lookup)
+            cache_stats.reset()
+
+    def test_json_feed_streams(self):
+        """JSON feeds stream the same bytes as encoding the feed at once"""
+        user = self._get_user()
+        b1 = Badge.objects.create(creator=user, title="Code Badge #1",
+                                  description="Stream me")
+        b1.award_to_many([self._get_user(username='tester%s' % idx)
+                          for idx in range(5)])
+        feed_url = reverse('badger.feeds.awards_recent', args=('json', ))
+
+        for params in (dict(), dict(callback='show')):
+            with patch_settings(BADGER_FEED_CACHE_TIMEOUT=0):
+                r = self.client.get(feed_url, params)
+            eq_(200, r.status_code)
+            ok_(r.streaming)
+            streamed = ''.join(r.streaming_content)
+
+            feed = AwardsRecentFeed()
+            request = RequestFactory().get(feed_url, params)
+            feed.request = request
+            feedgen = feed.get_feed(feed.get_object(request, 'json'),
+                                    request)
+            expected = json.dumps(feedgen.build_feed(),
+                                  default=feedgen._encode_complex)
+            if params:
+                expected = 'show(%s)' % expected
+            eq_(expected, streamed)
+            eq_(5, len(feedgen.build_feed()['items']))
+
+            # With a cache, misses stream too, and the feed is cached once
+            # it's all been sent.
+            r = self.client.get(feed_url, params)
+            ok_(r.streaming)
+            eq_(expected, ''.join(r.streaming_content))
+            r = self.client.get(feed_url, params)
+            ok_(not r.streaming)
+            eq_(expected, r.content)
+
+    def test_polling(self):
+        """Feeds can be polled for only the items created since a cursor"""
+        user = self._get_user()
+        b1 = Badge.objects.create(creator=user, title="Code Badge #1")
+        users = [self._get_user(username='tester%s' % idx) for idx in range(5)]
+        for awardee in users[:3]:
+            b1.award_to(awardee)
+        feed_url = reverse('badger.feeds.awards_by_badge',
+                           args=('json', b1.slug, ))
+
+        def names(data):
+            return [item['title'].split()[-1] for item in data['items']]
+
+        data = json.loads(content_of(self.client.get(feed_url)))
+        eq_(['tester2', 'tester1', 'tester0'], names(data))
+        since = data['next']
+
+        data = json.loads(content_of(self.client.get(
+            feed_url, dict(since=since))))
+        eq_([], names(data))
+        eq_(since, data['next'])
+
+        for awardee in users[3:]:
+            b1.award_to(awardee)
+        with patch_settings(BADGER_MAX_FEED_POLL_ITEMS=1):
+            data = json.loads(content_of(self.client.get(
+                feed_url, dict(since=since))))
+            eq_(['tester3'], names(data))
+            data = json.loads(content_of(self.client.get(
+                feed_url, dict(since=data['next']))))
+            eq_(['tester4'], names(data))
+
+        award = Award.objects.get(user=users[2])
+        data = json.loads(content_of(self.client.get(
+            feed_url, dict(after_id=award.pk))))
+        eq_(['tester4', 'tester3'], names(data))
+
+        for params in (dict(since='garbage'), dict(after_id='x')):
+            eq_(404, self.client.get(feed_url, params).status_code)
+
     def _get_user(self, username="tester", email="tester@example.com",
             password="trustno1"):
         (user, created) = User.objects.get_or_create(username=username,
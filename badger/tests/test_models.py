@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import shutil
+import socket
 import time
 from os.path import dirname
+from StringIO import StringIO
 
 try:
     from PIL import Image
 except ImportError:
     import Image
 
+import django
 from django.conf import settings
 
 from django.core.management import call_command
@@ -16,11 +20,13 @@ from django.db.models import loading
 from django.core.files.base import ContentFile
 from django.http import HttpRequest
 from django.test.client import Client
+from django.utils import timezone
 
 from django.core import mail
 
 from nose.tools import assert_equal, with_setup, assert_false, eq_, ok_
 from nose.plugins.attrib import attr
+from nose.plugins.skip import SkipTest
 
 if "notification" in settings.INSTALLED_APPS:
     from notification import models as notification
@@ -34,9 +40,16 @@ except ImportError:
 
 from django.contrib.auth.models import User
 
-from . import BadgerTestCase, patch_settings
+from . import BadgerTestCase, patch_settings, query_budget
 
 import badger
+from badger import baking, leaderboards, outbox, publishing
+from badger.buffers import progress_buffer
+from badger.caching import awarded_badges, image_cache, ImageCache
+from badger.stats import CacheStats, signal_stats
+from badger import mail as badger_mail
+from badger.mail import send_claim_invitations
+from badger.pagination import CursorPaginator, InvalidCursor
 from badger.models import (Badge, Award, Nomination, Progress, DeferredAward,
         BadgeAwardNotAllowedException,
         BadgeAlreadyAwardedException,
@@ -44,7 +57,12 @@ from badger.models import (Badge, Award, Nomination, Progress, DeferredAward,
         NominationApproveNotAllowedException,
         NominationAcceptNotAllowedException,
         NominationRejectNotAllowedException,
-        SITE_ISSUER, slugify)
+        BadgeDeferredAwardManagementNotAllowedException,
+        OutboxMessage, UserAwardCount, LeaderboardEntry, LeaderboardScore,
+        SearchToken,
+        SITE_ISSUER, slugify, make_random_code, taggit)
+from badger.signals import badge_was_awarded, badges_were_awarded
+from badger.claim_tokens import is_token, parse_token
 
 from badger_example.models import GuestbookEntry
 
@@ -53,6 +71,18 @@ BASE_URL = 'http://example.com'
 BADGE_IMG_FN = "%s/fixtures/default-badge.png" % dirname(dirname(__file__))
 
 
+class UnreachableEmailBackend(object):
+    """Mail backend for a mail server that's down"""
+    opened = 0
+
+    def __init__(self, **kwargs):
+        pass
+
+    def open(self):
+        UnreachableEmailBackend.opened += 1
+        raise socket.error('Connection refused')
+
+
 class BadgerBadgeTest(BadgerTestCase):
 
     def test_get_badge(self):
@@ -113,6 +143,650 @@ class BadgerBadgeTest(BadgerTestCase):
 
         eq_(1, Award.objects.filter(badge=b, user=user).count())
 
+    def test_award_query_budget(self):
+        """One award costs a bounded number of queries"""
+        badge = self._get_badge()
+        dep_badge = self._get_badge(title="Dependent Badge")
+        dep_badge.prerequisites.add(badge,
+                                    self._get_badge(title="Other Badge"))
+        users = [self._get_user(username='budget_%s' % idx)
+                 for idx in range(2)]
+
+        with awarded_badges.scope():
+            # Awarded set lookup, insert, recipient hash, badge award
+            # counter, user award counter (update, then savepoint and insert
+            # for the user's first award), prerequisites graph reload,
+            # progress reset
+            with query_budget(self, 10):
+                badge.award_to(awardee=users[0])
+            with query_budget(self, 0):
+                ok_(badge.is_awarded_to(users[0]))
+                ok_(not dep_badge.is_awarded_to(users[0]))
+
+        # Without a cache scope, the cost is still bounded
+        with query_budget(self, 10):
+            badge.award_to(awardee=users[1])
+
+    def test_awarded_badges_cache_invalidation(self):
+        """Cached awarded badge sets notice awards changing"""
+        badge = self._get_badge()
+        user = self._get_user()
+
+        for timeout in (0, 60):
+            with patch_settings(BADGER_AWARDED_CACHE_TIMEOUT=timeout):
+                with awarded_badges.scope():
+                    ok_(not badge.is_awarded_to(user))
+                    award = badge.award_to(awardee=user)
+                    ok_(badge.is_awarded_to(user))
+
+                    award.hidden = True
+                    award.save()
+                    ok_(not badge.is_awarded_to(user))
+
+                    award.hidden = False
+                    award.save()
+                    ok_(badge.is_awarded_to(user))
+
+                    award.delete()
+                    ok_(not badge.is_awarded_to(user))
+
+    def test_award_to_many(self):
+        """Can award a badge to many users and emails at once"""
+        badge = self._get_badge()
+        already = self._get_user(username='already',
+                                 email='already@example.com')
+        existing = badge.award_to(awardee=already)
+        users = [self._get_user(username='bulk_%s' % idx,
+                                email='bulk_%s@example.com' % idx)
+                 for idx in range(5)]
+        by_email = self._get_user(username='by_email',
+                                  email='by_email@example.com')
+        deferred_email = 'nobody_yet@example.com'
+
+        awardees = users + [already, by_email.email, deferred_email]
+        results = badge.award_to_many(awardees, awarder=badge.creator,
+                                      description='In bulk')
+
+        eq_(awardees, [awardee for awardee, result in results])
+        results = dict((isinstance(k, basestring) and k or k.pk, v)
+                       for k, v in results)
+        for user in users + [by_email]:
+            ok_(badge.is_awarded_to(user))
+            eq_(user, results.get(user.pk, results.get(user.email)).user)
+            eq_('In bulk', Award.objects.get(badge=badge, user=user)
+                                        .description)
+        eq_(existing.pk, results[already.pk].pk)
+        eq_(1, Award.objects.filter(badge=badge, user=already).count())
+
+        da = results[deferred_email]
+        ok_(hasattr(da, 'claim_code'))
+        eq_(da.pk, DeferredAward.objects.get(email=deferred_email).pk)
+        eq_(1, len([m for m in mail.outbox if deferred_email in m.to]))
+
+        # A second bulk award does not duplicate anything for a unique badge.
+        results = dict(badge.award_to_many(awardees))
+        eq_(None, results[deferred_email])
+        eq_(7, Award.objects.filter(badge=badge).count())
+        eq_(1, DeferredAward.objects.filter(email=deferred_email).count())
+
+    def test_award_to_many_not_allowed(self):
+        """Bulk award requires the same permission as award_to"""
+        badge = self._get_badge()
+        stranger = self._get_user(username='stranger')
+        awardee = self._get_user(username='awardee')
+        self.assertRaises(BadgeAwardNotAllowedException,
+                          lambda: badge.award_to_many([awardee],
+                                                      awarder=stranger))
+        ok_(not badge.is_awarded_to(awardee))
+
+    def test_badges_were_awarded(self):
+        """Awards and the awards they unlock arrive in one batch signal"""
+        badge = self._get_badge()
+        dep_badge = self._get_badge(title="Dependent Badge")
+        dep_badge.prerequisites.add(badge)
+        users = [self._get_user(username='batch_%s' % idx)
+                 for idx in range(3)]
+
+        batches, singles = [], []
+
+        def on_batch(sender, awards, **kwargs):
+            batches.append(awards)
+
+        def on_single(sender, award, **kwargs):
+            singles.append(award)
+
+        badges_were_awarded.connect(on_batch)
+        badge_was_awarded.connect(on_single)
+        try:
+            badge.award_to_many(users)
+            eq_(1, len(batches))
+            eq_(sorted((u.pk, b.pk) for u in users
+                       for b in (badge, dep_badge)),
+                sorted((a.user_id, a.badge_id) for a in batches[0]))
+            eq_(6, len(singles))
+
+            # A single award, and its cascade, make a batch too.
+            with patch_settings(BADGER_PER_AWARD_SIGNALS=False):
+                badge.award_to(self._get_user(username='batch_single'))
+            eq_(2, len(batches))
+            eq_(set([badge.pk, dep_badge.pk]),
+                set(a.badge_id for a in batches[1]))
+            eq_(6, len(singles))
+        finally:
+            badges_were_awarded.disconnect(on_batch)
+            badge_was_awarded.disconnect(on_single)
+
+    def test_signal_stats(self):
+        """Signal receivers are timed and counted when enabled"""
+        badge = self._get_badge(unique=False)
+        user = self._get_user()
+
+        def timed_receiver(sender, award, **kwargs):
+            pass
+
+        def failing_receiver(sender, award, **kwargs):
+            raise ValueError('oops')
+
+        signal_stats.reset()
+        badge_was_awarded.connect(timed_receiver)
+        try:
+            badge.award_to(user)
+            eq_([], signal_stats.snapshot())
+
+            signal_stats.enabled = True
+            badge.award_to(user)
+            badge.award_to(user)
+            badge_was_awarded.connect(failing_receiver)
+            self.assertRaises(ValueError, lambda: badge.award_to(user))
+        finally:
+            signal_stats.enabled = None
+            badge_was_awarded.disconnect(timed_receiver)
+            badge_was_awarded.disconnect(failing_receiver)
+
+        rows = dict(((row['signal'], row['receiver'].split('.')[-1]), row)
+                    for row in signal_stats.snapshot())
+        row = rows[('badge_was_awarded', 'timed_receiver')]
+        eq_((3, 0), (row['calls'], row['errors']))
+        ok_(0 <= row['max'] <= row['total'])
+        row = rows[('badge_was_awarded', 'failing_receiver')]
+        eq_((1, 1), (row['calls'], row['errors']))
+
+        # Published counts show up in the management command.
+        signal_stats.publish()
+        out = StringIO()
+        call_command('badger_stats', reset=True, stdout=out)
+        ok_('failing_receiver' in out.getvalue())
+        eq_([], signal_stats.snapshot())
+
+    def test_stats_publish(self):
+        """Counts published by separate processes add up, once due"""
+        first, second = CacheStats(), CacheStats()
+        first.reset()
+        first.record('test', True)
+        second.record('test', False)
+        second.record('test', True)
+        with patch_settings(BADGER_STATS_PUBLISH_INTERVAL=3600):
+            first.publish_due()
+            eq_(dict(), first.shared.totals())
+        first.publish()
+        second.publish()
+        eq_(dict(test=[2, 1]), second.shared.totals())
+        eq_(2 / 3.0, CacheStats().hit_ratio('test'))
+        first.reset()
+
+    def test_award_counters(self):
+        """Award counters follow awards and deferred awards around"""
+        badge = self._get_badge()
+        users = [self._get_user(username='counted_%s' % idx)
+                 for idx in range(3)]
+
+        def counts():
+            b = Badge.objects.get(pk=badge.pk)
+            return ((b.award_count, b.deferred_award_count),
+                    [UserAwardCount.objects.count_for(u) for u in users])
+
+        award = badge.award_to(users[0])
+        badge.award_to_many(users[1:] + ['counted@example.com'])
+        eq_(((3, 1), [1, 1, 1]), counts())
+
+        # Saving a stale badge leaves the counters alone.
+        badge.description = 'Counted'
+        badge.save()
+        eq_(((3, 1), [1, 1, 1]), counts())
+
+        award.hidden = True
+        award.save()
+        eq_(((2, 1), [0, 1, 1]), counts())
+        award.save()
+        eq_(((2, 1), [0, 1, 1]), counts())
+        award.hidden = False
+        award.save()
+        eq_(((3, 1), [1, 1, 1]), counts())
+        award.delete()
+        eq_(((2, 1), [0, 1, 1]), counts())
+
+        badge.generate_deferred_awards(user=badge.creator, amount=5)
+        eq_(((2, 6), [0, 1, 1]), counts())
+        DeferredAward.objects.get(email='counted@example.com').delete()
+        eq_(((2, 5), [0, 1, 1]), counts())
+
+        # Counters that drift get repaired.
+        Badge.objects.filter(pk=badge.pk).update(award_count=42)
+        UserAwardCount.objects.filter(user=users[1]).delete()
+        call_command('badger_recount', verbosity=0)
+        eq_(((2, 5), [0, 1, 1]), counts())
+
+        # Without leaderboards, the badge isn't needed to count.
+        award = Award.objects.get(badge=badge, user=users[1])
+        award.delete()
+        ok_('_badge_cache' not in award.__dict__)
+        eq_(((1, 5), [0, 0, 1]), counts())
+
+    def test_leaderboards(self):
+        """Leaderboards rank users incrementally as awards change"""
+        badges = [self._get_badge(title='Board %s' % idx)
+                  for idx in range(3)]
+        users = [self._get_user(username='ranked_%s' % idx)
+                 for idx in range(4)]
+
+        def board():
+            return [(e.rank, e.user.username, e.score)
+                    for e in leaderboards.top(10)]
+
+        def state():
+            return (sorted(LeaderboardEntry.objects.filter(score__gt=0)
+                               .values_list('board', 'user', 'score')),
+                    sorted(LeaderboardScore.objects.filter(users__gt=0)
+                               .values_list('board', 'score', 'users')))
+
+        with patch_settings(BADGER_LEADERBOARDS=True):
+            for badge in badges:
+                badge.award_to(users[0])
+            badges[0].award_to_many(users[1:3])
+            award = badges[1].award_to(users[1])
+            badges[1].award_to(users[2])
+
+            eq_([(1, 'ranked_0', 3), (2, 'ranked_1', 2), (2, 'ranked_2', 2)],
+                board())
+            eq_([(2, 'ranked_1', 2), (2, 'ranked_2', 2)],
+                [(e.rank, e.user.username, e.score)
+                 for e in leaderboards.top(5, offset=1)])
+            eq_((2, 2), leaderboards.rank(users[2]))
+            eq_(None, leaderboards.rank(users[3]))
+
+            award.hidden = True
+            award.save()
+            eq_([(1, 'ranked_0', 3), (2, 'ranked_2', 2), (3, 'ranked_1', 1)],
+                board())
+            eq_((3, 1), leaderboards.rank(users[1]))
+
+            award.delete()
+            eq_((3, 1), leaderboards.rank(users[1]))
+
+            # Scores don't go below zero, and neither do users move when
+            # they'd have to.
+            leaderboards.add(badges[0], {users[3].pk: 1})
+            leaderboards.add(badges[0], {users[3].pk: -1})
+            leaderboards.add(badges[0], {users[3].pk: -1})
+            eq_(1, LeaderboardScore.objects.get(board=leaderboards.GLOBAL,
+                                                score=1).users)
+            eq_((3, 1), leaderboards.rank(users[1]))
+
+            # Rebuilding from scratch comes out the same.
+            incremental = state()
+            call_command('badger_rebuild_leaderboards', verbosity=0)
+            eq_(incremental, state())
+
+        eq_([badges[0], badges[1], badges[2]],
+            leaderboards.most_awarded(3))
+        eq_([badges[1]], leaderboards.most_awarded(1, offset=1))
+
+    def test_top_tags(self):
+        """Tag counts are cached until badge tags change"""
+        if not taggit:
+            raise SkipTest('django-taggit is not installed')
+        badges = [self._get_badge(title='Tagged %s' % idx)
+                  for idx in range(3)]
+        for badge in badges:
+            badge.tags.add('common')
+        badges[0].tags.add('rare')
+
+        def top_tags(**kwargs):
+            return [(x['tag'].name, x['count'])
+                    for x in Badge.objects.top_tags(**kwargs)]
+
+        with patch_settings(BADGER_TAG_COUNTS_CACHE_TIMEOUT=60):
+            eq_([('common', 3)], top_tags())
+            eq_([('common', 3), ('rare', 1)], top_tags(min_count=1))
+            with query_budget(self, 0):
+                eq_([('common', 3)], top_tags(min_count=1, limit=1))
+                eq_('rare', Badge.objects.tag_named('rare').name)
+                eq_(None, Badge.objects.tag_named('missing'))
+
+            badges[1].tags.add('rare')
+            eq_([('common', 3), ('rare', 2)], top_tags())
+            badges[2].tags.remove('common')
+            eq_([('common', 2), ('rare', 2)], top_tags())
+            badges[0].delete()
+            eq_([('common', 1), ('rare', 1)], top_tags(min_count=1))
+
+    def test_search(self):
+        """Search matches prefixes of words, ranked by relevance, through an
+        index kept current as badges and awards change"""
+        rocket = self._get_badge(title='Rocket Scientist',
+                                 description='Launched a satellite')
+        launch = self._get_badge(title='Launch Day',
+                                 description='Shipped the rocketry kit')
+        other = self._get_badge(title='Gardener',
+                                description='Grew some tomatoes')
+
+        def search(query, sort='relevance'):
+            return list(Badge.objects.search(query, sort))
+
+        eq_([rocket, launch], search('rocket'))
+        eq_([launch, rocket], search('launch'))
+        eq_([rocket], search('ROCKET scien'))
+        eq_([], search('rocket tomato'))
+        eq_([], search('!!!'))
+        eq_(set([rocket, launch]), set(search('rock', sort='title')))
+
+        other.description = 'Launched some rockets'
+        other.save()
+        # Equal matches come most recently modified first.
+        eq_([rocket, other, launch], search('rocket'))
+        other.delete()
+        eq_([rocket, launch], search('rocket'))
+
+        user = self._get_user()
+        award = rocket.award_to(user, description='For the moon shot')
+        launch.award_to_many([user], description='Moonlight launch')
+        eq_(set([award.description, 'Moonlight launch']),
+            set(a.description for a in Award.objects.search('moon')))
+        award.hidden = True
+        award.save()
+        eq_(['Moonlight launch'],
+            [a.description for a in Award.objects.search('moon')])
+
+        # Rebuilding the index from scratch finds the same.
+        SearchToken.objects.all().delete()
+        call_command('badger_rebuild_search', verbosity=0)
+        eq_([rocket, launch], search('rocket'))
+
+        # Substring matching needs no index.
+        with patch_settings(
+                BADGER_SEARCH_BACKEND='badger.search.IcontainsBackend'):
+            SearchToken.objects.all().delete()
+            eq_(set([rocket, launch]), set(search('ocket')))
+
+    def test_cursor_pagination(self):
+        """Cursors page through awards newest first, unaffected by awards
+        made along the way"""
+        badge = self._get_badge(unique=False)
+        user = self._get_user()
+        awards = [badge.award_to(user) for idx in range(7)]
+        awards.reverse()
+        paginator = CursorPaginator(
+            Award.objects.filter(badge=badge), 3,
+            count=lambda: Badge.objects.get(pk=badge.pk).award_count)
+
+        def pages(cursor, attr='next_cursor'):
+            result = []
+            while cursor is not None or not result:
+                page = paginator.page(cursor)
+                result.append([a.pk for a in page])
+                cursor = getattr(page, attr)
+            return result
+
+        first = paginator.page()
+        ok_(not first.has_previous())
+        eq_([a.pk for a in awards[:3]], [a.pk for a in first])
+
+        badge.award_to(user)
+        eq_([[a.pk for a in awards[3:6]], [awards[6].pk]],
+            pages(first.next_cursor))
+        eq_([[a.pk for a in awards[4:]], [a.pk for a in awards[1:4]]],
+            pages(first.last_cursor, 'previous_cursor')[:2])
+        eq_(8, paginator.count)
+
+        # Not base64, an unknown direction, the wrong number of values, and
+        # JSON objects rather than lists
+        for cursor in ('garbage', 'WyJ4Il0', 'WyJuIiwgIngiLCAxXQ', 'e30',
+                       'eyIwIjogIm4ifQ'):
+            try:
+                paginator.page(cursor)
+                ok_(False, 'Cursor %s should be invalid' % cursor)
+            except InvalidCursor:
+                pass
+
+
+    def test_recipient_hashes(self):
+        """Recipient hashes are stored with awards and kept current"""
+        badge = self._get_badge(unique=False)
+        user = self._get_user()
+        award = badge.award_to(user)
+        award2 = badge.award_to_many([self._get_user('tester2')])[0][1]
+
+        def stored(award):
+            return Award.objects.values_list('salt', 'recipient_hash') \
+                                .get(pk=award.pk)
+
+        for a in (award, award2):
+            eq_(a.make_recipient_hash(), stored(a))
+        eq_([award], list(Award.objects.for_recipient_hash(
+            award.recipient_hash)))
+
+        user.email = 'renamed@example.com'
+        user.save()
+        award = Award.objects.get(pk=award.pk)
+        eq_(award.make_recipient_hash('renamed@example.com'), stored(award))
+        eq_(stored(award)[1], award.as_obi_assertion()['recipient'])
+
+        # Saves that leave the email alone don't touch the awards.
+        user.first_name = 'Tess'
+        # HACK: Django < 1.6 checks whether the row exists before updating
+        with query_budget(self, django.VERSION < (1, 6) and 2 or 1):
+            user.save()
+
+        # Awards from before hashes were stored get them from the command.
+        Award.objects.update(salt='', recipient_hash='')
+        eq_(award.make_recipient_hash(), tuple(
+            award.as_obi_assertion()[k] for k in ('salt', 'recipient')))
+        call_command('badger_backfill_recipient_hashes', verbosity=0)
+        for a in (award, award2):
+            eq_(a.make_recipient_hash(), stored(a))
+
+    def test_publish_assertions(self):
+        """Assertions and badges are published to storage as they change"""
+        storage = publishing.get_storage()
+        badge = self._get_badge(unique=False)
+        user = self._get_user()
+
+        def published(path):
+            return json.loads(storage.open(path).read())
+
+        try:
+            with patch_settings(BADGER_PUBLISH_ASSERTIONS=True):
+                award = badge.award_to(user)
+                award2 = badge.award_to_many([self._get_user('tester2')])[0][1]
+                eq_(award.as_obi_assertion(),
+                    published(publishing.award_path(award.pk)))
+                ok_(storage.exists(publishing.award_path(award2.pk)))
+
+                # Changes to badges and users show up in assertions.
+                badge.title = "Renamed Badge"
+                badge.save()
+                eq_("Renamed Badge",
+                    published(publishing.badge_path(badge.pk))['name'])
+                eq_("Renamed Badge",
+                    published(publishing.award_path(award2.pk))
+                        ['badge']['name'])
+                user.email = 'renamed@example.com'
+                user.save()
+                award = Award.objects.get(pk=award.pk)
+                eq_(award.as_obi_assertion()['recipient'],
+                    published(publishing.award_path(award.pk))['recipient'])
+                ok_(publishing.award_url(award).endswith(
+                    publishing.award_path(award.pk)))
+                # Files are replaced by renaming, leaving nothing behind.
+                eq_([], [name for name in storage.listdir(
+                    publishing.AWARDS_DIR)[1] if name.startswith('.')])
+
+                # Changes users don't see in assertions leave them be.
+                storage.delete(publishing.award_path(award.pk))
+                user.first_name = 'Tess'
+                user.save()
+                ok_(not storage.exists(publishing.award_path(award.pk)))
+
+                # Changes during a request are published at its end.
+                publishing.pending_changes.begin_request()
+                try:
+                    badge.title = "Requested Badge"
+                    badge.save()
+                    ok_(not storage.exists(publishing.award_path(award.pk)))
+                finally:
+                    publishing.pending_changes.flush()
+                eq_("Requested Badge",
+                    published(publishing.award_path(award.pk))
+                        ['badge']['name'])
+
+                award2.delete()
+                ok_(not storage.exists(publishing.award_path(award2.pk)))
+                award.hidden = True
+                award.save()
+                ok_(not storage.exists(publishing.award_path(award.pk)))
+
+                # The command publishes everything and prunes the rest.
+                Award.admin_objects.filter(pk=award.pk).update(hidden=False)
+                storage.save(publishing.award_path(99999),
+                             ContentFile('{}'))
+                call_command('badger_publish_assertions', threads=1,
+                             batch=1, verbosity=0)
+                ok_(storage.exists(publishing.award_path(award.pk)))
+                ok_(not storage.exists(publishing.award_path(99999)))
+        finally:
+            shutil.rmtree(storage.path(publishing.BADGES_DIR.split('/')[0]),
+                          ignore_errors=True)
+
+class BadgerOutboxTest(BadgerTestCase):
+
+    def setUp(self):
+        self.awarded = []
+        badge_was_awarded.connect(self._on_awarded)
+
+    def tearDown(self):
+        badge_was_awarded.disconnect(self._on_awarded)
+        outbox.handlers.pop('test.fail', None)
+
+    def _on_awarded(self, sender, award, **kwargs):
+        self.awarded.append(award.pk)
+
+    def _work(self):
+        call_command('badger_worker', once=True, threads=1, verbosity=0)
+
+    def test_async_award_side_effects(self):
+        """Award side effects wait in the outbox for the worker"""
+        badge = self._get_badge()
+        dep_badge = self._get_badge(title="Dependent Badge")
+        dep_badge.prerequisites.add(badge)
+        user = self._get_user()
+
+        with patch_settings(BADGER_ASYNC_SIDE_EFFECTS=True):
+            award = badge.award_to(awardee=user)
+            da = badge.award_to(email='nobody_yet@example.com')
+
+            eq_([], self.awarded)
+            ok_(not dep_badge.is_awarded_to(user))
+            eq_(0, len(mail.outbox))
+            eq_(4, OutboxMessage.objects.count())
+
+            self._work()
+
+        dep_award = Award.objects.get(badge=dep_badge, user=user)
+        eq_([award.pk, dep_award.pk], self.awarded)
+        eq_(1, len([m for m in mail.outbox if da.email in m.to]))
+        eq_(0, OutboxMessage.objects.count())
+
+    def test_outbox_retries(self):
+        """Failed outbox messages are retried later, and deduplicated"""
+        def fail(object_ids, done):
+            raise Exception('Nope')
+        outbox.handler('test.fail')(fail)
+
+        outbox.enqueue('test.fail', [1, 2])
+        outbox.enqueue('test.fail', [2, 3])
+        eq_(3, OutboxMessage.objects.count())
+
+        eq_(3, outbox.process_batch(threads=1))
+        for message in OutboxMessage.objects.all():
+            eq_(1, message.attempts)
+            ok_('Nope' in message.last_error)
+            ok_(message.available_at > timezone.now())
+
+        # Not due again yet.
+        eq_(0, outbox.process_batch(threads=1))
+
+        # Once fixed, the messages get handled and cleared.
+        outbox.handler('test.fail')(lambda object_ids, done: None)
+        OutboxMessage.objects.update(available_at=timezone.now())
+        eq_(3, outbox.process_batch(threads=1))
+        eq_(0, OutboxMessage.objects.count())
+
+    def test_outbox_enqueue_exhausted(self):
+        """Enqueueing a message out of attempts starts it over"""
+        handled = []
+        outbox.handler('test.fail')(
+            lambda object_ids, done: handled.extend(object_ids))
+
+        outbox.enqueue('test.fail', [1])
+        OutboxMessage.objects.update(
+            attempts=badger.settings.OUTBOX_MAX_ATTEMPTS, last_error='Nope')
+        eq_(0, outbox.process_batch(threads=1))
+
+        outbox.enqueue('test.fail', [1, 2])
+        message = OutboxMessage.objects.get(object_id=1)
+        eq_(0, message.attempts)
+        eq_('', message.last_error)
+        eq_(2, outbox.process_batch(threads=1))
+        eq_([1, 2], sorted(handled))
+        eq_(0, OutboxMessage.objects.count())
+
+    def test_outbox_partial_failure(self):
+        """Objects a handler is done with aren't handled again when another
+        in the batch fails"""
+        handled = []
+        def partly_fail(object_ids, done):
+            for object_id in object_ids:
+                if object_id == 2:
+                    raise Exception('Nope')
+                handled.append(object_id)
+                done(object_id)
+        outbox.handler('test.fail')(partly_fail)
+
+        outbox.enqueue('test.fail', [1, 2, 3])
+        eq_(3, outbox.process_batch(threads=1))
+        # 1 was done before the failure, and 3 once retried on its own.
+        eq_([1, 3], handled)
+        message = OutboxMessage.objects.get()
+        eq_(2, message.object_id)
+        eq_(1, message.attempts)
+
+    def test_outbox_enqueue_in_flight(self):
+        """Enqueueing a message being handled has it handled again"""
+        handled = []
+        def enqueue_again(object_ids, done):
+            handled.extend(object_ids)
+            if len(handled) == 1:
+                outbox.enqueue('test.fail', object_ids)
+        outbox.handler('test.fail')(enqueue_again)
+
+        outbox.enqueue('test.fail', [1])
+        eq_(1, outbox.process_batch(threads=1))
+        message = OutboxMessage.objects.get()
+        eq_(None, message.locked_until)
+        eq_(1, outbox.process_batch(threads=1))
+        eq_([1, 1], handled)
+        eq_(0, OutboxMessage.objects.count())
+
 
 class BadgerOBITest(BadgerTestCase):
 
@@ -155,6 +829,100 @@ class BadgerOBITest(BadgerTestCase):
                 award_1.delete()
 
 
+    def test_bake_png_chunks(self):
+        """Baking adds a text chunk, leaving the rest of the PNG as it was"""
+        img_data = open(BADGE_IMG_FN, 'rb').read()
+        url = 'http://example.com/award/1.json'
+        baked = baking.bake(img_data, url)
+        eq_(url, baking.unbake(baked))
+        eq_(None, baking.unbake(img_data))
+
+        # Other chunks are copied as they were, and PIL can read the result.
+        def chunks(data):
+            return [data[start:end] for chunk_type, start, end
+                    in baking.iter_chunks(data) if chunk_type != 'tEXt']
+        eq_(chunks(img_data), chunks(baked))
+        img = Image.open(StringIO(baked))
+        img.load()
+        eq_(url, img.info['openbadges'])
+
+        # Baking again replaces the value, in international text if needed.
+        rebaked = baking.bake(baked, u'http://example.com/\u2603.json')
+        eq_(u'http://example.com/\u2603.json', baking.unbake(rebaked))
+        eq_(1, len([c for c in baking.iter_chunks(rebaked)
+                    if c[0] in baking.TEXT_CHUNKS]))
+
+        for bad in ('GIF89a', img_data[:-20]):
+            try:
+                baking.bake(bad, url)
+                ok_(False, 'Baking should fail')
+            except baking.BakingError:
+                pass
+
+    def test_badge_image_cache(self):
+        """Badge images are read once for a batch of bakes, and again once
+        changed"""
+        img_data = open(BADGE_IMG_FN, 'rb').read()
+        badge = self._get_badge(title="Badge with Image")
+        badge.image.save('', ContentFile(img_data), True)
+        users = [self._get_user(username='awardee_%s' % idx)
+                 for idx in range(3)]
+
+        reads = []
+        read_image = Badge.read_image
+        def counted_read_image(self):
+            reads.append(self.pk)
+            return read_image(self)
+
+        image_cache.clear()
+        Badge.read_image = counted_read_image
+        try:
+            with patch_settings(BADGER_BAKE_AWARD_IMAGES=True):
+                for user in users[:2]:
+                    award = badge.award_to(awardee=user)
+                    eq_('%s%s' % (BASE_URL, reverse(
+                            'badger.award_detail_json',
+                            args=(badge.slug, award.pk))),
+                        baking.unbake(award.image.read()))
+                eq_([badge.pk], reads)
+
+                # A new image is read afresh, and the old one dropped.
+                old_key = badge.image_cache_key()
+                eq_([old_key], [key for key, kind in image_cache._entries])
+                badge.image.save('', ContentFile(img_data), True)
+                eq_([], list(image_cache._entries))
+                badge.award_to(awardee=users[2])
+                eq_([badge.pk, badge.pk], reads)
+
+                badge.delete()
+                eq_(0, image_cache.size)
+        finally:
+            Badge.read_image = read_image
+
+    def test_image_cache_budget(self):
+        """The least recently used images are dropped to stay in budget"""
+        cache = ImageCache()
+        built = []
+        def get(pk):
+            return cache.get((pk, 'image.png'), 'png',
+                             lambda: built.append(pk) or 'x' * 10)
+
+        with patch_settings(BADGER_IMAGE_CACHE_SIZE=25):
+            get(1), get(2), get(1), get(3)
+            eq_([1, 2, 3], built)
+            eq_(20, cache.size)
+            # 2 was least recently used, so it's gone.
+            get(1), get(3), get(2)
+            eq_([1, 2, 3, 2], built)
+
+            # Too big to keep at all
+            cache.get((4, 'big.png'), 'png', lambda: 'x' * 30)
+            eq_(20, cache.size)
+
+        with patch_settings(BADGER_IMAGE_CACHE_SIZE=0):
+            get(2)
+            eq_([1, 2, 3, 2, 2], built)
+
 class BadgerProgressTest(BadgerTestCase):
 
     def test_progress_badge_already_awarded(self):
@@ -175,6 +943,81 @@ class BadgerProgressTest(BadgerTestCase):
         # None, because award deletes progress.
         eq_(0, Progress.objects.filter(badge=b, user=user).count())
 
+    def test_increment_is_atomic(self):
+        """Increments through stale records should not be lost"""
+        user = self._get_user()
+        b = self._get_badge(title='Counted', creator=user)
+
+        p1 = b.progress_for(user)
+        p2 = b.progress_for(user)
+        p1.increment_by(5)
+        p2.increment_by(3)
+        eq_(8, p2.counter)
+        p1.decrement_by(2)
+        eq_(6, p1.counter)
+
+        eq_(1, Progress.objects.filter(badge=b, user=user).count())
+        eq_(6, b.progress_for(user).counter)
+
+    def test_increment_goal_awards(self):
+        """Reaching the goal through increments should auto-award"""
+        user = self._get_user()
+        b = self._get_badge(title='Counted', creator=user)
+
+        p = b.progress_for(user).increment_by(150, goal=200)
+        eq_(75, p.percent)
+        ok_(not b.is_awarded_to(user))
+
+        b.progress_for(user).increment_by(50, goal=200)
+        ok_(b.is_awarded_to(user))
+        eq_(0, Progress.objects.filter(badge=b, user=user).count())
+
+    def test_increment_saves_changed_fields(self):
+        """Increments save a percent or notes set beforehand, and auto-award
+        at 100 percent without a goal, as saving does"""
+        user = self._get_user()
+        b = self._get_badge(title='Counted', creator=user)
+
+        p = b.progress_for(user)
+        p.notes = dict(words=['alpha'])
+        p.percent = 40
+        p.increment_by(1)
+        p = b.progress_for(user)
+        eq_(dict(words=['alpha']), p.notes)
+        eq_(40, p.percent)
+        eq_(1, p.counter)
+
+        with patch_settings(BADGER_PROGRESS_FLUSH_INTERVAL=3600):
+            p.percent = 100
+            p.increment_by(1)
+        ok_(b.is_awarded_to(user))
+        eq_(0, Progress.objects.filter(badge=b, user=user).count())
+
+    def test_buffered_increments(self):
+        """Buffered increments should be coalesced and written on flush"""
+        user = self._get_user()
+        other = self._get_user(username='other')
+        b = self._get_badge(title='Counted', creator=user)
+
+        with patch_settings(BADGER_PROGRESS_FLUSH_INTERVAL=3600):
+            p_user, p_other = b.progress_for(user), b.progress_for(other)
+            with awarded_badges.scope():
+                ok_(not b.is_awarded_to(user))
+                ok_(not b.is_awarded_to(other))
+                with query_budget(self, 0):
+                    for i in range(10):
+                        p_user.increment_by(1, goal=15)
+                        p_other.increment_by(2, goal=15)
+            eq_(0, Progress.objects.filter(badge=b).count())
+            eq_(10, b.progress_for(user).counter)
+
+            progress_buffer.flush()
+
+        eq_(10, b.progress_for(user).counter)
+        eq_(0, Progress.objects.filter(badge=b, user=other).count())
+        ok_(b.is_awarded_to(other))
+        ok_(not b.is_awarded_to(user))
+
 
 class BadgerDeferredAwardTest(BadgerTestCase):
 
@@ -408,6 +1251,54 @@ class BadgerDeferredAwardTest(BadgerTestCase):
             # Assert that the claim group is gone, and now there's one less.
             eq_(num_groups - 1, len(badge1.claim_groups))
 
+    def test_generate_claim_code_collisions(self):
+        """Generating claim codes should replace ones already in use"""
+        creator = self._get_user()
+        badge = self._get_badge(title="Test A", creator=creator)
+        taken = DeferredAward.objects.create(badge=badge, claim_code='333333')
+
+        codes = iter(['333333', '444444', '333333', '777777', '999999'])
+        orig_make_random_code = badger.models.make_random_code
+        badger.models.make_random_code = lambda: next(codes)
+        try:
+            with query_budget(self, 6):
+                cg, counts = DeferredAward.objects.generate(
+                    badge, creator, amount=3, return_counts=True)
+        finally:
+            badger.models.make_random_code = orig_make_random_code
+
+        eq_(dict(created=3, regenerated=1), counts)
+        eq_(set(['444444', '777777', '999999']),
+            set(DeferredAward.objects.filter(claim_group=cg)
+                                     .values_list('claim_code', flat=True)))
+        eq_(taken.pk, DeferredAward.objects.get(claim_code='333333').pk)
+
+    def test_claim_tokens(self):
+        """Signed claim tokens can be minted and verified without the DB"""
+        creator = self._get_user()
+        other = self._get_user(username='other')
+        badge = self._get_badge(title="Test A", creator=creator)
+
+        self.assertRaises(BadgeDeferredAwardManagementNotAllowedException,
+                          lambda: badge.mint_claim_tokens(other, amount=10))
+
+        tokens = badge.mint_claim_tokens(creator, amount=1000,
+                                         claim_group=1234)
+        with query_budget(self, 0):
+            tokens = list(tokens)
+            codes = set(t.claim_code for t in tokens)
+            eq_(1000, len(codes))
+            for code in list(codes)[:10]:
+                ok_(len(code) <= 32)
+                ok_(is_token(code))
+                ok_(not is_token(make_random_code()))
+                eq_(badge.pk, parse_token(code)[0])
+                eq_(1234, parse_token(code)[1])
+                eq_(None, parse_token(code[:-1] + '!'))
+                eq_(None, parse_token(code.replace('-', '-1', 1)))
+        eq_(tokens[10].serial, parse_token(tokens[10].claim_code)[2])
+        eq_(0, DeferredAward.objects.count())
+
     def test_deferred_award_unique_duplication(self):
         """Only one deferred award for a unique badge can be created"""
         deferred_email = 'winner@example.com'
@@ -448,6 +1339,62 @@ class BadgerDeferredAwardTest(BadgerTestCase):
         eq_(2, DeferredAward.objects.filter(email=deferred_email).count())
         eq_(1, len(mail.outbox))
 
+    def test_batched_claim_invitations(self):
+        """Claim invitations go out in batches over one connection"""
+        user = self._get_user()
+        b = Badge.objects.create(slug='batched', title='Batched',
+                                 creator=user)
+        emails = ['winner%s@example.com' % idx for idx in range(5)]
+        with patch_settings(BADGER_MAIL_BATCH_SIZE=2):
+            b.award_to_many(emails, awarder=user)
+        eq_(sorted(emails), sorted(m.to[0] for m in mail.outbox))
+        for msg in mail.outbox:
+            da = DeferredAward.objects.get(email=msg.to[0])
+            ok_(da.get_claim_url() in msg.body)
+            ok_('\n' not in msg.subject)
+
+        batches = []
+
+        class Connection(object):
+            def open(self):
+                batches.append([])
+                return True
+
+            def send_messages(self, messages):
+                batches[-1].append(len(messages))
+                return len(messages)
+
+            def close(self):
+                pass
+
+        deferreds = DeferredAward.objects.filter(badge=b)
+        with patch_settings(BADGER_MAIL_BATCH_SIZE=2):
+            eq_(5, send_claim_invitations(deferreds, Connection()))
+        eq_([[2, 2, 1]], batches)
+
+    def test_claim_invitations_mail_down(self):
+        """Awards aren't held up or undone by the mail server"""
+        user = self._get_user()
+        awardee = self._get_user(username='awardee')
+        b = Badge.objects.create(slug='mail-down', title='Mail down',
+                                 creator=user)
+        UnreachableEmailBackend.opened = 0
+        with patch_settings(EMAIL_BACKEND='badger.tests.test_models.'
+                                          'UnreachableEmailBackend'):
+            b.award_to_many([awardee], awarder=user)
+            eq_(0, UnreachableEmailBackend.opened)
+
+            b.award_to_many(['nobody_yet@example.com'], awarder=user)
+            eq_(1, UnreachableEmailBackend.opened)
+        ok_(b.is_awarded_to(awardee))
+        eq_(1, DeferredAward.objects.filter(badge=b).count())
+
+    def test_missing_template_not_cached(self):
+        """Templates missing once are looked for again"""
+        name = 'badger/missing_invitation.txt'
+        eq_(None, badger_mail.compiled_template(name))
+        ok_(name not in badger_mail._templates)
+
 
 class BadgerMultiplayerBadgeTest(BadgerTestCase):
 
@@ -22,12 +22,15 @@ except ImportError:
     from django.core.urlresolvers import reverse
     get_url_prefix = None
 
-from . import BadgerTestCase
+from . import (BadgerTestCase, patch_settings, query_budget,
+                view_query_budget)
 
 from badger.models import (Badge, Award, Nomination, Progress, DeferredAward,
         NominationApproveNotAllowedException,
         NominationAcceptNotAllowedException,
         BadgeAwardNotAllowedException)
+from badger.autocomplete import prefix_index
+from badger.stats import cache_stats
 from badger.utils import get_badge, award_badge
 
 
@@ -106,6 +109,76 @@ class BadgerViewsTest(BadgerTestCase):
         eq_('http://testserver%s' % award.badge.get_absolute_url(),
             data['badge']['criteria'])
 
+    @attr('json')
+    def test_obi_json_cached(self):
+        """OBI JSON is served from the cache until what it shows changes"""
+        user = self._get_user()
+        user2 = self._get_user(username='tester2')
+        b1 = Badge.objects.create(creator=user, title="Code Badge #1")
+        award = b1.award_to(user2, awarder=user)
+        url = reverse('badger.award_detail_json', args=(b1.slug, award.pk,))
+        badge_url = reverse('badger.detail_json', args=(b1.slug, ))
+
+        cache_stats.reset()
+        r = self.client.get(url)
+        eq_(200, r.status_code)
+        with query_budget(self, 2):
+            eq_(r.content, self.client.get(url).content)
+        eq_(0.5, cache_stats.hit_ratio('obi_assertion'))
+
+        # Changes to the badge, the award and users show up right away.
+        b1.title = "Renamed Badge"
+        b1.save()
+        data = json.loads(self.client.get(url).content)
+        eq_("Renamed Badge", data['badge']['name'])
+        user.email = 'renamed@example.com'
+        user.save()
+        data = json.loads(self.client.get(url).content)
+        eq_('renamed@example.com', data['badge']['issuer']['contact'])
+        data = json.loads(self.client.get(badge_url).content)
+        eq_('renamed@example.com', data['issuer']['contact'])
+        old_recipient = json.loads(self.client.get(url).content)
+        user2.email = 'other@example.com'
+        user2.save()
+        ok_(old_recipient['recipient'] !=
+            json.loads(self.client.get(url).content)['recipient'])
+
+        # Logging in doesn't change anything shown.
+        self.client.login(username='tester2', password='trustno1')
+        self.client.get(url)
+        eq_(3 / 7.0, cache_stats.hit_ratio('obi_assertion'))
+        cache_stats.reset()
+
+    @attr('json')
+    def test_awards_by_recipient(self):
+        """Verifiers can look up awards by recipient hash"""
+        user = self._get_user()
+        user2 = self._get_user(username='tester2')
+        b1 = Badge.objects.create(creator=user, title="Code Badge #1")
+        award = b1.award_to(user2)
+        b1.award_to(user)
+        url = reverse('badger.awards_by_recipient')
+
+        with query_budget(self, 1):
+            r = self.client.get(url, dict(hash=award.recipient_hash))
+        eq_(200, r.status_code)
+        data = json.loads(r.content)
+        eq_(award.recipient_hash, data['recipient'])
+        eq_(['http://testserver%s' % reverse('badger.award_detail_json',
+                                             args=(b1.slug, award.pk))],
+            [a['assertion'] for a in data['awards']])
+
+        data = json.loads(self.client.get(
+            url, dict(hash='sha256$%s' % ('0' * 64))).content)
+        eq_([], data['awards'])
+
+        # Awards without hashes yet aren't found by a missing or empty one.
+        Award.objects.update(recipient_hash='')
+        for params in (dict(), dict(hash=''), dict(hash='sha256$0'),
+                       dict(hash=award.recipient_hash.upper())):
+            eq_(400, self.client.get(url, params).status_code)
+        eq_(0, Award.objects.for_recipient_hash('').count())
+
     def test_awards_by_user(self):
         """Can view awards by user"""
         user = self._get_user()
@@ -128,6 +201,55 @@ class BadgerViewsTest(BadgerTestCase):
         for b in (b1, b2, b3):
             eq_(1, doc.find('.badge .title:contains("%s")' % b.title).length)
 
+    def test_cursor_pagination(self):
+        """Can page through awards by cursor"""
+        user = self._get_user()
+        user2 = self._get_user(username='tester2')
+        badges = [Badge.objects.create(creator=user, title="Code Badge #%s" % idx)
+                  for idx in range(5)]
+        for badge in badges:
+            badge.award_to(user2)
+
+        base_url = url = reverse('badger.views.awards_by_user',
+                                 args=(user2.username,))
+        titles = []
+        with patch_settings(BADGER_CURSOR_PAGINATION=True,
+                            BADGER_BADGE_PAGE_SIZE=2):
+            while url:
+                r = self.client.get(url)
+                eq_(200, r.status_code)
+                doc = pq(r.content)
+                titles.append([pq(e).text() for e in doc.find('.badge .title')])
+                next_link = doc.find('.pagination .next a').attr('href')
+                url = next_link and '%s%s' % (base_url, next_link)
+            eq_([["Code Badge #4", "Code Badge #3"],
+                 ["Code Badge #2", "Code Badge #1"], ["Code Badge #0"]], titles)
+
+            for cursor in ('garbage', 'e30'):
+                r = self.client.get(base_url, dict(cursor=cursor))
+                eq_(404, r.status_code)
+            r = self.client.get(reverse('badger.awards_list'))
+            eq_(5, pq(r.content).find('.award').length)
+
+    @view_query_budget(4)
+    def test_listing_query_budget(self):
+        """Listings take the same few queries however many awards they show"""
+        user = self._get_user()
+        users = [self._get_user(username='tester%s' % idx) for idx in range(8)]
+        for idx in range(8):
+            badge = Badge.objects.create(creator=user,
+                                         title="Code Badge #%s" % idx)
+            badge.award_to_many(users)
+
+        for url in (reverse('badger.badges_list'),
+                    reverse('badger.awards_list'),
+                    reverse('badger.detail', args=(badge.slug,)),
+                    reverse('badger.views.awards_by_badge',
+                            args=(badge.slug,)),
+                    reverse('badger.views.awards_by_user',
+                            args=(users[0].username,))):
+            eq_(200, self.client.get(url).status_code)
+
     def test_awards_by_badge(self):
         """Can view awards by badge"""
         user = self._get_user()
@@ -149,6 +271,78 @@ class BadgerViewsTest(BadgerTestCase):
             eq_(1, doc.find('.award .user:contains("%s")' % u.username)
                       .length)
 
+    def test_leaderboard(self):
+        """Can view the leaderboard of users and badges"""
+        user = self._get_user()
+        b1 = Badge.objects.create(creator=user, title="Code Badge #1")
+        b2 = Badge.objects.create(creator=user, title="Code Badge #2")
+        u1 = self._get_user(username='tester1')
+        u2 = self._get_user(username='tester2')
+
+        with patch_settings(BADGER_LEADERBOARDS=True):
+            b1.award_to_many([u1, u2])
+            b2.award_to(u2)
+
+            self.client.login(username='tester1', password='trustno1')
+            r = self.client.get(reverse('badger.leaderboard'))
+        eq_(200, r.status_code)
+        doc = pq(r.content)
+
+        eq_(['tester2', 'tester1'],
+            [pq(e).text() for e in doc.find('.top_earners .username')])
+        eq_(['1', '2'], [pq(e).text() for e in doc.find('.top_earners .rank')])
+        eq_('2', doc.find('.your_rank .rank').text())
+        eq_([b1.title, b2.title],
+            [pq(e).text() for e in doc.find('.most_awarded .title')])
+
+    def test_search(self):
+        """Can search badges, best matches first"""
+        user = self._get_user()
+        Badge.objects.create(creator=user, title="Night Owl",
+                             description="Coded past midnight")
+        Badge.objects.create(creator=user, title="Code Reviewer")
+        Badge.objects.create(creator=user, title="Gardener")
+
+        r = self.client.get(reverse('badger.badges_list'), dict(q='code'))
+        eq_(200, r.status_code)
+        doc = pq(r.content)
+        eq_(['Code Reviewer', 'Night Owl'],
+            [pq(e).text() for e in doc.find('.badges .title')])
+
+    def test_autocomplete(self):
+        """Can autocomplete badge titles and slugs, cacheably"""
+        user = self._get_user()
+        Badge.objects.create(creator=user, title="Code Reviewer")
+        Badge.objects.create(creator=user, title="Night Owl",
+                             slug="coder-at-night")
+        Badge.objects.create(creator=user, title="Gardener")
+        url = reverse('badger.autocomplete')
+
+        r = self.client.get(url, dict(q='CO'))
+        eq_(200, r.status_code)
+        ok_('max-age' in r['Cache-Control'])
+        data = json.loads(r.content)
+        eq_(['Code Reviewer', 'Night Owl'],
+            [x['label'] for x in data['results']])
+        eq_(reverse('badger.detail', args=('coder-at-night',)),
+            data['results'][1]['url'])
+
+        with query_budget(self, 0):
+            eq_(1, len(prefix_index.complete('co', limit=1)))
+        eq_([], json.loads(self.client.get(
+            url, dict(q='co', kind='tag')).content)['results'])
+
+        r = self.client.get(url, dict(q='CO'), HTTP_IF_NONE_MATCH=r['ETag'])
+        eq_(304, r.status_code)
+
+        # Changing a badge changes the completions.
+        Badge.objects.filter(title="Gardener").get().delete()
+        Badge.objects.create(creator=user, title="Cook")
+        r = self.client.get(url, dict(q='CO'), HTTP_IF_NONE_MATCH=r['ETag'])
+        eq_(200, r.status_code)
+        eq_(['Code Reviewer', 'Night Owl', 'Cook'],
+            [x['label'] for x in json.loads(r.content)['results']])
+
     def test_award_detail_includes_nomination(self):
         """Nomination should be included in award detail"""
         creator = self._get_user(username="creator", email="creator@example.com")
@@ -380,6 +574,47 @@ class BadgerViewsTest(BadgerTestCase):
                             args=(award.badge.slug, award.pk))
         ok_(award_url in r['Location'])
 
+    def test_claim_token(self):
+        """Signed claim tokens can be viewed and claimed once"""
+        user1 = self._get_user(username="creator", email="creator@example.com")
+        user2 = self._get_user(username="awardee", email="a@example.com")
+        b1 = Badge.objects.create(creator=user1, unique=False,
+                                  title="Badge for tokens")
+        token = list(b1.mint_claim_tokens(user1, amount=2))[1]
+        url = token.get_claim_url()
+
+        # Tampered tokens are turned away before the DB is consulted.
+        forged = token.claim_code[:-1] + (
+            token.claim_code.endswith('a') and 'b' or 'a')
+        with query_budget(self, 0):
+            r = self.client.get(reverse('badger.views.claim_deferred_award',
+                                        args=(forged,)), follow=False)
+        eq_(404, r.status_code)
+
+        r = self.client.get(url, follow=False)
+        eq_(200, r.status_code)
+
+        self.client.login(username="awardee", password="trustno1")
+        r = self.client.get(url, follow=False)
+        eq_(200, r.status_code)
+        eq_(1, pq(r.content)('form#claim_award').length)
+        r = self.client.post(reverse('badger.views.claim_deferred_award'),
+                             dict(code=token.claim_code), follow=False)
+        eq_(302, r.status_code)
+        ok_(b1.is_awarded_to(user2))
+
+        # After claim, the token URL leads to the award.
+        award = Award.objects.get(badge=b1, user=user2)
+        eq_(token.claim_code, award.claim_code)
+        r = self.client.get(url, follow=False)
+        eq_(302, r.status_code)
+        ok_(reverse('badger.views.award_detail',
+                    args=(b1.slug, award.pk)) in r['Location'])
+
+        # And can't be claimed again.
+        eq_(None, token.claim(user1))
+        eq_(1, Award.objects.filter(badge=b1).count())
+
     def test_reusable_deferred_award_visit(self):
         """Issue #140: Viewing a claim page for a deferred award that has been
         claimed, yet is flagged as reusable, should result in the claim page
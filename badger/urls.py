@@ -15,6 +15,14 @@ urlpatterns = patterns('badger.views',
         name='badger.badges_list'),
     url(r'^awards/?', 'awards_list',
         name='badger.awards_list'),
+    url(r'^leaderboard/?$', 'leaderboard',
+        name='badger.leaderboard'),
+    url(r'^leaderboard/tag/(?P<tag_name>.+)/?$', 'leaderboard',
+        name='badger.leaderboard'),
+    url(r'^autocomplete/?$', 'autocomplete',
+        name='badger.autocomplete'),
+    url(r'^recipient/awards\.json$', 'awards_by_recipient',
+        name='badger.awards_by_recipient'),
     url(r'^badge/(?P<slug>[^/]+)/awards/?$', 'awards_list',
         name='badger.awards_list_for_badge'),
     url(r'^badge/(?P<slug>[^/]+)/awards/(?P<id>\d+)\.json$', 'award_detail',
@@ -27,6 +35,8 @@ urlpatterns = patterns('badger.views',
     url(r'^badge/(?P<slug>[^/]+)/claims/(?P<claim_group>.+)\.pdf$', 'claims_list',
         kwargs=dict(format='pdf'),
         name='badger.claims_list_pdf'),
+    url(r'^badge/(?P<slug>[^/]+)/claim_tokens/(?P<claim_group>\d+)\.pdf$',
+        'claim_tokens_pdf', name='badger.claim_tokens_pdf'),
     url(r'^badge/(?P<slug>[^/]+)/claims/(?P<claim_group>[^/]+)/?$', 'claims_list',
         name='badger.claims_list'),
     url(r'^claim/(?P<claim_code>[^/]+)/?$', 'claim_deferred_award',
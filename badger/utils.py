@@ -85,6 +85,25 @@ def award_badge(slug_or_badge, awardee, awarder=None):
     return b.award_to(awardee=awardee, awarder=awarder)
 
 
+def award_badge_many(slug_or_badge, awardees, awarder=None, description=''):
+    """Award a badge to many awardees at once, with optional awarder
+
+    :arg slug_or_badge: slug or Badge instance to award
+    :arg awardees: list of Users and / or email addresses to award
+    :arg awarder: User who awarded this Badge
+    :arg description: Explanation and evidence for the awards
+
+    :returns: list of (awardee, result) tuples, see
+        :py:meth:`badger.models.Badge.award_to_many`
+
+    :raise BadgeAwardNotAllowedException: if the awarder is not allowed
+        to award this badge
+
+    """
+    b = get_badge(slug_or_badge)
+    return b.award_to_many(awardees, awarder=awarder, description=description)
+
+
 def get_progress(slug_or_badge, user):
     """Get a progress record for a badge and awardee
 
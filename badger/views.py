@@ -1,13 +1,16 @@
+import hashlib
 import json
 import logging
 import random
 
 from django.conf import settings
 from django.http import (HttpResponseRedirect, HttpResponse,
-        HttpResponseForbidden, HttpResponseNotFound, Http404)
+        HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound,
+        HttpResponseNotModified, Http404)
 from django.shortcuts import get_object_or_404, render
 from django.template import RequestContext
 from django.template.defaultfilters import slugify
+from django.utils.cache import patch_cache_control
 
 try:
     from funfactory.urlresolvers import (get_url_prefix, Prefixer, reverse,
@@ -37,21 +40,26 @@ except ImportError:
     taggit = None
 
 import badger
-from badger import settings as bsettings
-from .models import (Badge, Award, Nomination, DeferredAward,
-                     Progress, BadgeAwardNotAllowedException,
+from badger import leaderboards, pagination, settings as bsettings
+from .models import (Badge, Award, Nomination, DeferredAward, UserAwardCount,
+                     Progress, RECIPIENT_HASH_RE,
+                     BadgeAwardNotAllowedException,
                      BadgeAlreadyAwardedException,
+                     BadgeDeferredAwardManagementNotAllowedException,
                      NominationApproveNotAllowedException,
                      NominationAcceptNotAllowedException)
 from .forms import (BadgeAwardForm, DeferredAwardGrantForm,
                     DeferredAwardMultipleGrantForm, BadgeNewForm,
                     BadgeEditForm, BadgeSubmitNominationForm)
+from .claim_tokens import ClaimToken, is_token
+from .autocomplete import prefix_index, BADGE, TAG
+from .caching import obi_cache
 
 
 def home(request):
     """Badger home page"""
     badge_list = Badge.objects.order_by('-modified').all()[:bsettings.MAX_RECENT]
-    award_list = Award.objects.order_by('-modified').all()[:bsettings.MAX_RECENT]
+    award_list = Award.objects.for_listing().order_by('-modified')[:bsettings.MAX_RECENT]
     badge_tags = Badge.objects.top_tags()
 
     return render(request, '%s/home.html' % bsettings.TEMPLATE_BASE, dict(
@@ -59,7 +67,39 @@ def home(request):
     ))
 
 
-class BadgesListView(ListView):
+def _paginate(request, queryset, count=None, per_page=None):
+    """Context for the page of a listing at ?cursor=, see
+    badger.pagination"""
+    try:
+        return pagination.paginate(request, queryset,
+                                   per_page or bsettings.BADGE_PAGE_SIZE,
+                                   count)
+    except pagination.InvalidCursor:
+        raise Http404
+
+
+class CursorPaginationMixin(object):
+    """Pages a ListView by cursor rather than page number, while
+    BADGER_CURSOR_PAGINATION is enabled"""
+
+    def use_cursor(self):
+        return bsettings.CURSOR_PAGINATION
+
+    def get_count(self):
+        """Number of objects listed, if known without counting"""
+        return None
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_cursor():
+            return super(CursorPaginationMixin, self).paginate_queryset(
+                queryset, page_size)
+        context = _paginate(self.request, queryset, self.get_count(),
+                            page_size)
+        return (context['paginator'], context['page_obj'],
+                context['page_obj'].object_list, context['is_paginated'])
+
+
+class BadgesListView(CursorPaginationMixin, ListView):
     """Badges list page"""
     model = Badge
     template_name = '%s/badges_list.html' % bsettings.TEMPLATE_BASE
@@ -71,13 +111,20 @@ class BadgesListView(ListView):
         query_string = self.request.GET.get('q', None)
         tag_name = self.kwargs.get('tag_name', None)
         if query_string is not None:
-            sort_order = self.request.GET.get('sort', 'created')
+            sort_order = self.request.GET.get('sort', 'relevance')
             qs = Badge.objects.search(query_string, sort_order)
         if taggit and tag_name:
-            tag = get_object_or_404(Tag, name=tag_name)
+            tag = Badge.objects.tag_named(tag_name)
+            if not tag:
+                raise Http404
             qs = (Badge.objects.filter(tags__in=[tag]).distinct())
         return qs
 
+    def use_cursor(self):
+        # Search results are ordered by relevance, which cursors can't follow
+        return (super(BadgesListView, self).use_cursor() and
+                self.request.GET.get('q', None) is None)
+
     def get_context_data(self, **kwargs):
         context = super(BadgesListView, self).get_context_data(**kwargs)
         context['award_list'] = None
@@ -85,10 +132,12 @@ class BadgesListView(ListView):
         context['query_string'] = kwargs.get('q', None)
         if context['query_string'] is not None:
             # TODO: Is this the most efficient query?
-            context['award_list'] = (Award.objects.filter(badge__in=self.get_queryset()))
+            context['award_list'] = (Award.objects.for_listing()
+                                     .filter(badge__in=self.get_queryset()))
         if taggit and context['tag_name']:
             # TODO: Is this the most efficient query?
-            context['award_list'] = (Award.objects.filter(badge__in=self.get_queryset()))
+            context['award_list'] = (Award.objects.for_listing()
+                                     .filter(badge__in=self.get_queryset()))
         return context
 
 badges_list = BadgesListView.as_view()
@@ -101,7 +150,7 @@ def detail(request, slug, format="html"):
     if not badge.allows_detail_by(request.user):
         return HttpResponseForbidden('Detail forbidden')
 
-    awards = (Award.objects.filter(badge=badge)
+    awards = (Award.objects.for_listing().filter(badge=badge)
                            .order_by('-created'))[:bsettings.MAX_RECENT]
 
     # FIXME: This is awkward. It used to collect sections as responses to a
@@ -117,7 +166,11 @@ def detail(request, slug, format="html"):
         if request.POST.get('is_generate', None):
             if not badge.allows_manage_deferred_awards_by(request.user):
                 return HttpResponseForbidden('Claim generate denied')
-            amount = int(request.POST.get('amount', 10))
+            try:
+                amount = int(request.POST.get('amount', 10))
+            except ValueError:
+                amount = 10
+            amount = max(1, min(amount, bsettings.MAX_GENERATE_AMOUNT))
             reusable = (amount == 1)
             cg = badge.generate_deferred_awards(user=request.user,
                                                 amount=amount,
@@ -135,8 +188,7 @@ def detail(request, slug, format="html"):
     claim_groups = badge.claim_groups
 
     if format == 'json':
-        data = badge.as_obi_serialization(request)
-        resp = HttpResponse(json.dumps(data))
+        resp = HttpResponse(obi_cache.badge_json(badge, request))
         resp['Content-Type'] = 'application/json'
         return resp
     else:
@@ -203,7 +255,7 @@ def delete(request, slug):
     if not badge.allows_delete_by(request.user):
         return HttpResponseForbidden()
 
-    awards_count = badge.award_set.count()
+    awards_count = badge.award_count
 
     if request.method == "POST":
         messages.info(request, _(u'Badge "{badgetitle}" deleted.').format(
@@ -231,9 +283,9 @@ def award_badge(request, slug):
         if form.is_valid():
             emails = form.cleaned_data['emails']
             description = form.cleaned_data['description']
-            for email in emails:
-                result = badge.award_to(email=email, awarder=request.user,
-                                        description=description)
+            results = badge.award_to_many(emails, awarder=request.user,
+                                          description=description)
+            for email, result in results:
                 if result:
                     if not hasattr(result, 'claim_code'):
                         messages.info(request, _(u'Award issued to {email}').format(
@@ -249,7 +301,7 @@ def award_badge(request, slug):
     ))
 
 
-class AwardsListView(ListView):
+class AwardsListView(CursorPaginationMixin, ListView):
     model = Award
     template_name = '%s/awards_list.html' % bsettings.TEMPLATE_BASE
     template_object_name = 'award'
@@ -261,11 +313,16 @@ class AwardsListView(ListView):
         return self._badge
 
     def get_queryset(self):
-        qs = Award.objects.order_by('-modified')
+        qs = Award.objects.for_listing().order_by('-modified')
         if self.kwargs.get('slug', None) is not None:
             qs = qs.filter(badge=self.get_badge())
         return qs
 
+    def get_count(self):
+        if self.kwargs.get('slug', None) is not None:
+            return self.get_badge().award_count
+        return None
+
     def get_context_data(self, **kwargs):
         context = super(AwardsListView, self).get_context_data(**kwargs)
         if self.kwargs.get('slug', None) is None:
@@ -286,8 +343,9 @@ def award_detail(request, slug, id, format="html"):
         return HttpResponseForbidden('Award detail forbidden')
 
     if format == 'json':
-        data = json.dumps(award.as_obi_assertion(request))
-        resp = HttpResponse(data)
+        # The badge was just looked up, no need to again.
+        award.badge = badge
+        resp = HttpResponse(obi_cache.assertion_json(award, request))
         resp['Content-Type'] = 'application/json'
         return resp
     else:
@@ -296,6 +354,26 @@ def award_detail(request, slug, id, format="html"):
         ))
 
 
+@require_GET
+def awards_by_recipient(request):
+    """Awards to the recipient identified by ?hash=, the recipient hash from
+    an assertion, as JSON for verifiers"""
+    recipient_hash = request.GET.get('hash', '')
+    if not RECIPIENT_HASH_RE.match(recipient_hash):
+        return HttpResponseBadRequest('Invalid recipient hash')
+    awards = (Award.objects.for_recipient_hash(recipient_hash)
+                           .select_related('badge').order_by('pk'))
+    data = dict(recipient=recipient_hash, awards=[
+        dict(badge=award.badge.slug,
+             assertion=request.build_absolute_uri(
+                 reverse('badger.award_detail_json',
+                         args=(award.badge.slug, award.pk))))
+        for award in awards])
+    resp = HttpResponse(json.dumps(data))
+    resp['Content-Type'] = 'application/json'
+    return resp
+
+
 @require_http_methods(['GET', 'POST'])
 @login_required
 def award_delete(request, slug, id):
@@ -350,6 +428,9 @@ def claim_deferred_award(request, claim_code=None):
     if not claim_code:
         claim_code = request.REQUEST.get('code', '').strip()
 
+    if is_token(claim_code):
+        return _claim_token(request, claim_code)
+
     # Look for any awards that match this claim code.
     awards = Award.objects.filter(claim_code=claim_code)
     awards_ct = awards.count()
@@ -398,6 +479,53 @@ def claim_deferred_award(request, claim_code=None):
     ))
 
 
+def _claim_token(request, claim_code):
+    """Claim view for a signed claim token, see badger.claim_tokens"""
+    # Forged and mistyped tokens get turned away without a DB lookup.
+    token = ClaimToken.from_code(claim_code)
+    if not token:
+        raise Http404('No such claim code, %s' % claim_code)
+
+    # Redeemed tokens act like consumed deferred awards.
+    redemption = token.redemption()
+    if redemption:
+        if redemption.award:
+            return _redirect_to_claimed_awards([redemption.award], 1)
+        raise Http404('No such claim code, %s' % claim_code)
+
+    if request.method == "POST":
+        if request.POST.get('is_grant', False) is not False:
+            return HttpResponseForbidden('Grant denied')
+        return _do_claim(request, token)
+
+    return render(request, '%s/claim_deferred_award.html' % bsettings.TEMPLATE_BASE, dict(
+        badge=token.badge, deferred_award=token, grant_form=None
+    ))
+
+
+@require_GET
+@login_required
+def claim_tokens_pdf(request, slug, claim_group):
+    """Print labels for a range of signed claim tokens in a claim group"""
+    badge = get_object_or_404(Badge, slug=slug)
+    try:
+        amount = int(request.GET.get('amount', 10))
+        start = int(request.GET.get('start', 0))
+    except ValueError:
+        raise Http404('Bad claim token range')
+    amount = max(1, min(amount, bsettings.MAX_GENERATE_AMOUNT))
+
+    try:
+        tokens = badge.mint_claim_tokens(request.user, amount=amount,
+                                         claim_group=int(claim_group),
+                                         start=max(0, start))
+    except BadgeDeferredAwardManagementNotAllowedException:
+        return HttpResponseForbidden()
+
+    from badger.printing import render_claims_to_pdf
+    return render_claims_to_pdf(request, slug, claim_group, tokens)
+
+
 @require_http_methods(['GET', 'POST'])
 @login_required
 def claims_list(request, slug, claim_group, format="html"):
@@ -423,22 +551,95 @@ def claims_list(request, slug, claim_group, format="html"):
 def awards_by_user(request, username):
     """Badge awards by user"""
     user = get_object_or_404(User, username=username)
-    awards = Award.objects.filter(user=user)
-    return render(request, '%s/awards_by_user.html' % bsettings.TEMPLATE_BASE, dict(
-        user=user, award_list=awards,
-    ))
+    awards = Award.objects.for_listing().filter(user=user)
+    context = dict(user=user, award_list=awards,
+                   award_count=UserAwardCount.objects.count_for(user))
+    if bsettings.CURSOR_PAGINATION:
+        context.update(_paginate(request, awards, context['award_count']))
+        context['award_list'] = context['page_obj'].object_list
+    return render(request, '%s/awards_by_user.html' % bsettings.TEMPLATE_BASE,
+                  context)
 
 
 @require_GET
 def awards_by_badge(request, slug):
     """Badge awards by badge"""
     badge = get_object_or_404(Badge, slug=slug)
-    awards = Award.objects.filter(badge=badge)
-    return render(request, '%s/awards_by_badge.html' % bsettings.TEMPLATE_BASE, dict(
-        badge=badge, awards=awards,
+    awards = Award.objects.for_listing().filter(badge=badge)
+    context = dict(badge=badge, awards=awards, award_count=badge.award_count)
+    if bsettings.CURSOR_PAGINATION:
+        context.update(_paginate(request, awards, badge.award_count))
+        context['awards'] = context['page_obj'].object_list
+    return render(request, '%s/awards_by_badge.html' % bsettings.TEMPLATE_BASE,
+                  context)
+
+
+@require_GET
+def leaderboard(request, tag_name=None):
+    """Top earners and most awarded badges, overall or for a tag"""
+    tag_slug = None
+    if taggit and tag_name:
+        tag = Badge.objects.tag_named(tag_name)
+        if not tag:
+            raise Http404
+        tag_slug = tag.slug
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    size = bsettings.BADGE_PAGE_SIZE
+    offset = (page - 1) * size
+
+    top_earners, rank = [], None
+    if bsettings.LEADERBOARDS:
+        top_earners = leaderboards.top(size, offset, tag_slug)
+        if request.user.is_authenticated():
+            rank = leaderboards.rank(request.user, tag_slug)
+    most_awarded = leaderboards.most_awarded(size, offset, tag_slug)
+
+    return render(request, '%s/leaderboard.html' % bsettings.TEMPLATE_BASE, dict(
+        tag_name=tag_name, page=page, top_earners=top_earners, rank=rank,
+        most_awarded=most_awarded,
+        has_next=len(top_earners) == size or len(most_awarded) == size,
     ))
 
 
+@require_GET
+def autocomplete(request):
+    """Badges and tags with a title, slug or name starting with ?q=, as
+    JSON for typeahead. ?kind=badge or ?kind=tag narrows it to one kind."""
+    query = request.GET.get('q', '')
+    kind = request.GET.get('kind', None)
+    kinds = kind in (BADGE, TAG) and [kind] or None
+    try:
+        limit = max(1, int(request.GET.get('limit', 10)))
+    except ValueError:
+        limit = 10
+
+    # Responses only change with the index, so clients and proxies can
+    # revalidate cheaply.
+    index = prefix_index.load()
+    etag = '"%s"' % hashlib.md5(('%s:%s:%s:%s' % (
+        index.version, kind, limit, query)).encode('utf-8')).hexdigest()
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        resp = HttpResponseNotModified()
+    else:
+        results = []
+        for kind, label, slug in index.complete(query, limit, kinds):
+            if kind == BADGE:
+                url = reverse('badger.detail', args=(slug,))
+            else:
+                url = reverse('badger.badges_list',
+                              kwargs=dict(tag_name=label))
+            results.append(dict(kind=kind, label=label, slug=slug, url=url))
+        resp = HttpResponse(json.dumps(dict(query=query, results=results)))
+        resp['Content-Type'] = 'application/json'
+    resp['ETag'] = etag
+    patch_cache_control(resp, public=True,
+                        max_age=bsettings.AUTOCOMPLETE_MAX_AGE)
+    return resp
+
+
 @require_http_methods(['GET', 'POST'])
 @login_required
 def staff_tools(request):
@@ -475,9 +676,12 @@ def badges_by_user(request, username):
     """Badges created by user"""
     user = get_object_or_404(User, username=username)
     badges = Badge.objects.filter(creator=user)
-    return render(request, '%s/badges_by_user.html' % bsettings.TEMPLATE_BASE, dict(
-        user=user, badge_list=badges,
-    ))
+    context = dict(user=user, badge_list=badges)
+    if bsettings.CURSOR_PAGINATION:
+        context.update(_paginate(request, badges))
+        context['badge_list'] = context['page_obj'].object_list
+    return render(request, '%s/badges_by_user.html' % bsettings.TEMPLATE_BASE,
+                  context)
 
 
 @require_http_methods(['GET', 'POST'])